@@ -0,0 +1,432 @@
+"""
+Deferred duplicate actions for Deduplicationator 3000.
+
+Instead of asking about every duplicate group while the scan runs, groups
+are collected into an ActionPlan. The user approves groups in bulk (all,
+by directory or by size) once the scan has finished, and the approved
+groups are then applied in a single pass.
+
+Duplicates are either deleted or replaced by a hardlink or copy-on-write
+clone (FICLONE) of the kept file, so their paths stay usable. An
+ActionRunner applies the chosen action group by group: it checks that the
+files are unchanged since the scan, keeps a hardlinked backup of every
+path it touches, verifies the result and records everything in a journal.
+Backups are dropped only when the run finishes, so an interrupted run can
+be rolled back with rollback_journal().
+"""
+
+import os
+import json
+import errno
+import shutil
+import logging
+from datetime import datetime
+from pathlib import Path
+
+from hash_algorithms import new_hasher
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; reflinks are Linux-only
+    fcntl = None
+
+ACTION_MODES = ('delete', 'hardlink', 'reflink')
+JOURNAL_DIR = str(Path.home() / ".deduplicationator3000" / "journals")
+FICLONE = 0x40049409  # Linux ioctl sharing all extents of one file with another
+VERIFY_CHUNK_SIZE = 1024 * 1024  # Read size when re-hashing a clone
+
+logger = logging.getLogger(__name__)
+
+
+def _is_under(path, directory):
+    """True if path lies inside directory."""
+    directory = os.path.join(os.path.abspath(directory), "")
+    return os.path.abspath(path).startswith(directory)
+
+
+def clone_file(source, target):
+    """
+    Create target as a copy-on-write clone of source.
+
+    Args:
+        source (str): File to clone
+        target (str): New file, must not exist
+
+    Raises:
+        OSError: If the filesystem cannot clone files
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform", target)
+    with open(source, 'rb') as src, open(target, 'xb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+
+
+def _file_digest(path, algorithm):
+    """Hash a file with a registered algorithm."""
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(VERIFY_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _unchanged(record):
+    """True if a file still matches the record made during the scan."""
+    try:
+        st = os.stat(record.path)
+    except OSError:
+        return False
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns) == record.fingerprint
+
+
+def _backup(path, backup):
+    """Keep the original file at backup, as a hardlink where the filesystem allows it."""
+    try:
+        os.link(path, backup)
+    except OSError:
+        os.rename(path, backup)
+
+
+def _restore_backup(path, backup):
+    """Put the original file back at path and drop the backup."""
+    if os.path.lexists(path) and os.path.samefile(path, backup):
+        # Path still is the original; rename() would leave both links in place
+        os.remove(backup)
+    else:
+        os.replace(backup, path)
+
+
+def interrupted_journals(directory=JOURNAL_DIR):
+    """
+    List journals left behind by runs that did not finish.
+
+    Args:
+        directory (str): Journal directory
+
+    Returns:
+        list: Journal file paths, oldest first
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith('.jsonl'))
+
+
+def rollback_journal(path, on_progress=None):
+    """
+    Undo an interrupted run by restoring every touched path from its backup.
+
+    If the run had already committed, its remaining backups are removed
+    instead.
+
+    Args:
+        path (str): Journal file
+        on_progress (callable): Called with a message for each restored file
+
+    Returns:
+        int: Number of files restored
+    """
+    on_progress = on_progress or (lambda message: None)
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break  # Torn last line of a crashed run
+    committed = any(entry.get('op') == 'commit' for entry in entries)
+
+    restored = 0
+    for entry in reversed(entries):
+        if entry.get('op') != 'group':
+            continue
+        for filepath, backup, temp in reversed(entry['files']):
+            try:
+                if os.path.lexists(temp):
+                    os.remove(temp)
+                if not os.path.lexists(backup):
+                    continue
+                if committed:
+                    os.remove(backup)
+                else:
+                    _restore_backup(filepath, backup)
+                    restored += 1
+                    on_progress(f"Restored: {filepath}")
+            except OSError as e:
+                logger.error(f"Error restoring {filepath}: {str(e)}")
+                on_progress(f"Error restoring {filepath}: {str(e)}")
+                return restored  # Keep the journal so the rollback can be retried
+    os.remove(path)
+    return restored
+
+
+class ActionRunner:
+    """
+    Applies the chosen action to duplicate groups, one group at a time.
+
+    Call finish() when done (also after a stop) to drop the backups and the
+    journal; until then every change can be rolled back.
+    """
+
+    def __init__(self, mode='delete', on_progress=None, journal_dir=JOURNAL_DIR):
+        """
+        Args:
+            mode (str): 'delete', 'hardlink' or 'reflink'
+            on_progress (callable): Called with a message for each action
+            journal_dir (str): Where the journal of this run is written
+        """
+        if mode not in ACTION_MODES:
+            raise ValueError(f"Unknown action mode: {mode}")
+        self.mode = mode
+        self.on_progress = on_progress or (lambda message: None)
+        self.journal_dir = journal_dir
+        self.journal = None
+        self.journal_path = None
+        self.backups = []
+        self.token = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        self.groups = 0
+        self.result = {'deleted': 0, 'linked': 0, 'size_saved': 0, 'errors': 0, 'rolled_back': 0}
+
+    def _write(self, entry):
+        if self.journal is None:
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self.journal_path = os.path.join(self.journal_dir, f"run_{self.token}.jsonl")
+            self.journal = open(self.journal_path, 'a', encoding='utf-8')
+            self._write({'op': 'start', 'mode': self.mode})
+        self.journal.write(json.dumps(entry) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def _replace(self, keep, filepath, backup, temp):
+        """Replace one duplicate path according to the mode."""
+        if self.mode == 'delete':
+            if os.path.lexists(filepath):
+                os.remove(filepath)
+            return
+        if self.mode == 'hardlink':
+            os.link(keep, temp)
+        else:
+            clone_file(keep, temp)
+            shutil.copystat(backup, temp)  # Keep the duplicate's permissions and times
+        # Swapping the path in with a rename is atomic; readers never see it missing
+        os.replace(temp, filepath)
+
+    def _verify(self, keep, filepath, group):
+        """Check that a path ended up in the expected state."""
+        if self.mode == 'delete':
+            return not os.path.lexists(filepath)
+        if self.mode == 'hardlink':
+            return os.path.samefile(keep, filepath)
+        # A clone is a separate file; only its content shows that it is one of the kept file
+        return (os.path.getsize(filepath) == group.size
+                and _file_digest(filepath, group.algorithm) == group.digest)
+
+    def _restore(self, files):
+        for filepath, backup, temp in reversed(files):
+            if os.path.lexists(temp):
+                os.remove(temp)
+            if os.path.lexists(backup):
+                _restore_backup(filepath, backup)
+
+    def apply_group(self, group):
+        """
+        Apply the action to every duplicate of one group.
+
+        The group is skipped if any of its files changed since the scan and
+        rolled back if any path fails verification afterwards.
+
+        Args:
+            group (DuplicateGroup): Identical files, the first one is kept
+
+        Returns:
+            bool: True if the group was applied
+        """
+        keep = group.keep
+        if not _unchanged(keep):
+            self.on_progress(f"Skipping group, kept file changed since the scan: {keep.path}")
+            self.result['errors'] += 1
+            return False
+
+        duplicates = group.duplicates
+        changed = [record.path for record in duplicates if not _unchanged(record)]
+        if changed:
+            self.on_progress(f"Skipping group, files changed since the scan: {', '.join(changed)}")
+            self.result['errors'] += 1
+            return False
+        if self.mode != 'delete':
+            # Links and clones cannot cross filesystems
+            duplicates = [record for record in duplicates if record.device == keep.device]
+            for record in group.duplicates:
+                if record.device != keep.device:
+                    self.on_progress(f"Skipping {record.path}: not on the same filesystem as {keep.path}")
+                    self.result['errors'] += 1
+
+        self.groups += 1
+        files = []
+        for record in duplicates:
+            directory, name = os.path.split(record.path)
+            files.append((record.path,
+                          os.path.join(directory, f".{name}.dedup-{self.token}.bak"),
+                          os.path.join(directory, f".{name}.dedup-{self.token}.tmp")))
+        self._write({'op': 'group', 'group': self.groups, 'keep': keep.path, 'files': files})
+
+        done = []
+        try:
+            for filepath, backup, temp in files:
+                _backup(filepath, backup)
+                done.append((filepath, backup, temp))
+                self._replace(keep.path, filepath, backup, temp)
+                if not self._verify(keep.path, filepath, group):
+                    raise OSError(errno.EIO, "Verification failed", filepath)
+        except OSError as e:
+            logger.error(f"Error applying {self.mode} to group of {keep.path}: {str(e)}")
+            self.on_progress(f"Error applying {self.mode} to {e.filename or keep.path}: {e.strerror or e}; "
+                             f"restoring group")
+            self.result['errors'] += 1
+            try:
+                self._restore(done)
+                self.result['rolled_back'] += 1
+            except OSError as restore_error:
+                logger.error(f"Error restoring group of {keep.path}: {str(restore_error)}")
+                self.on_progress(f"Error restoring group, run the journal rollback: {self.journal_path}")
+            return False
+
+        self.backups.extend(done)
+        paths = [filepath for filepath, _, _ in done]
+        self.result['deleted' if self.mode == 'delete' else 'linked'] += len(paths)
+        self.result['size_saved'] += group.reclaimed(paths)
+        for filepath in paths:
+            self.on_progress(f"{'Deleted' if self.mode == 'delete' else 'Linked'}: {filepath}")
+        self.on_progress(f"Kept: {keep.path}")
+        return True
+
+    def finish(self):
+        """
+        Commit the run: remove the backups and the journal.
+
+        Returns:
+            dict: 'deleted', 'linked', 'size_saved', 'errors' and 'rolled_back' counters
+        """
+        if self.journal is not None:
+            self._write({'op': 'commit'})
+            for filepath, backup, _ in self.backups:
+                try:
+                    os.remove(backup)
+                except OSError as e:
+                    logger.error(f"Error removing backup {backup}: {str(e)}")
+            self.journal.close()
+            self.journal = None
+            os.remove(self.journal_path)
+        self.backups = []
+        return self.result
+
+
+class ActionPlan:
+    """Duplicate groups awaiting review, and which of them are approved."""
+
+    def __init__(self):
+        self.groups = []
+        self.approved = set()  # Indexes into self.groups
+
+    def __len__(self):
+        return len(self.groups)
+
+    def add(self, group):
+        """
+        Queue a duplicate group for review.
+
+        Args:
+            group (DuplicateGroup): Identical files, the first one is kept
+        """
+        self.groups.append(group)
+
+    def approve_all(self):
+        """Approve every queued group."""
+        self.approved = set(range(len(self.groups)))
+
+    def approve_under(self, directory):
+        """
+        Approve groups whose duplicates all live under a directory.
+
+        Args:
+            directory (str): Only files below this directory would be removed
+
+        Returns:
+            int: Number of groups newly approved
+        """
+        before = len(self.approved)
+        for i, group in enumerate(self.groups):
+            if all(_is_under(path, directory) for path in group.duplicate_files):
+                self.approved.add(i)
+        return len(self.approved) - before
+
+    def approve_min_size(self, min_size):
+        """
+        Approve groups whose files are at least a given size.
+
+        Args:
+            min_size (int): Minimum file size in bytes
+
+        Returns:
+            int: Number of groups newly approved
+        """
+        before = len(self.approved)
+        self.approved.update(i for i, group in enumerate(self.groups) if group.size >= min_size)
+        return len(self.approved) - before
+
+    def toggle(self, index):
+        """Flip the approval of one group."""
+        self.approved.symmetric_difference_update({index})
+
+    def clear_approvals(self):
+        """Withdraw every approval."""
+        self.approved.clear()
+
+    def approved_groups(self):
+        """Approved groups, in scan order."""
+        return [self.groups[i] for i in sorted(self.approved)]
+
+    def summary(self):
+        """
+        Count what the plan would do.
+
+        Returns:
+            dict: Group, file and byte counts for all and for approved groups
+        """
+        approved = self.approved_groups()
+        return {
+            'groups': len(self.groups),
+            'files': sum(len(group.duplicate_files) for group in self.groups),
+            'reclaimable': sum(group.reclaimable for group in self.groups),
+            'approved_groups': len(approved),
+            'approved_files': sum(len(group.duplicate_files) for group in approved),
+            'approved_reclaimable': sum(group.reclaimable for group in approved)
+        }
+
+    def apply(self, on_progress=None, is_running=lambda: True, mode='delete'):
+        """
+        Apply the action to the duplicates of every approved group in one pass.
+
+        A group is skipped if any of its files changed since the scan, so the
+        last copy of a file is never removed.
+
+        Args:
+            on_progress (callable): Called with a message for each action
+            is_running (callable): Returns False to stop early
+            mode (str): 'delete', 'hardlink' or 'reflink'
+
+        Returns:
+            dict: 'deleted', 'linked', 'size_saved', 'errors' and 'rolled_back' counters
+        """
+        runner = ActionRunner(mode, on_progress)
+        for group in self.approved_groups():
+            if not is_running():
+                break
+            runner.apply_group(group)
+        # Stopping early still commits the finished groups; an exception leaves the journal for rollback
+        return runner.finish()
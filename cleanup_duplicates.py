@@ -1,7 +1,6 @@
 import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import hashlib
 from PIL import Image, ImageTk
 import psutil
 from tqdm import tqdm
@@ -9,9 +8,38 @@ import threading
 import json
 from datetime import datetime
 import time
-import csv
 import sys
 from pathlib import Path
+from hash_algorithms import confirm_algorithms, DEFAULT_ALGORITHM
+from scan_engine import ScanConfig, ScanEngine, CHUNK_SIZE
+from file_readers import READ_METHODS, DEFAULT_READ_METHOD
+from ui_events import CoalescingEventQueue
+from action_plan import ActionPlan, ACTION_MODES, interrupted_journals, rollback_journal
+from result_writer import ResultWriter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss(process):
+    """
+    Get the peak resident memory of a process.
+    
+    Uses getrusage() where available, which reports the peak of the
+    calling process since it started, and the peak working set on Windows.
+    
+    Args:
+        process (psutil.Process): Process to inspect when getrusage() is not available
+        
+    Returns:
+        int: Peak resident set size in bytes (the current one if the platform reports no peak)
+    """
+    if resource:
+        scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in KB except on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    info = process.memory_info()
+    return getattr(info, 'peak_wset', info.rss)
 
 class Deduplicationator3000:
     def __init__(self, root):
@@ -151,6 +179,41 @@ class Deduplicationator3000:
         self.skip_extensions.pack(side=tk.LEFT, padx=5)
         self.skip_extensions.insert(0, ".tmp,.temp,.log")
         
+        # Read chunk size
+        chunk_frame = ttk.Frame(options_frame)
+        chunk_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(chunk_frame, text="Read Chunk Size (MB):").pack(side=tk.LEFT)
+        self.chunk_size = ttk.Entry(chunk_frame, width=10)
+        self.chunk_size.pack(side=tk.LEFT, padx=5)
+        self.chunk_size.insert(0, str(CHUNK_SIZE // (1024 * 1024)))
+        
+        ttk.Label(chunk_frame, text="Read Method:").pack(side=tk.LEFT, padx=(10, 0))
+        self.read_method = tk.StringVar(value=DEFAULT_READ_METHOD)
+        self.read_method_combo = ttk.Combobox(
+            chunk_frame,
+            textvariable=self.read_method,
+            values=list(READ_METHODS),
+            state="readonly",
+            width=10
+        )
+        self.read_method_combo.pack(side=tk.LEFT, padx=5)
+        
+        # Hash algorithm
+        algo_frame = ttk.Frame(options_frame)
+        algo_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(algo_frame, text="Hash Algorithm:").pack(side=tk.LEFT)
+        self.hash_algorithm = tk.StringVar(value=DEFAULT_ALGORITHM)
+        self.hash_algorithm_combo = ttk.Combobox(
+            algo_frame,
+            textvariable=self.hash_algorithm,
+            values=confirm_algorithms(),
+            state="readonly",
+            width=10
+        )
+        self.hash_algorithm_combo.pack(side=tk.LEFT, padx=5)
+        
         # Action options
         action_frame = ttk.Frame(options_frame)
         action_frame.pack(fill=tk.X, pady=5)
@@ -163,6 +226,18 @@ class Deduplicationator3000:
         )
         self.auto_delete_cb.pack(side=tk.LEFT, padx=5)
         
+        # Delete duplicates or replace them with links to the kept file
+        ttk.Label(action_frame, text="Action:").pack(side=tk.LEFT, padx=(5, 0))
+        self.action_mode = tk.StringVar(value="delete")
+        self.action_mode_combo = ttk.Combobox(
+            action_frame,
+            textvariable=self.action_mode,
+            values=ACTION_MODES,
+            state="readonly",
+            width=10
+        )
+        self.action_mode_combo.pack(side=tk.LEFT, padx=5)
+        
         self.export_csv = tk.BooleanVar(value=True)
         self.export_csv_cb = ttk.Checkbutton(
             action_frame,
@@ -171,6 +246,14 @@ class Deduplicationator3000:
         )
         self.export_csv_cb.pack(side=tk.LEFT, padx=5)
         
+        self.use_cache = tk.BooleanVar(value=True)
+        self.use_cache_cb = ttk.Checkbutton(
+            action_frame,
+            text="Use hash cache",
+            variable=self.use_cache
+        )
+        self.use_cache_cb.pack(side=tk.LEFT, padx=5)
+        
         # Progress frame
         progress_frame = ttk.LabelFrame(
             self.scrollable_frame,
@@ -232,14 +315,34 @@ class Deduplicationator3000:
         )
         self.time_remaining_label.pack(anchor="w")
         
-        # Current file
+        # Current step
         self.current_file_label = ttk.Label(
             self.stats_frame,
-            text="Current File: None",
+            text="Current Step: None",
             foreground=self.accent_color
         )
         self.current_file_label.pack(anchor="w")
         
+        # Peak memory
+        self.memory_label = ttk.Label(
+            self.stats_frame,
+            text="Peak Memory: -- MB",
+            foreground=self.accent_color
+        )
+        self.memory_label.pack(anchor="w")
+        
+        # Scan summary, filled in when a scan finishes
+        self.summary_text = tk.Text(
+            progress_frame,
+            height=10,
+            bg=self.button_color,
+            fg=self.text_color,
+            font=('Arial', 9),
+            relief=tk.FLAT,
+            state='disabled'
+        )
+        self.summary_text.pack(fill=tk.X, pady=5)
+        
         # Status label with cyberpunk styling
         self.status_label = ttk.Label(
             self.scrollable_frame,
@@ -279,10 +382,26 @@ class Deduplicationator3000:
         self.files_per_second = 0
         self.speed_samples = []  # For rolling average
         self.max_samples = 10    # Number of samples for rolling average
+        self.process = psutil.Process()
+        self.peak_memory = 0
         
         # Add Documents folder path
         self.documents_folder = str(Path.home() / "Documents")
         
+        # Scan threads only queue UI updates; the Tk thread renders them on a timer
+        self.ui_events = CoalescingEventQueue(self.root, {
+            'log': self.show_step,
+            'stats': self.show_stats,
+            'done': self.show_stats,
+            'status': lambda text: self.status_label.configure(text=text),
+            'summary': self.show_summary,
+            'error': self.show_error,
+            'finished': self.scan_finished
+        })
+        
+        # Offer to undo file changes left half-done by a crash
+        self.root.after(500, self.recover_interrupted_runs)
+        
     def browse_directory(self):
         directory = filedialog.askdirectory()
         if directory:
@@ -305,6 +424,9 @@ class Deduplicationator3000:
             # Calculate average speed
             self.files_per_second = sum(self.speed_samples) / len(self.speed_samples)
         
+        # Track peak memory
+        self.peak_memory = max(self.peak_memory, peak_rss(self.process))
+        
         # Update labels
         self.files_processed_label.configure(
             text=f"Files Processed: {self.files_processed:,}"
@@ -320,6 +442,9 @@ class Deduplicationator3000:
             font=('Arial', 10, 'bold'),  # Make speed more prominent
             foreground=self.accent_color
         )
+        self.memory_label.configure(
+            text=f"Peak Memory: {self.peak_memory / (1024*1024):,.1f} MB"
+        )
     
     def start_scan(self):
         directory = self.dir_entry.get()
@@ -327,6 +452,24 @@ class Deduplicationator3000:
             messagebox.showerror("Error", "Please select a valid directory")
             return
         
+        # Read every setting here, on the Tk thread; the scan thread never touches widgets
+        try:
+            config = ScanConfig(
+                directory,
+                min_size=float(self.min_size.get()) * 1024 * 1024,  # Convert MB to bytes
+                max_size=float(self.max_size.get()) * 1024 * 1024,
+                skip_extensions=self.skip_extensions.get().split(','),
+                algorithm=self.hash_algorithm.get(),
+                chunk_size=max(1, int(float(self.chunk_size.get()) * 1024 * 1024)),
+                read_method=self.read_method.get(),
+                use_cache=self.use_cache.get()
+            )
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid option: {str(e)}")
+            return
+        action_mode = self.action_mode.get() if self.auto_delete.get() else None
+        export_csv = self.export_csv.get()
+        
         # Reset statistics
         self.start_time = time.time()
         self.files_processed = 0
@@ -335,16 +478,57 @@ class Deduplicationator3000:
         self.last_update = time.time()
         self.files_per_second = 0
         self.speed_samples = []  # Reset speed samples
+        self.peak_memory = peak_rss(self.process)
         
         # Disable start button during scan
         self.start_btn.configure(state='disabled')
         self.status_label.configure(text="Scanning...")
+        self.summary_text.configure(state='normal')
+        self.summary_text.delete("1.0", tk.END)
+        self.summary_text.configure(state='disabled')
+        self.ui_events.start()
         
         # Start scan in a separate thread
-        thread = threading.Thread(target=self.scan_directory, args=(directory,))
+        thread = threading.Thread(target=self.scan_directory, args=(config, action_mode, export_csv))
         thread.daemon = True
         thread.start()
     
+    def show_step(self, lines):
+        self.current_file_label.configure(text=f"Current Step: {lines[-1].strip()}")
+    
+    def show_stats(self, stats):
+        self.files_processed = stats['processed']
+        self.duplicates_found = stats['duplicate_files']
+        self.space_saved = stats['reclaimable']
+        
+        # Update statistics every 0.5 seconds
+        current_time = time.time()
+        if current_time - self.last_update >= 0.5:
+            self.update_statistics()
+            self.last_update = current_time
+    
+    def show_summary(self, lines):
+        # Windowed builds have no console, so the summary goes into the window
+        self.update_statistics()
+        lines = lines + [f"Peak memory: {self.peak_memory / (1024*1024):,.1f} MB"]
+        self.summary_text.configure(state='normal')
+        self.summary_text.delete("1.0", tk.END)
+        self.summary_text.insert(tk.END, "\n".join(lines))
+        self.summary_text.configure(state='disabled')
+    
+    def show_error(self, error):
+        title, message = error
+        messagebox.showerror(title, message)
+    
+    def scan_finished(self, _=None):
+        self.ui_events.stop()
+        
+        # Peak memory for the whole scan ends up in its label
+        self.update_statistics()
+        
+        self.start_btn.configure(state='normal')
+        self.current_file_label.configure(text="Current Step: None")
+    
     def get_safe_csv_path(self):
         """Get a safe path for the CSV file in the Documents folder."""
         try:
@@ -359,123 +543,85 @@ class Deduplicationator3000:
             # Return full path
             return os.path.join(output_dir, filename)
         except Exception as e:
-            messagebox.showerror("Error", f"Could not create output directory: {str(e)}")
+            self.ui_events.put('error', ("Error", f"Could not create output directory: {str(e)}"))
             return None
 
-    def scan_directory(self, directory):
+    def recover_interrupted_runs(self):
+        """Offer to roll back file changes of runs that were interrupted by a crash."""
+        journals = interrupted_journals()
+        if not journals:
+            return
+        if not messagebox.askyesno("Interrupted Run",
+                                   f"{len(journals)} earlier run(s) stopped while changing duplicate files.\n"
+                                   f"Restore the files they touched?"):
+            return
+        restored = 0
         try:
-            # Get file size limits
-            min_size = float(self.min_size.get()) * 1024 * 1024  # Convert MB to bytes
-            max_size = float(self.max_size.get()) * 1024 * 1024
-            
-            # Get skip extensions
-            skip_extensions = set(ext.strip() for ext in self.skip_extensions.get().split(','))
-            
-            # Initialize progress tracking
-            self.files_processed = 0
-            self.duplicates_found = 0
-            self.space_saved = 0
-            self.start_time = time.time()
-            self.last_update = time.time()
-            self.files_per_second = 0
-            self.speed_samples = []  # Reset speed samples
-            
-            # Process files as we find them
-            hashes = {}
-            for root, _, filenames in os.walk(directory):
-                for filename in filenames:
-                    try:
-                        filepath = os.path.join(root, filename)
-                        size = os.path.getsize(filepath)
-                        ext = os.path.splitext(filename)[1].lower()
-                        
-                        if min_size <= size <= max_size and ext not in skip_extensions:
-                            # Update current file
-                            self.current_file_label.configure(
-                                text=f"Current File: {os.path.basename(filepath)}"
-                            )
-                            
-                            with open(filepath, 'rb') as f:
-                                file_hash = hashlib.sha256(f.read()).hexdigest()
-                                if file_hash in hashes:
-                                    hashes[file_hash].append(filepath)
-                                    self.duplicates_found += 1
-                                    self.space_saved += size
-                                else:
-                                    hashes[file_hash] = [filepath]
-                            
-                            self.files_processed += 1
-                            
-                            # Update statistics every 0.5 seconds
-                            current_time = time.time()
-                            if current_time - self.last_update >= 0.5:
-                                self.update_statistics()
-                                self.last_update = current_time
-                            
-                    except Exception as e:
-                        print(f"Error processing {filepath}: {e}")
-                        continue
+            for journal in journals:
+                restored += rollback_journal(journal)
+            messagebox.showinfo("Rollback Complete", f"Restored {restored} files")
+        except Exception as e:
+            messagebox.showerror("Rollback Error", f"Could not roll back {journal}: {str(e)}")
+    
+    def scan_directory(self, config, action_mode, export_csv):
+        # Runs on the scan thread: every UI update goes through self.ui_events
+        try:
+            engine = ScanEngine(config)
             
-            # Find duplicates
-            duplicates = {h: files for h, files in hashes.items() if len(files) > 1}
+            # Groups are exported as soon as they are confirmed, so a stopped scan still leaves a report
+            writer = None
+            csv_path = self.get_safe_csv_path() if export_csv else None
+            if csv_path:
+                try:
+                    writer = ResultWriter(csv_path, 'csv')
+                except OSError as e:
+                    self.ui_events.put('error', ("Export Error",
+                        f"Could not export to CSV: {str(e)}\n\n"
+                        f"Please ensure you have write permissions to:\n{csv_path}"))
+                    csv_path = None
             
-            # Export to CSV if requested
-            if self.export_csv.get():
-                csv_path = self.get_safe_csv_path()
-                if csv_path:
-                    try:
-                        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-                            writer = csv.writer(f)
-                            writer.writerow(['Hash', 'File Path', 'Size (bytes)', 'Last Modified'])
-                            for hash_value, file_list in duplicates.items():
-                                for filepath in file_list:
-                                    writer.writerow([
-                                        hash_value,
-                                        filepath,
-                                        os.path.getsize(filepath),
-                                        datetime.fromtimestamp(os.path.getmtime(filepath))
-                                    ])
-                        self.status_label.configure(
-                            text=f"Exported results to {csv_path}"
-                        )
-                    except Exception as e:
-                        messagebox.showerror("Export Error", 
-                            f"Could not export to CSV: {str(e)}\n\n"
-                            f"Please ensure you have write permissions to:\n{csv_path}")
+            # Only groups that will be deleted or linked are kept in memory
+            duplicates = ActionPlan()
+            found = 0
+            try:
+                for event in engine.run():
+                    if event.kind == 'group':
+                        found += 1
+                        if writer:
+                            writer.write(event.data)
+                        if action_mode:
+                            duplicates.add(event.data)
+                        self.ui_events.put('stats', dict(engine.stats))
+                    else:
+                        self.ui_events.put(event.kind, event.data)
+            finally:
+                if writer:
+                    writer.close()
             
             # Auto-delete if requested
-            if self.auto_delete.get() and duplicates:
-                for hash_value, file_list in duplicates.items():
-                    # Keep the most recently modified file
-                    files_with_mtime = [(f, os.path.getmtime(f)) for f in file_list]
-                    files_with_mtime.sort(key=lambda x: x[1], reverse=True)
-                    for filepath, _ in files_with_mtime[1:]:  # Skip the first (most recent) file
-                        try:
-                            os.remove(filepath)
-                        except Exception as e:
-                            print(f"Error deleting {filepath}: {e}")
+            result = None
+            if action_mode and duplicates:
+                # Files are ordered most recent first; the plan keeps the first one
+                duplicates.approve_all()
+                result = duplicates.apply(mode=action_mode)
             
             # Update status
-            if duplicates:
-                self.status_label.configure(
-                    text=f"Found {len(duplicates)} sets of duplicate files"
-                )
-                if self.auto_delete.get():
-                    self.status_label.configure(
-                        text=f"Deleted {self.duplicates_found} duplicate files"
-                    )
-                if self.export_csv.get():
-                    self.status_label.configure(
-                        text=f"Exported results to {csv_path}"
-                    )
+            if found:
+                status = f"Found {found} sets of duplicate files"
+                if result:
+                    status = (f"Deleted {result['deleted']} duplicate files" if action_mode == 'delete'
+                              else f"Linked {result['linked']} duplicate files")
+                if csv_path:
+                    status = f"Exported results to {csv_path}"
             else:
-                self.status_label.configure(text="No duplicates found")
+                status = "No duplicates found"
+            self.ui_events.put('status', status)
+            self.ui_events.put('summary', engine.summary())
             
         except Exception as e:
-            messagebox.showerror("Error", str(e))
+            self.ui_events.put('error', ("Error", str(e)))
         finally:
-            self.start_btn.configure(state='normal')
-            self.current_file_label.configure(text="Current File: None")
+            self.ui_events.put('finished')
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,437 @@
+"""
+Benchmark suite for Deduplicationator 3000.
+
+Generates a synthetic file tree from a seed, so every run and every commit
+scans exactly the same data, then runs the scan engine once per strategy
+(hash algorithm, workers, chunk size, pruning, cache, ...) in a fresh
+process and reports throughput, peak memory and system call counts as JSON.
+
+Example:
+    python dedup_benchmark.py /tmp/bench --files 20000 --profile mixed -o before.json
+    python dedup_benchmark.py /tmp/bench --files 20000 --profile mixed -o after.json
+
+The tree is only regenerated when its settings change. Page cache state is
+not controlled unless --drop-caches is given (Linux, root only), so compare
+runs made the same way.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import shutil
+import logging
+import argparse
+import platform
+import subprocess
+import tempfile
+import multiprocessing
+
+from scan_engine import ScanConfig, ScanEngine, NUM_WORKERS, format_size
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+TREE_MANIFEST = "bench_tree.json"  # Settings of the generated tree, next to it
+WRITE_BLOCK = 1024 * 1024          # Generated files are written in blocks of this size
+CHILD_POLL = 1.0                   # Seconds between checks that a strategy's process is alive
+
+# Size distributions: (weight, smallest, largest) buckets in bytes
+SIZE_PROFILES = {
+    'tiny': [(1.0, 0, 4 * 1024)],
+    'mixed': [(0.6, 1024, 64 * 1024), (0.3, 64 * 1024, 4 * 1024**2), (0.1, 4 * 1024**2, 64 * 1024**2)],
+    'large': [(0.5, 16 * 1024**2, 64 * 1024**2), (0.5, 64 * 1024**2, 256 * 1024**2)],
+}
+
+# Strategies: ScanConfig overrides, plus 'warm' to measure a second run that
+# can reuse the hash cache or directory manifest of the first one
+STRATEGIES = {
+    'baseline': {},
+    'blake2b': {'algorithm': 'blake2b'},
+    'single-worker': {'workers': 1},
+    'process-pool': {'backend': 'process'},
+    'chunk-64k': {'chunk_size': 64 * 1024},
+    'chunk-16m': {'chunk_size': 16 * 1024**2},
+    'no-prune': {'prune_sizes': False},
+    'no-partial': {'partial_stages': []},
+    'no-lockstep': {'lockstep_max_files': 0},
+    'mmap': {'read_method': 'mmap'},
+    'cache-cold': {'use_cache': True},
+    'cache-warm': {'use_cache': True, 'warm': True},
+    'incremental-warm': {'use_cache': True, 'incremental': True, 'warm': True},
+}
+DEFAULT_STRATEGIES = ['baseline', 'blake2b', 'single-worker', 'chunk-64k', 'no-prune',
+                      'cache-cold', 'cache-warm']
+
+
+class TreeSpec:
+    """Settings of a synthetic tree; the same spec and seed always give the same files."""
+
+    def __init__(self, files=2000, profile='mixed', duplicate_ratio=0.2, collision_ratio=0.1,
+                 hardlink_ratio=0.05, tiny_files=0, depth=4, files_per_dir=50, seed=3000):
+        """
+        Args:
+            files (int): Regular files to create
+            profile (str): Size distribution from SIZE_PROFILES
+            duplicate_ratio (float): Share of files that copy an earlier file
+            collision_ratio (float): Share of files with the size, but not the content, of an earlier file
+            hardlink_ratio (float): Share of files that are hardlinks of an earlier file
+            tiny_files (int): Extra files of at most 512 bytes
+            depth (int): Deepest directory nesting
+            files_per_dir (int): Average files per directory
+            seed (int): Seed of the random generator
+        """
+        if profile not in SIZE_PROFILES:
+            raise ValueError(f"Unknown size profile: {profile}")
+        self.files = files
+        self.profile = profile
+        self.duplicate_ratio = duplicate_ratio
+        self.collision_ratio = collision_ratio
+        self.hardlink_ratio = hardlink_ratio
+        self.tiny_files = tiny_files
+        self.depth = depth
+        self.files_per_dir = files_per_dir
+        self.seed = seed
+
+    def to_dict(self):
+        """Settings as a JSON-serializable dictionary."""
+        return dict(vars(self))
+
+
+def _write_content(path, size, content_seed):
+    """Write size pseudo-random bytes derived from content_seed."""
+    rng = random.Random(content_seed)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            block = min(remaining, WRITE_BLOCK)
+            f.write(rng.randbytes(block))
+            remaining -= block
+
+
+def generate_tree(root, spec):
+    """
+    Create the synthetic tree of a spec below root/tree.
+
+    Args:
+        root (str): Benchmark directory
+        spec (TreeSpec): Tree settings
+
+    Returns:
+        dict: Totals of the generated tree (files, bytes, duplicates, ...)
+    """
+    rng = random.Random(spec.seed)
+    tree = os.path.join(root, "tree")
+    if os.path.exists(tree):
+        shutil.rmtree(tree)
+
+    # Directory layout first, so nesting does not depend on file contents
+    directories = []
+    for _ in range(max(1, spec.files // max(1, spec.files_per_dir))):
+        parts = [f"d{rng.randrange(8)}" for _ in range(rng.randint(1, max(1, spec.depth)))]
+        directories.append(os.path.join(tree, *parts))
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    buckets = SIZE_PROFILES[spec.profile]
+    weights = [weight for weight, _, _ in buckets]
+    written = []  # (path, size, content seed) of every regular file
+    totals = {'files': 0, 'bytes': 0, 'duplicates': 0, 'collisions': 0, 'hardlinks': 0, 'tiny': 0}
+
+    for number in range(spec.files):
+        path = os.path.join(rng.choice(directories), f"f{number}.bin")
+        roll = rng.random()
+        if written and roll < spec.hardlink_ratio:
+            os.link(rng.choice(written)[0], path)
+            totals['hardlinks'] += 1
+            totals['files'] += 1
+            continue
+        if written and roll < spec.hardlink_ratio + spec.duplicate_ratio:
+            _, size, content_seed = rng.choice(written)
+            totals['duplicates'] += 1
+        elif written and roll < spec.hardlink_ratio + spec.duplicate_ratio + spec.collision_ratio:
+            _, size, _ = rng.choice(written)
+            content_seed = rng.getrandbits(64)
+            totals['collisions'] += 1
+        else:
+            _, low, high = rng.choices(buckets, weights)[0]
+            size = rng.randint(low, high)
+            content_seed = rng.getrandbits(64)
+        _write_content(path, size, content_seed)
+        written.append((path, size, content_seed))
+        totals['files'] += 1
+        totals['bytes'] += size
+
+    for number in range(spec.tiny_files):
+        path = os.path.join(rng.choice(directories), f"t{number}.txt")
+        size = rng.randint(0, 512)
+        _write_content(path, size, rng.getrandbits(64))
+        totals['tiny'] += 1
+        totals['files'] += 1
+        totals['bytes'] += size
+
+    totals['directories'] = len(set(directories))
+    return totals
+
+
+def prepare_tree(root, spec, regenerate=False):
+    """
+    Generate the tree unless one with the same spec already exists.
+
+    Args:
+        root (str): Benchmark directory
+        spec (TreeSpec): Tree settings
+        regenerate (bool): Always generate a new tree
+
+    Returns:
+        dict: Spec and totals of the tree
+    """
+    manifest_path = os.path.join(root, TREE_MANIFEST)
+    if not regenerate and os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('spec') == spec.to_dict():
+            return manifest
+
+    os.makedirs(root, exist_ok=True)
+    started = time.time()
+    manifest = {'spec': spec.to_dict(), 'totals': generate_tree(root, spec)}
+    manifest['generated_in'] = round(time.time() - started, 3)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _io_counters():
+    """System call and byte counters of this process and its reaped children, or None."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return {'read_calls': int(fields['syscr']), 'write_calls': int(fields['syscw']),
+                'read_bytes': int(fields['rchar'])}
+    except (OSError, KeyError, ValueError):
+        pass
+    if psutil:
+        counters = psutil.Process().io_counters()
+        return {'read_calls': counters.read_count, 'write_calls': counters.write_count,
+                'read_bytes': getattr(counters, 'read_chars', counters.read_bytes)}
+    return None
+
+
+def _peak_rss():
+    """Peak resident memory in bytes of this process and its worker processes, or None."""
+    if resource:
+        scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in KB except on macOS
+        return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+    if psutil:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+def _scan(config):
+    """Run a scan to completion and return the engine."""
+    engine = ScanEngine(config)
+    for _ in engine.run():
+        pass
+    return engine
+
+
+def run_strategy(tree, name, overrides, workdir, drop_caches=False):
+    """
+    Run one strategy and measure it. Meant to run in a fresh process.
+
+    Args:
+        tree (str): Directory to scan
+        name (str): Strategy name
+        overrides (dict): ScanConfig overrides; 'warm' measures a second scan
+        workdir (str): Private directory for the hash cache and manifest
+        drop_caches (bool): Drop the page cache before the measured scan
+
+    Returns:
+        dict: Measurements of the strategy
+    """
+    overrides = dict(overrides)
+    warm = overrides.pop('warm', False)
+    settings = {'use_cache': False, 'workers': NUM_WORKERS}
+    settings.update(overrides)
+    config = ScanConfig(tree, cache_path=os.path.join(workdir, "cache.db"),
+                        manifest_path=os.path.join(workdir, "manifest.db"), **settings)
+    if warm:
+        _scan(config)
+    if drop_caches:
+        _drop_page_cache()
+
+    io_before = _io_counters()
+    started = time.perf_counter()
+    # A completed scan joins its hashing pool, so process workers are reaped
+    # and their reads and peak memory are in the counters below
+    engine = _scan(config)
+    seconds = time.perf_counter() - started
+    io_after = _io_counters()
+
+    stats = engine.stats
+    result = {
+        'strategy': name,
+        'config': config.to_dict(),
+        'warm': warm,
+        'seconds': round(seconds, 4),
+        'files_per_second': round(stats['processed'] / seconds, 1) if seconds else None,
+        'mb_per_second': round(stats['total_size'] / (1024 * 1024) / seconds, 2) if seconds else None,
+        'peak_rss': _peak_rss(),
+        'syscalls': ({key: io_after[key] - io_before[key] for key in io_after}
+                     if io_before and io_after else None),
+        'stats': stats,
+        'stages': engine.stage_stats,
+        'stage_seconds': {stage: values['seconds'] for stage, values in engine.metrics.snapshot()['stages'].items()},
+    }
+    if engine.cache:
+        result['cache'] = dict(engine.cache.stats)
+    if engine.manifest:
+        result['manifest'] = dict(engine.manifest.stats)
+    return result
+
+
+def _drop_page_cache():
+    """Flush dirty pages and drop the page cache (Linux, root only)."""
+    os.sync()
+    try:
+        with open("/proc/sys/vm/drop_caches", 'w') as f:
+            f.write("3\n")
+    except OSError as e:
+        logging.warning(f"Could not drop the page cache: {str(e)}")
+
+
+def _run_in_child(results, *args):
+    try:
+        results.put(run_strategy(*args))
+    except Exception as e:
+        results.put({'strategy': args[1], 'error': str(e)})
+
+
+def measure(tree, name, overrides, drop_caches=False):
+    """
+    Run a strategy in a fresh process, so peak memory and counters are its own.
+
+    Args:
+        tree (str): Directory to scan
+        name (str): Strategy name
+        overrides (dict): ScanConfig overrides
+        drop_caches (bool): Drop the page cache before the measured scan
+
+    Returns:
+        dict: Measurements, or {'strategy', 'error'} if the run failed or
+        its process died (e.g. killed for running out of memory)
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    with tempfile.TemporaryDirectory(prefix="dedup-bench-") as workdir:
+        child = context.Process(target=_run_in_child,
+                                args=(results, tree, name, overrides, workdir, drop_caches))
+        child.start()
+        result = None
+        while result is None:
+            try:
+                result = results.get(timeout=CHILD_POLL)
+            except queue.Empty:
+                if not child.is_alive():
+                    # A result may have been put just before the process exited
+                    try:
+                        result = results.get(timeout=CHILD_POLL)
+                    except queue.Empty:
+                        result = {'strategy': name, 'error': f"process exited with code {child.exitcode}"}
+        child.join()
+    return result
+
+
+def git_commit():
+    """Commit of the working tree, if it is a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark scan strategies on a synthetic file tree.")
+    parser.add_argument("root", help="Directory for the generated tree")
+    parser.add_argument("--files", type=int, default=2000, help="Regular files to generate")
+    parser.add_argument("--profile", choices=sorted(SIZE_PROFILES), default='mixed', help="File size distribution")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="Share of files that are copies")
+    parser.add_argument("--collisions", type=float, default=0.1,
+                        help="Share of files with the size but not the content of another file")
+    parser.add_argument("--hardlinks", type=float, default=0.05, help="Share of files that are hardlinks")
+    parser.add_argument("--tiny-files", type=int, default=0, help="Extra files of at most 512 bytes")
+    parser.add_argument("--depth", type=int, default=4, help="Deepest directory nesting")
+    parser.add_argument("--files-per-dir", type=int, default=50, help="Average files per directory")
+    parser.add_argument("--seed", type=int, default=3000, help="Seed of the tree generator")
+    parser.add_argument("--regenerate", action="store_true", help="Generate the tree even if it exists")
+    parser.add_argument("--strategies", default=",".join(DEFAULT_STRATEGIES),
+                        help=f"Comma separated strategies, 'all' for every one: {', '.join(STRATEGIES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per strategy")
+    parser.add_argument("--drop-caches", action="store_true",
+                        help="Drop the page cache before every measured scan (Linux, root only)")
+    parser.add_argument("--output", "-o", help="Write JSON here instead of stdout")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    names = list(STRATEGIES) if args.strategies == 'all' else [name.strip() for name in args.strategies.split(',')]
+    unknown = [name for name in names if name not in STRATEGIES]
+    if unknown:
+        print(f"Unknown strategies: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    spec = TreeSpec(args.files, args.profile, args.duplicates, args.collisions, args.hardlinks,
+                    args.tiny_files, args.depth, args.files_per_dir, args.seed)
+    print(f"Preparing tree in {args.root}...", file=sys.stderr)
+    tree_info = prepare_tree(args.root, spec, args.regenerate)
+    tree = os.path.join(args.root, "tree")
+
+    results = []
+    for name in names:
+        for run in range(args.repeat):
+            result = measure(tree, name, STRATEGIES[name], args.drop_caches)
+            result['run'] = run
+            results.append(result)
+            if 'error' in result:
+                print(f"{name}: failed: {result['error']}", file=sys.stderr)
+            else:
+                print(f"{name}: {result['seconds']:.2f}s, {result['files_per_second']} files/s, "
+                      f"{result['mb_per_second']} MB/s, peak RSS {format_size(result['peak_rss'] or 0)}",
+                      file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'tree': tree_info,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+Command-line interface for Deduplicationator 3000.
+
+Runs the headless scan engine and writes the duplicate groups as JSON,
+for servers without a display and for scripting or profiling scans.
+
+Example:
+    python dedup_cli.py /srv/share --min-size 1GB --output duplicates.json --checkpoint
+    python dedup_cli.py --resume --output duplicates.json
+    python dedup_cli.py /srv/pool --shards 4 --work-dir /mnt/shared/dedup-job --output duplicates.json
+"""
+
+import sys
+import json
+import argparse
+import logging
+import multiprocessing
+
+from scan_engine import (ScanConfig, ScanEngine, SKIP_EXTENSIONS, NUM_WORKERS,
+                         HASH_BACKEND, CHUNK_SIZE, PARTIAL_HASH_STAGES, LOCKSTEP_MAX_FILES)
+from hash_algorithms import prefilter_algorithms, confirm_algorithms, DEFAULT_ALGORITHM, DEFAULT_PREFILTER
+from file_walker import WALK_WORKERS
+from file_readers import READ_METHODS, DEFAULT_READ_METHOD
+from io_scheduler import READ_ORDERS, DEFAULT_READ_ORDER, HDD_CONCURRENCY
+from scan_metrics import METRICS_FORMATS
+from scan_checkpoint import ScanCheckpoint, CHECKPOINT_DIR
+from result_writer import ResultWriter, RESULT_FORMATS, group_to_dict
+from result_store import RESULTS_PATH
+from shard_scan import ShardCoordinator, run_worker
+
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+
+
+def parse_size(text):
+    """
+    Convert a size such as '512', '10MB' or '1.5GB' to bytes.
+
+    Args:
+        text (str): Size with an optional unit (B, KB, MB, GB, TB)
+
+    Returns:
+        int: Size in bytes
+    """
+    value = text.strip().upper()
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(float(value))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Find duplicate files and report them as JSON.")
+    parser.add_argument("roots", nargs="*", help="Directories to scan (not needed with --resume)")
+    parser.add_argument("--min-size", type=parse_size, default=0, help="Minimum file size (e.g. 10MB)")
+    parser.add_argument("--max-size", type=parse_size, default=SIZE_UNITS["TB"] * 1024,
+                        help="Maximum file size (e.g. 300GB)")
+    parser.add_argument("--skip-ext", default=",".join(sorted(SKIP_EXTENSIONS)),
+                        help="Comma separated extensions to skip")
+    parser.add_argument("--algorithm", choices=confirm_algorithms(), default=DEFAULT_ALGORITHM,
+                        help="Hash algorithm that confirms duplicates")
+    parser.add_argument("--prefilter", choices=prefilter_algorithms(), default=DEFAULT_PREFILTER,
+                        help="Hash algorithm for partial hashing stages")
+    parser.add_argument("--backend", choices=["thread", "process"], default=HASH_BACKEND,
+                        help="Hashing worker pool type")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="Number of hashing workers")
+    parser.add_argument("--walk-workers", type=int, default=WALK_WORKERS,
+                        help="Number of directory traversal threads")
+    parser.add_argument("--chunk-size", type=parse_size, default=CHUNK_SIZE, help="Read size for full hashing")
+    parser.add_argument("--read-method", choices=list(READ_METHODS), default=DEFAULT_READ_METHOD,
+                        help="How full hashing reads files")
+    parser.add_argument("--read-order", choices=READ_ORDERS, default=DEFAULT_READ_ORDER,
+                        help="Order of reads on each device ('extent' applies to spinning disks)")
+    parser.add_argument("--hdd-concurrency", type=int, default=HDD_CONCURRENCY,
+                        help="Reads in flight per spinning disk")
+    parser.add_argument("--no-partial", action="store_true", help="Disable partial hashing stages")
+    parser.add_argument("--no-prune", action="store_true", help="Hash files even if their size is unique")
+    parser.add_argument("--no-lockstep", action="store_true",
+                        help="Hash small groups instead of comparing them byte by byte")
+    parser.add_argument("--max-read-rate", type=parse_size, default=0,
+                        help="Read bandwidth cap per second (e.g. 50MB), 0 for none")
+    parser.add_argument("--max-open-files", type=int, default=0, help="Files hashed at the same time, 0 for no cap")
+    parser.add_argument("--max-cpu", type=float, default=0,
+                        help="Percent of all CPUs the scan may use, 0 for no cap")
+    parser.add_argument("--max-load", type=float, default=0,
+                        help="Back off while the load average per CPU is above this, 0 to ignore")
+    parser.add_argument("--max-disk-busy", type=float, default=0,
+                        help="Back off while a disk is busier than this percentage, 0 to ignore")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the persistent hash cache")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse listings of directories unchanged since the previous scan")
+    parser.add_argument("--metrics", help="Write per-stage timings and histograms to this file")
+    parser.add_argument("--metrics-format", choices=METRICS_FORMATS,
+                        help="Metrics file format (default: prometheus for .prom files, else json)")
+    parser.add_argument("--metrics-interval", type=float, default=0,
+                        help="Also rewrite the metrics file every this many seconds during the scan")
+    parser.add_argument("--checkpoint", nargs="?", const=CHECKPOINT_DIR, metavar="DIR",
+                        help=f"Save a checkpoint after every hashing batch (default directory: {CHECKPOINT_DIR})")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the interrupted scan saved in the checkpoint, with its original settings")
+    parser.add_argument("--stream", metavar="FILE",
+                        help="Write each duplicate group to this CSV or NDJSON file as soon as it is confirmed")
+    parser.add_argument("--stream-format", choices=RESULT_FORMATS,
+                        help="Format of the --stream file (default: ndjson for .ndjson/.jsonl files, else csv)")
+    parser.add_argument("--results", nargs="?", const=RESULTS_PATH, metavar="DB",
+                        help=f"Store the duplicate groups in an indexed result database for dedup_results.py "
+                             f"(default: {RESULTS_PATH})")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the scan over this many worker processes that share --work-dir")
+    parser.add_argument("--work-dir", help="Shared directory the coordinator and shard workers exchange files in")
+    parser.add_argument("--external-workers", action="store_true",
+                        help="Do not start local shard workers; run them with --worker, e.g. on other hosts")
+    parser.add_argument("--worker", type=int, metavar="SHARD",
+                        help="Run shard worker SHARD of the job in --work-dir, then exit")
+    parser.add_argument("--output", "-o", help="Write JSON here instead of stdout")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Do not print progress to stderr")
+    return parser
+
+
+def resume_config(checkpoint_path):
+    """
+    Get the settings of the scan saved in a checkpoint.
+
+    Args:
+        checkpoint_path (str): Checkpoint directory
+
+    Returns:
+        ScanConfig: Saved settings set to resume, or None if there is no checkpoint
+    """
+    state = ScanCheckpoint(checkpoint_path).state()
+    if state is None:
+        return None
+    config = ScanConfig.from_dict(state['config'])
+    config.checkpoint_path = checkpoint_path
+    config.resume = True
+    return config
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.worker is not None:
+        if not args.work_dir:
+            parser.error("--worker needs --work-dir")
+        return 0 if run_worker(args.work_dir, args.worker) else 1
+    if args.shards > 1 and not args.work_dir:
+        parser.error("--shards needs --work-dir")
+    if args.shards > 1 and (args.resume or args.checkpoint):
+        parser.error("sharded scans cannot be checkpointed or resumed")
+
+    if args.resume:
+        config = resume_config(args.checkpoint or CHECKPOINT_DIR)
+        if config is None:
+            parser.error(f"no checkpoint to resume in {args.checkpoint or CHECKPOINT_DIR}")
+        return run_scan(config, args)
+    if not args.roots:
+        parser.error("the following arguments are required: roots")
+
+    config = ScanConfig(
+        args.roots,
+        min_size=args.min_size,
+        max_size=args.max_size,
+        skip_extensions=args.skip_ext.split(','),
+        algorithm=args.algorithm,
+        prefilter=args.prefilter,
+        backend=args.backend,
+        workers=args.workers,
+        walk_workers=args.walk_workers,
+        chunk_size=args.chunk_size,
+        partial_stages=[] if args.no_partial else PARTIAL_HASH_STAGES,
+        prune_sizes=not args.no_prune,
+        use_cache=not args.no_cache,
+        incremental=args.incremental,
+        lockstep_max_files=0 if args.no_lockstep else LOCKSTEP_MAX_FILES,
+        read_method=args.read_method,
+        read_order=args.read_order,
+        hdd_concurrency=args.hdd_concurrency,
+        max_read_rate=args.max_read_rate,
+        max_open_files=args.max_open_files,
+        max_cpu_percent=args.max_cpu,
+        max_load=args.max_load,
+        max_disk_busy=args.max_disk_busy,
+        metrics_path=args.metrics,
+        metrics_format=args.metrics_format,
+        metrics_interval=args.metrics_interval,
+        checkpoint_path=args.checkpoint,
+        results_path=args.results
+    )
+    return run_scan(config, args)
+
+
+def run_scan(config, args):
+    """Run a scan and write its result as the arguments ask."""
+    if args.shards > 1:
+        try:
+            engine = ShardCoordinator(config, args.work_dir, args.shards, local_workers=not args.external_workers)
+        except (ValueError, OSError) as e:
+            print(f"Cannot use work directory: {str(e)}", file=sys.stderr)
+            return 2
+    else:
+        engine = ScanEngine(config)
+    # With --stream, groups go to the report as they are confirmed instead of being collected
+    writer = ResultWriter(args.stream, args.stream_format) if args.stream else None
+
+    groups = []
+    linked = []
+    try:
+        for event in engine.run():
+            if event.kind == 'log' and not args.quiet:
+                print(event.data, file=sys.stderr)
+            elif event.kind == 'group':
+                if writer:
+                    writer.write(event.data)
+                else:
+                    groups.append(group_to_dict(event.data))
+            elif event.kind == 'linked':
+                linked.append({'size': event.data.size, 'paths': [record.path for record in event.data.files]})
+    except KeyboardInterrupt:
+        engine.stop()
+        print("Scan interrupted", file=sys.stderr)
+        if writer:
+            print(f"{writer.groups} duplicate groups found so far are in {writer.path}", file=sys.stderr)
+        if engine.checkpoint and engine.checkpoint.exists():
+            print(f"Continue it with --resume --checkpoint {engine.checkpoint.directory}", file=sys.stderr)
+        return 130
+    finally:
+        if writer:
+            writer.close()
+
+    if not args.quiet:
+        print("\n=== Scan Complete ===", file=sys.stderr)
+        for line in engine.summary():
+            print(line, file=sys.stderr)
+
+    result = {
+        'config': config.to_dict(),
+        'algorithm': config.algorithm,
+        'stats': engine.stats,
+        'stages': engine.stage_stats,
+        'groups': groups,
+        'linked': linked
+    }
+    if writer:
+        result['report'] = writer.path
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Required for the process backend in frozen builds
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Query the scan result store of Deduplicationator 3000.
+
+Scans run with `dedup_cli.py --results` (and every scan started from the
+GUI) store their duplicate groups in an indexed SQLite database. This tool
+answers the usual questions from it without loading a report, and prints
+JSON.
+
+Example:
+    python dedup_results.py top --limit 20
+    python dedup_results.py under /srv/share/archive
+    python dedup_results.py changed
+    python dedup_results.py runs
+"""
+
+import sys
+import json
+import argparse
+
+from result_store import ResultStore, RESULTS_PATH
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Query stored duplicate file scan results")
+    parser.add_argument("--db", default=RESULTS_PATH, help="Result database")
+    parser.add_argument("--run", type=int, help="Run to query (default: the latest completed run)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("runs", help="List stored runs, newest first")
+    top = commands.add_parser("top", help="Groups that free the most space")
+    top.add_argument("--limit", type=int, default=20, help="Number of groups")
+    under = commands.add_parser("under", help="Duplicate files below a directory")
+    under.add_argument("directory")
+    under.add_argument("--limit", type=int, default=-1, help="Maximum number of files")
+    changed = commands.add_parser("changed", help="Groups new or changed since an earlier run, "
+                                                  "and groups that were resolved")
+    changed.add_argument("--since", type=int, help="Run to compare with (default: the previous run of the same roots)")
+    files = commands.add_parser("files", help="Paths of a group")
+    files.add_argument("group", type=int)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    store = ResultStore(args.db)
+    try:
+        if args.command == 'runs':
+            result = [run._asdict() for run in store.runs()]
+        elif args.command == 'top':
+            result = [group._asdict() for group in store.top_groups(args.limit, args.run)]
+        elif args.command == 'under':
+            result = [record._asdict() for record in store.duplicates_under(args.directory, args.run, args.limit)]
+        elif args.command == 'changed':
+            result = {
+                'changed': [group._asdict() for group in store.changed_groups(args.run, args.since)],
+                'resolved': [group._asdict() for group in store.resolved_groups(args.run, args.since)]
+            }
+        else:
+            result = [record._asdict() for record in store.files(args.group)]
+    finally:
+        store.close()
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,8 @@
 Deduplicationator 3000
 
 A futuristic GUI application that helps users find and remove duplicate files efficiently.
-The application uses advanced file size and SHA-256 hashing to identify duplicates,
+The application uses file size, partial hashing and full-content hashing
+(SHA-256 by default) to identify duplicates,
 with configurable size limits and file extension filters.
 
 Key Features:
@@ -17,13 +18,10 @@ Key Features:
 """
 
 import os
-import hashlib
 import logging
-from collections import defaultdict
 import time
 from pathlib import Path
 import multiprocessing
-from concurrent.futures import ProcessPoolExecutor
 import psutil
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
@@ -31,7 +29,16 @@ import threading
 from datetime import datetime
 from PIL import Image, ImageTk, ImageDraw
 import math
-import csv
+from hash_algorithms import prefilter_algorithms, confirm_algorithms, DEFAULT_ALGORITHM, DEFAULT_PREFILTER
+from scan_engine import ScanConfig, ScanEngine, DuplicateGroup, format_size, NUM_WORKERS, HASH_BACKEND
+from ui_events import CoalescingEventQueue
+from action_plan import ActionPlan, ActionRunner, ACTION_MODES, interrupted_journals, rollback_journal
+from throttle import BUSY_LOAD, BUSY_DISK_PERCENT
+from scan_checkpoint import ScanCheckpoint
+from result_writer import ResultWriter
+from result_store import ResultStore, RESULTS_PATH
+
+MAX_LOG_LINES = 5000  # Lines kept in the progress log
 
 # Custom colors
 CYBER_PINK = "#FF00FF"
@@ -41,27 +48,6 @@ CYBER_PURPLE = "#9D00FF"
 CYBER_BLACK = "#0A0A0A"
 CYBER_WHITE = "#FFFFFF"
 
-def calculate_file_hash(filepath, chunk_size=1024*1024*4):  # 4MB chunks
-    """
-    Calculate SHA-256 hash of a file using chunked reading for memory efficiency.
-    
-    Args:
-        filepath (str): Path to the file to hash
-        chunk_size (int): Size of chunks to read (default: 4MB)
-        
-    Returns:
-        str: SHA-256 hash of the file, or None if an error occurs
-    """
-    try:
-        sha256_hash = hashlib.sha256()
-        with open(filepath, "rb") as f:
-            for byte_block in iter(lambda: f.read(chunk_size), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
-    except Exception as e:
-        logging.error(f"Error calculating hash for {filepath}: {str(e)}")
-        return None
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -71,14 +57,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Default configuration values
-MIN_FILE_SIZE = 1024 * 1024 * 1024 * 10  # 10GB
-MAX_FILE_SIZE = 1024 * 1024 * 1024 * 300  # 300GB
-CHUNK_SIZE = 1024 * 1024 * 4  # 4MB chunks for better performance
-SKIP_EXTENSIONS = {'.tmp', '.temp', '.log', '.cache'}
-BATCH_SIZE = 1000  # Process files in batches of 1000
-NUM_WORKERS = max(1, multiprocessing.cpu_count() - 1)  # Leave one core free
-
 class CyberButton(tk.Canvas):
     """Custom circular button with cyberpunk style and animations"""
     def __init__(self, parent, text, command, radius=50, color=CYBER_PINK, hover_color=CYBER_ORANGE, **kwargs):
@@ -220,6 +198,17 @@ class DuplicateFinderGUI:
         self.is_running = False
         self.auto_delete = tk.BooleanVar(value=False)
         self.export_csv = tk.BooleanVar(value=False)  # New variable for CSV export
+        self.use_cache = tk.BooleanVar(value=True)
+        self.incremental = tk.BooleanVar(value=False)
+        self.action_mode = tk.StringVar(value="delete")
+        self.hash_backend = tk.StringVar(value=HASH_BACKEND)
+        self.prefilter_algorithm = tk.StringVar(value=DEFAULT_PREFILTER)
+        self.hash_algorithm = tk.StringVar(value=DEFAULT_ALGORITHM)
+        self.num_workers = tk.StringVar(value=str(NUM_WORKERS))
+        self.max_read_rate = tk.StringVar(value="0")
+        self.max_cpu = tk.StringVar(value="0")
+        self.back_off_when_busy = tk.BooleanVar(value=False)
+        self.engine = None
         
         # Initialize statistics
         self.stats = {
@@ -228,15 +217,38 @@ class DuplicateFinderGUI:
             'hashed': 0,       # Files successfully hashed
             'duplicates': 0,   # Number of duplicate groups found
             'deleted': 0,      # Number of duplicate files deleted
+            'relinked': 0,     # Number of duplicate files replaced by a link to the kept file
             'size_saved': 0,   # Total space saved by deleting duplicates
-            'total_size': 0    # Total size of all processed files
+            'total_size': 0,   # Total size of all processed files
+            'pruned': 0,       # Files with a unique size that were never hashed
+            'pruned_size': 0   # Bytes not read thanks to size pruning
         }
+        # Counters of the running scan or apply thread; the Tk thread only sees snapshots in self.stats
+        self.worker_stats = dict(self.stats)
+        
+        # Report that duplicate groups are streamed to during a scan, if exporting
+        self.result_writer = None
         
-        # Store duplicate information for CSV export
-        self.duplicate_groups = []
+        # Groups waiting for review when auto-delete is off
+        self.action_plan = ActionPlan()
+        self.changed_groups = None  # Groups new or changed since the previous run, if known
+        self.review_window = None
         
         self.create_widgets()
         
+        # Scan threads only queue UI updates; the Tk thread renders them on a timer
+        self.ui_events = CoalescingEventQueue(self.root, {
+            'log': self.show_progress_lines,
+            'stats': self.show_stats,
+            'review': lambda _: self.show_review(),
+            'finished': self.scan_finished,
+            'applied': self.apply_finished
+        })
+        self.ui_events.start()
+        
+        # Offer to undo deletions left half-done by a crash
+        self.root.after(500, self.recover_interrupted_runs)
+        
     def start_move(self, event):
         """Start moving the window"""
         self.x = event.x
@@ -367,6 +379,93 @@ class DuplicateFinderGUI:
                       activeforeground=CYBER_WHITE,
                       variable=self.export_csv).pack(anchor="w", padx=5)
         
+        # Hash cache checkbox
+        tk.Checkbutton(options_frame,
+                      text="Reuse hashes of unchanged files from previous scans",
+                      font=('Cyberpunk', 10),
+                      fg=CYBER_WHITE, bg=CYBER_BLACK,
+                      selectcolor=CYBER_BLACK,
+                      activebackground=CYBER_BLACK,
+                      activeforeground=CYBER_WHITE,
+                      variable=self.use_cache).pack(anchor="w", padx=5)
+        
+        # Incremental rescan checkbox
+        tk.Checkbutton(options_frame,
+                      text="Incremental rescan (skip directories unchanged since the last scan)",
+                      font=('Cyberpunk', 10),
+                      fg=CYBER_WHITE, bg=CYBER_BLACK,
+                      selectcolor=CYBER_BLACK,
+                      activebackground=CYBER_BLACK,
+                      activeforeground=CYBER_WHITE,
+                      variable=self.incremental).pack(anchor="w", padx=5)
+        
+        # What happens to duplicates
+        action_frame = tk.Frame(options_frame, bg=CYBER_BLACK)
+        action_frame.pack(anchor="w", padx=5, pady=(5, 0))
+        tk.Label(action_frame, text="Duplicate Action:", font=('Cyberpunk', 10),
+                fg=CYBER_WHITE, bg=CYBER_BLACK).grid(row=0, column=0, padx=5)
+        ttk.Combobox(action_frame, textvariable=self.action_mode,
+                    values=ACTION_MODES, state="readonly",
+                    width=10, font=('Cyberpunk', 10)).grid(row=0, column=1, padx=5)
+        tk.Label(action_frame, text="(hardlink/reflink keep every path, pointing at the kept file's data)",
+                font=('Cyberpunk', 9), fg=CYBER_PURPLE, bg=CYBER_BLACK).grid(row=0, column=2, padx=5)
+        
+        # Hashing engine settings
+        engine_frame = tk.Frame(options_frame, bg=CYBER_BLACK)
+        engine_frame.pack(anchor="w", padx=5, pady=(5, 0))
+        
+        tk.Label(engine_frame, text="Hash Backend:", font=('Cyberpunk', 10),
+                fg=CYBER_WHITE, bg=CYBER_BLACK).grid(row=0, column=0, padx=5)
+        ttk.Combobox(engine_frame, textvariable=self.hash_backend,
+                    values=["thread", "process"], state="readonly",
+                    width=8, font=('Cyberpunk', 10)).grid(row=0, column=1, padx=5)
+        
+        tk.Label(engine_frame, text="Workers:", font=('Cyberpunk', 10),
+                fg=CYBER_WHITE, bg=CYBER_BLACK).grid(row=0, column=2, padx=5)
+        tk.Entry(engine_frame, textvariable=self.num_workers, width=5,
+                font=('Cyberpunk', 10),
+                bg=CYBER_BLACK, fg=CYBER_WHITE,
+                insertbackground=CYBER_PINK).grid(row=0, column=3, padx=5)
+        
+        tk.Label(engine_frame, text="Prefilter Hash:", font=('Cyberpunk', 10),
+                fg=CYBER_WHITE, bg=CYBER_BLACK).grid(row=0, column=4, padx=5)
+        ttk.Combobox(engine_frame, textvariable=self.prefilter_algorithm,
+                    values=prefilter_algorithms(), state="readonly",
+                    width=8, font=('Cyberpunk', 10)).grid(row=0, column=5, padx=5)
+        
+        tk.Label(engine_frame, text="Confirm Hash:", font=('Cyberpunk', 10),
+                fg=CYBER_WHITE, bg=CYBER_BLACK).grid(row=0, column=6, padx=5)
+        ttk.Combobox(engine_frame, textvariable=self.hash_algorithm,
+                    values=confirm_algorithms(), state="readonly",
+                    width=8, font=('Cyberpunk', 10)).grid(row=0, column=7, padx=5)
+        
+        # Resource limits, for scans on servers that must keep serving
+        throttle_frame = tk.Frame(options_frame, bg=CYBER_BLACK)
+        throttle_frame.pack(anchor="w", padx=5, pady=(5, 0))
+        
+        tk.Label(throttle_frame, text="Max Read (MB/s):", font=('Cyberpunk', 10),
+                fg=CYBER_WHITE, bg=CYBER_BLACK).grid(row=0, column=0, padx=5)
+        tk.Entry(throttle_frame, textvariable=self.max_read_rate, width=6,
+                font=('Cyberpunk', 10),
+                bg=CYBER_BLACK, fg=CYBER_WHITE,
+                insertbackground=CYBER_PINK).grid(row=0, column=1, padx=5)
+        
+        tk.Label(throttle_frame, text="Max CPU (%):", font=('Cyberpunk', 10),
+                fg=CYBER_WHITE, bg=CYBER_BLACK).grid(row=0, column=2, padx=5)
+        tk.Entry(throttle_frame, textvariable=self.max_cpu, width=5,
+                font=('Cyberpunk', 10),
+                bg=CYBER_BLACK, fg=CYBER_WHITE,
+                insertbackground=CYBER_PINK).grid(row=0, column=3, padx=5)
+        
+        tk.Checkbutton(throttle_frame,
+                      text="Back off while the system or disks are busy",
+                      font=('Cyberpunk', 10),
+                      fg=CYBER_WHITE, bg=CYBER_BLACK,
+                      selectcolor=CYBER_BLACK,
+                      activebackground=CYBER_BLACK,
+                      activeforeground=CYBER_WHITE,
+                      variable=self.back_off_when_busy).grid(row=0, column=4, padx=5)
+        
         # Control Buttons - Moved up before progress frame
         control_frame = tk.Frame(main_frame, bg=CYBER_BLACK)
         control_frame.pack(fill="x", pady=15)  # Reduced padding
@@ -382,6 +481,13 @@ class DuplicateFinderGUI:
                                       radius=50)
         self.start_button.pack(side="left", padx=30)
         
+        self.resume_button = CyberButton(button_container, "RESUME",
+                                       self.resume_scan,
+                                       color=CYBER_PURPLE,
+                                       hover_color=CYBER_ORANGE,
+                                       radius=50)
+        self.resume_button.pack(side="left", padx=30)
+        
         self.stop_button = CyberButton(button_container, "STOP",
                                      self.stop_scan,
                                      color=CYBER_PINK,
@@ -440,29 +546,51 @@ class DuplicateFinderGUI:
         Returns:
             str: Formatted size string (e.g., "1.5GB")
         """
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.1f}{unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.1f}TB"
+        return format_size(size_bytes)
     
     def update_progress(self, message):
         """
-        Update progress text with timestamp and scroll to bottom.
+        Queue a timestamped progress message. Safe to call from any thread.
         
         Args:
             message (str): Message to display
         """
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.progress_text.insert("end", f"[{timestamp}] {message}\n")
+        self.ui_events.put('log', f"[{timestamp}] {message}")
+        
+    def show_progress_lines(self, lines):
+        """
+        Append queued progress messages to the log and scroll to bottom.
+        
+        Args:
+            lines (list): Messages collected since the last UI tick
+        """
+        self.progress_text.insert("end", "\n".join(lines) + "\n")
+        
+        # Keep the log widget from growing without bound
+        excess = int(self.progress_text.index("end-1c").split('.')[0]) - MAX_LOG_LINES
+        if excess > 0:
+            self.progress_text.delete("1.0", f"{excess + 1}.0")
         self.progress_text.see("end")
-        self.root.update_idletasks()
         
         # Update progress bar based on processed files
         if hasattr(self, 'total_files'):
             progress = (self.stats['processed'] / self.total_files) * 100
             self.progress_bar.set_progress(progress)
 
+    def show_stats(self, stats):
+        """
+        Take over the newest counters of the scan or apply thread.
+        
+        Args:
+            stats (dict): Snapshot sent with publish_stats
+        """
+        self.stats = stats
+        
+    def publish_stats(self):
+        """Send a snapshot of the worker thread's counters to the Tk thread."""
+        self.ui_events.put('stats', dict(self.worker_stats))
+        
     def update_status(self):
         """Update status bar with current statistics."""
         if self.is_running:
@@ -473,9 +601,11 @@ class DuplicateFinderGUI:
             size_saved = self.format_size(stats['size_saved'])
             
             status = (f"Files: {stats['processed']} | Size: {total_size} | "
-                     f"Skipped: {stats['skipped']} | Hashed: {stats['hashed']} | "
-                     f"Duplicates: {stats['duplicates']} | Deleted: {stats['deleted']} | "
+                     f"Skipped: {stats['skipped']} | Pruned: {stats['pruned']} | Hashed: {stats['hashed']} | "
+                     f"Duplicates: {stats['duplicates']} | Deleted: {stats['deleted']} | Linked: {stats['relinked']} | "
                      f"Saved: {size_saved} | Speed: {speed:.1f} files/s")
+            if 'throttle' in stats:
+                status += f" | Throttle: {stats['throttle']}"
             
             self.status_var.set(status)
             self.root.after(1000, self.update_status)
@@ -508,8 +638,70 @@ class DuplicateFinderGUI:
             messagebox.showerror("Error", "Invalid size values")
             return
             
+        try:
+            workers = max(1, int(self.num_workers.get()))
+        except ValueError:
+            messagebox.showerror("Error", "Invalid number of workers")
+            return
+            
+        try:
+            max_read_rate = int(float(self.max_read_rate.get() or 0) * 1024 * 1024)
+            max_cpu = float(self.max_cpu.get() or 0)
+        except ValueError:
+            messagebox.showerror("Error", "Invalid resource limits")
+            return
+        back_off = self.back_off_when_busy.get()
+            
+        # Read every setting here, on the Tk thread; the scan thread never touches widgets
+        config = ScanConfig(
+            self.target_dir.get(),
+            min_size=min_size,
+            max_size=max_size,
+            skip_extensions=self.skip_extensions.get().split(','),
+            algorithm=self.hash_algorithm.get(),
+            prefilter=self.prefilter_algorithm.get(),
+            backend=self.hash_backend.get(),
+            workers=workers,
+            use_cache=self.use_cache.get(),
+            incremental=self.incremental.get(),
+            max_read_rate=max_read_rate,
+            max_cpu_percent=max_cpu,
+            max_load=BUSY_LOAD if back_off else 0,
+            max_disk_busy=BUSY_DISK_PERCENT if back_off else 0,
+            checkpoint_path=ScanCheckpoint().directory,
+            results_path=RESULTS_PATH
+        )
+        self.launch_scan(config)
+        
+    def resume_scan(self):
+        """Continue the last interrupted scan from its checkpoint, with its original settings."""
+        checkpoint = ScanCheckpoint()
+        state = checkpoint.state()
+        if state is None:
+            messagebox.showinfo("Resume", "There is no interrupted scan to resume")
+            return
+        if not messagebox.askyesno("Resume", f"Resume the scan of {checkpoint.describe()}?"):
+            return
+        config = ScanConfig.from_dict(state['config'])
+        config.resume = True
+        self.launch_scan(config)
+        
+    def launch_scan(self, config):
+        """
+        Start a scan on its own thread.
+        
+        Args:
+            config (ScanConfig): Settings of the scan
+        """
+        self.auto_delete_enabled = self.auto_delete.get()
+        self.action_mode_selected = self.action_mode.get()
+        self.export_csv_enabled = self.export_csv.get()
+        # The save dialog must run here, on the Tk thread; groups are written as they are found
+        self.result_writer = self.open_result_writer() if self.export_csv_enabled else None
+        
         self.is_running = True
         self.start_button.config(state="disabled")
+        self.resume_button.config(state="disabled")
         self.stop_button.config(state="normal")
         
         # Reset statistics
@@ -519,15 +711,19 @@ class DuplicateFinderGUI:
             'hashed': 0,
             'duplicates': 0,
             'deleted': 0,
+            'relinked': 0,
             'size_saved': 0,
-            'total_size': 0
+            'total_size': 0,
+            'pruned': 0,
+            'pruned_size': 0
         }
+        self.worker_stats = dict(self.stats)
         self.start_time = time.time()
         
         # Start the scan in a separate thread
         self.scan_thread = threading.Thread(
             target=self.run_scan,
-            args=(self.target_dir.get(), min_size, max_size)
+            args=(config,)
         )
         self.scan_thread.start()
         
@@ -537,261 +733,355 @@ class DuplicateFinderGUI:
     def stop_scan(self):
         """Stop the scanning process."""
         self.is_running = False
+        if self.engine:
+            self.engine.stop()
         self.stop_button.config(state="disabled")
         self.update_progress("\nScan stopped by user")
         
-    def run_scan(self, directory, min_size, max_size):
+    def run_scan(self, config):
         """
-        Run the main scanning process.
+        Run the main scanning process on the scan engine.
+        
+        Runs on the scan thread, so all UI output goes through update_progress
+        and the UI event queue.
         
         Args:
-            directory (str): Directory to scan
-            min_size (int): Minimum file size in bytes
-            max_size (int): Maximum file size in bytes
+            config (ScanConfig): Settings read from the GUI
         """
         try:
-            self.update_progress(f"Starting scan in: {directory}")
-            self.update_progress(f"File size range: {self.format_size(min_size)} - {self.format_size(max_size)}")
-            self.update_progress(f"Using {NUM_WORKERS} CPU cores for processing")
+            self.engine = ScanEngine(config)
+            self.action_plan = ActionPlan()
+            self.changed_groups = None
+            # Auto-delete applies each group as soon as it is found, journaled until the scan ends
+            self.action_runner = (ActionRunner(self.action_mode_selected, self.update_progress)
+                                  if self.auto_delete_enabled else None)
             
-            # Get extensions to skip
-            skip_extensions = set(ext.strip().lower() for ext in self.skip_extensions.get().split(','))
-            self.update_progress(f"Skipping extensions: {', '.join(skip_extensions)}")
-            
-            # Initialize size dictionary
-            size_dict = defaultdict(list)
-            
-            # Process files in batches
-            batch_size = BATCH_SIZE
-            current_batch = []
-            total_files = 0
-            
-            self.update_progress("\nScanning directory structure...")
-            for root, _, files in os.walk(directory):
+            for event in self.engine.run():
                 if not self.is_running:
-                    return
+                    self.engine.stop()
+                if event.kind == 'log':
+                    self.update_progress(event.data)
+                elif event.kind == 'stats':
+                    self.worker_stats.update(event.data)
+                    self.publish_stats()
+                elif event.kind == 'group':
+                    self.handle_duplicates(event.data)
+                elif event.kind == 'linked':
+                    self.update_progress(f"Already linked ({self.format_size(event.data.size)}): "
+                                         + " = ".join(record.path for record in event.data.files))
+                elif event.kind == 'done':
+                    self.worker_stats.update(event.data)
+                    self.publish_stats()
                     
-                total_files += len(files)
-                self.update_progress(f"Found {total_files} files so far...")
-                
-                for filename in files:
-                    if not self.is_running:
-                        return
-                        
-                    filepath = os.path.join(root, filename)
-                    try:
-                        # Skip files with specified extensions
-                        if any(filename.lower().endswith(ext) for ext in skip_extensions):
-                            self.stats['skipped'] += 1
-                            continue
-                            
-                        # Get file size
-                        size = os.path.getsize(filepath)
-                        self.stats['total_size'] += size
-                        
-                        # Skip files outside size range
-                        if size < min_size or size > max_size:
-                            self.stats['skipped'] += 1
-                            continue
-                            
-                        # Add to current batch
-                        current_batch.append((filepath, size))
-                        self.stats['processed'] += 1
-                        
-                        # Process batch when it reaches batch_size
-                        if len(current_batch) >= batch_size:
-                            self.update_progress(f"Processing batch of {len(current_batch)} files...")
-                            self.process_batch(current_batch, size_dict)
-                            current_batch = []
-                            
-                    except (PermissionError, OSError) as e:
-                        self.update_progress(f"Error accessing {filepath}: {str(e)}")
-                        continue
-                        
-            # Process remaining files
-            if current_batch:
-                self.update_progress(f"Processing final batch of {len(current_batch)} files...")
-                self.process_batch(current_batch, size_dict)
+            # Groups applied so far are verified; commit them even if the scan was stopped
+            if self.action_runner:
+                self.action_runner.finish()
                 
-            # Find and handle duplicates
-            self.update_progress("\nAnalyzing potential duplicates...")
-            self.handle_duplicates(size_dict)
-            
             if not self.is_running:
+                if self.engine.checkpoint and self.engine.checkpoint.exists():
+                    self.update_progress("RESUME continues this scan from its last checkpoint")
                 return
                 
             # Display final statistics
             self.update_progress("\n=== Scan Complete ===")
-            self.update_progress(f"Total files found: {total_files}")
-            self.update_progress(f"Files processed: {self.stats['processed']}")
-            self.update_progress(f"Total size processed: {self.format_size(self.stats['total_size'])}")
-            self.update_progress(f"Files skipped: {self.stats['skipped']}")
-            self.update_progress(f"Files hashed: {self.stats['hashed']}")
-            self.update_progress(f"Duplicate groups found: {self.stats['duplicates']}")
-            self.update_progress(f"Duplicate files deleted: {self.stats['deleted']}")
-            self.update_progress(f"Total space saved: {self.format_size(self.stats['size_saved'])}")
+            for line in self.engine.summary():
+                self.update_progress(line)
+            self.update_progress(f"Duplicate files deleted: {self.worker_stats['deleted']}")
+            self.update_progress(f"Duplicate files linked: {self.worker_stats['relinked']}")
+            self.update_progress(f"Total space saved: {self.format_size(self.worker_stats['size_saved'])}")
+            
+            # The review reads the groups back from the result store, largest savings first
+            if self.engine.run_id and not self.auto_delete_enabled:
+                self.load_results(config.results_path, self.engine.run_id)
+                
+            # Let the user review the collected groups now that nothing blocks the scan
+            if len(self.action_plan):
+                self.update_progress(f"{len(self.action_plan)} duplicate groups are waiting for review")
+                self.ui_events.put('review')
             
         except Exception as e:
             self.update_progress(f"Error: {str(e)}")
         finally:
+            # A stopped scan still leaves a valid report of the groups found so far
+            if self.result_writer:
+                try:
+                    self.result_writer.close()
+                    self.update_progress(f"\nExported {self.result_writer.groups} duplicate groups to: "
+                                         f"{self.result_writer.path}")
+                except OSError as e:
+                    self.update_progress(f"Error exporting duplicates: {str(e)}")
+                self.result_writer = None
             self.is_running = False
-            self.root.after(0, lambda: self.start_button.config(state="normal"))
-            self.root.after(0, lambda: self.stop_button.config(state="disabled"))
+            self.ui_events.put('finished')
+            
+    def scan_finished(self, _=None):
+        """Re-enable the controls once the scan thread is done."""
+        self.start_button.config(state="normal")
+        self.resume_button.config(state="normal")
+        self.stop_button.config(state="disabled")
             
-    def process_batch(self, batch, size_dict):
+    def handle_duplicates(self, group):
         """
-        Process a batch of files and update size dictionary.
+        Show a duplicate group found by the engine and delete it or queue it for review.
         
         Args:
-            batch (list): List of (filepath, size) tuples
-            size_dict (defaultdict): Dictionary to store files by size
+            group (DuplicateGroup): Identical files, most recently modified first
         """
-        for filepath, size in batch:
-            if not self.is_running:
-                return
-                
-            try:
-                # Calculate file hash
-                file_hash = calculate_file_hash(filepath)
-                if file_hash:
-                    self.stats['hashed'] += 1
-                    size_dict[size].append((filepath, file_hash))
-            except Exception as e:
-                self.update_progress(f"Error processing {filepath}: {str(e)}")
-                
-    def handle_duplicates(self, size_dict):
+        size = group.size
+        
+        self.update_progress(f"\nFound duplicate group ({self.format_size(size)}):")
+        
+        # Stream the group to the export file while the scan goes on
+        if self.result_writer:
+            self.result_writer.write(group)
+        
+        # Show files in group; modification times come from the walk, not from new stat calls
+        for i, record in enumerate(group.files, 1):
+            self.update_progress(f"{i}. {record.path} (Modified: {record.modified})")
+        for record in group.already_linked:
+            self.update_progress(f"   {record.path} (already a hardlink of {group.keep_file})")
+        
+        # Delete duplicates
+        if self.auto_delete_enabled:
+            self.delete_duplicates(group)
+        else:
+            # Never block the scan thread on a dialog; decide after the scan
+            if not self.engine.results:
+                self.action_plan.add(group)
+            self.update_progress("Queued for review")
+            
+    def load_results(self, results_path, run_id):
         """
-        Find and handle duplicate files.
+        Fill the review plan from the groups of a run in the result store.
         
         Args:
-            size_dict (defaultdict): Dictionary of files grouped by size
+            results_path (str): Result database
+            run_id (int): Run whose groups are reviewed
         """
-        self.duplicate_groups = []  # Reset duplicate groups for new scan
+        store = ResultStore(results_path)
+        try:
+            plan = ActionPlan()
+            for stored, files, links in store.groups(run_id):
+                plan.add(DuplicateGroup(stored.size, stored.digest, stored.algorithm, files, links))
+            self.changed_groups = len(store.changed_groups(run_id))
+            self.action_plan = plan
+        finally:
+            store.close()
+            
+    def show_review(self):
+        """Open the review window for the duplicate groups collected during the scan."""
+        if self.review_window is not None and self.review_window.winfo_exists():
+            self.review_window.destroy()
+            
+        plan = self.action_plan
+        window = tk.Toplevel(self.root)
+        window.title("Review Duplicates")
+        window.geometry("1000x600")
+        window.configure(bg=CYBER_BLACK)
+        self.review_window = window
+        
+        summary_var = tk.StringVar()
+        tk.Label(window, textvariable=summary_var, font=('Cyberpunk', 11),
+                fg=CYBER_GREEN, bg=CYBER_BLACK).pack(fill="x", padx=10, pady=5)
+        
+        # One row per group; double-click toggles approval
+        tree_frame = tk.Frame(window, bg=CYBER_BLACK)
+        tree_frame.pack(fill="both", expand=True, padx=10)
+        columns = ("approved", "size", "copies", "reclaimable", "keep")
+        tree = ttk.Treeview(tree_frame, columns=columns, show="headings", selectmode="extended")
+        for column, heading, width in [("approved", "Approved", 80), ("size", "File Size", 100),
+                                       ("copies", "Duplicates", 80), ("reclaimable", "Reclaimable", 100),
+                                       ("keep", "Keep", 600)]:
+            tree.heading(column, text=heading)
+            tree.column(column, width=width, stretch=(column == "keep"))
+        scrollbar = ttk.Scrollbar(tree_frame, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        tree.pack(fill="both", expand=True)
         
-        for size, files in size_dict.items():
-            if not self.is_running:
-                return
-
-            if len(files) < 2:
-                continue
-                
-            # Group files by hash
-            hash_groups = defaultdict(list)
-            for filepath, file_hash in files:
-                hash_groups[file_hash].append(filepath)
-                
-            # Handle duplicate groups
-            for file_hash, filepaths in hash_groups.items():
-                if len(filepaths) < 2:
-                    continue
-                    
-                self.stats['duplicates'] += 1
-                self.update_progress(f"\nFound duplicate group ({self.format_size(size)}):")
-                
-                # Keep the most recently modified file
-                filepaths.sort(key=lambda x: os.path.getmtime(x), reverse=True)
-                keep_file = filepaths[0]
-                
-                # Store duplicate information for CSV export
-                group_info = {
-                    'size': size,
-                    'keep_file': keep_file,
-                    'duplicate_files': filepaths[1:],
-                    'modified_time': datetime.fromtimestamp(os.path.getmtime(keep_file))
-                }
-                self.duplicate_groups.append(group_info)
+        for i, group in enumerate(plan.groups):
+            tree.insert("", "end", iid=str(i), values=(
+                "", self.format_size(group.size), len(group.duplicate_files),
+                self.format_size(group.reclaimable), group.keep_file))
+            
+        shown = set()  # Rows currently marked as approved
+        
+        def refresh():
+            # Only touch rows whose approval changed; plans can hold many thousands of groups
+            for i in shown ^ plan.approved:
+                tree.set(str(i), "approved", "YES" if i in plan.approved else "")
+            shown.clear()
+            shown.update(plan.approved)
+            summary = plan.summary()
+            summary_var.set(
+                f"Groups: {summary['groups']} | Approved: {summary['approved_groups']} | "
+                f"Files to delete: {summary['approved_files']} | "
+                f"Space to reclaim: {self.format_size(summary['approved_reclaimable'])} "
+                f"of {self.format_size(summary['reclaimable'])}"
+                + (f" | New or changed since last scan: {self.changed_groups}"
+                   if self.changed_groups is not None else ""))
                 
-                # Show files in group
-                for i, filepath in enumerate(filepaths, 1):
-                    mod_time = datetime.fromtimestamp(os.path.getmtime(filepath))
-                    self.update_progress(f"{i}. {filepath} (Modified: {mod_time})")
+        def toggle_selected(_=None):
+            for iid in tree.selection():
+                plan.toggle(int(iid))
+            refresh()
+            
+        def approve_all():
+            plan.approve_all()
+            refresh()
+            
+        def approve_directory():
+            directory = filedialog.askdirectory(parent=window, title="Approve groups whose duplicates are under")
+            if directory:
+                plan.approve_under(directory)
+                refresh()
                 
-                # Delete duplicates
-                if self.auto_delete.get():
-                    self.delete_duplicates(filepaths[1:], keep_file, size)
-                else:
-                    # Ask for confirmation
-                    msg = f"Found {len(filepaths)} duplicate files. Keep the most recent one and delete the rest?"
-                    if messagebox.askyesno("Confirm Deletion", msg):
-                        self.delete_duplicates(filepaths[1:], keep_file, size)
-                    else:
-                        self.update_progress("Skipping this group...")
-        
-        # Export to CSV if enabled
-        if self.export_csv.get() and self.duplicate_groups:
-            self.export_duplicates_to_csv()
+        def approve_size():
+            try:
+                min_size = self.get_size_in_bytes(threshold.get(), threshold_unit.get())
+            except ValueError:
+                messagebox.showerror("Error", "Invalid size value", parent=window)
+                return
+            plan.approve_min_size(min_size)
+            refresh()
             
-    def delete_duplicates(self, files_to_delete, keep_file, size):
+        def clear():
+            plan.clear_approvals()
+            refresh()
+            
+        def apply():
+            summary = plan.summary()
+            if not summary['approved_groups']:
+                messagebox.showinfo("Nothing Approved", "Approve some groups first.", parent=window)
+                return
+            mode = self.action_mode.get()
+            action = "Delete" if mode == "delete" else f"Replace with {mode}s"
+            msg = (f"{action}: {summary['approved_files']} duplicate files from "
+                   f"{summary['approved_groups']} groups, reclaiming "
+                   f"{self.format_size(summary['approved_reclaimable'])}?")
+            if messagebox.askyesno("Confirm Action", msg, parent=window):
+                window.destroy()
+                self.apply_plan(mode)
+                
+        tree.bind("<Double-1>", toggle_selected)
+        
+        controls = tk.Frame(window, bg=CYBER_BLACK)
+        controls.pack(fill="x", padx=10, pady=10)
+        button_style = dict(font=('Cyberpunk', 10), fg=CYBER_WHITE, bg=CYBER_BLACK,
+                            activebackground=CYBER_PURPLE, activeforeground=CYBER_WHITE)
+        
+        tk.Button(controls, text="Toggle Selected", command=toggle_selected, **button_style).pack(side="left", padx=3)
+        tk.Button(controls, text="Approve All", command=approve_all, **button_style).pack(side="left", padx=3)
+        tk.Button(controls, text="Approve Under Directory...", command=approve_directory,
+                 **button_style).pack(side="left", padx=3)
+        
+        threshold = tk.StringVar(value="100")
+        threshold_unit = tk.StringVar(value="MB")
+        tk.Button(controls, text="Approve Files >=", command=approve_size, **button_style).pack(side="left", padx=3)
+        tk.Entry(controls, textvariable=threshold, width=6, font=('Cyberpunk', 10),
+                bg=CYBER_BLACK, fg=CYBER_WHITE, insertbackground=CYBER_PINK).pack(side="left")
+        ttk.Combobox(controls, textvariable=threshold_unit, values=["KB", "MB", "GB", "TB"],
+                    state="readonly", width=4, font=('Cyberpunk', 10)).pack(side="left", padx=3)
+        
+        tk.Button(controls, text="Clear", command=clear, **button_style).pack(side="left", padx=3)
+        tk.Button(controls, text="Apply Approved", command=apply, font=('Cyberpunk', 10, 'bold'),
+                 fg=CYBER_BLACK, bg=CYBER_GREEN).pack(side="right", padx=3)
+        
+        refresh()
+        
+    def apply_plan(self, mode):
         """
-        Delete duplicate files.
+        Apply the action to the approved duplicates in one pass on a worker thread.
         
         Args:
-            files_to_delete (list): List of file paths to delete
-            keep_file (str): Path of the file to keep
-            size (int): Size of each file in bytes
+            mode (str): 'delete', 'hardlink' or 'reflink'
         """
-        for filepath in files_to_delete:
-            if not self.is_running:
-                return
-                
+        self.is_running = True
+        self.start_button.config(state="disabled")
+        self.resume_button.config(state="disabled")
+        self.stop_button.config(state="normal")
+        self.start_time = time.time()
+        self.worker_stats = dict(self.stats)
+        self.update_status()
+        
+        def run():
             try:
-                os.remove(filepath)
-                self.stats['deleted'] += 1
-                self.stats['size_saved'] += size
-                self.update_progress(f"Deleted: {filepath}")
+                self.update_progress(f"\n=== Applying Approved Actions ({mode}) ===")
+                result = self.action_plan.apply(self.update_progress, lambda: self.is_running, mode)
+                self.worker_stats['deleted'] += result['deleted']
+                self.worker_stats['relinked'] += result['linked']
+                self.worker_stats['size_saved'] += result['size_saved']
+                self.publish_stats()
+                self.update_progress(f"Duplicate files deleted: {result['deleted']}")
+                self.update_progress(f"Duplicate files linked: {result['linked']}")
+                self.update_progress(f"Total space saved: {self.format_size(result['size_saved'])}")
+                if result['errors']:
+                    self.update_progress(f"Errors: {result['errors']}")
             except Exception as e:
-                self.update_progress(f"Error deleting {filepath}: {str(e)}")
+                self.update_progress(f"Error: {str(e)}")
+            finally:
+                self.is_running = False
+                self.ui_events.put('applied')
                 
-        self.update_progress(f"Kept: {keep_file}")
+        threading.Thread(target=run).start()
+        
+    def apply_finished(self, _=None):
+        """Re-enable the controls once the approved deletions are done."""
+        self.action_plan = ActionPlan()
+        self.scan_finished()
+        
+    def delete_duplicates(self, group):
+        """
+        Delete the duplicate files of a group, or replace them with links.
+        
+        Args:
+            group (DuplicateGroup): Identical files; the first one is kept
+        """
+        runner = self.action_runner
+        before = dict(runner.result)
+        runner.apply_group(group)
+        self.worker_stats['deleted'] += runner.result['deleted'] - before['deleted']
+        self.worker_stats['relinked'] += runner.result['linked'] - before['linked']
+        self.worker_stats['size_saved'] += runner.result['size_saved'] - before['size_saved']
+        self.publish_stats()
 
-    def export_duplicates_to_csv(self):
-        """Export duplicate file information to a CSV file."""
+    def recover_interrupted_runs(self):
+        """Offer to roll back actions of runs that were interrupted by a crash."""
+        journals = interrupted_journals()
+        if not journals:
+            return
+        msg = (f"{len(journals)} earlier run(s) stopped while changing duplicate files.\n"
+               f"Restore the files they touched?")
+        if not messagebox.askyesno("Interrupted Run", msg):
+            return
+        for journal in journals:
+            try:
+                restored = rollback_journal(journal, self.update_progress)
+                self.update_progress(f"Rolled back {journal}: {restored} files restored")
+            except Exception as e:
+                self.update_progress(f"Error rolling back {journal}: {str(e)}")
+
+    def open_result_writer(self):
+        """
+        Ask where to export duplicate groups and create the report file.
+        
+        Returns:
+            ResultWriter: Open report, or None if the user cancelled or it could not be created
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filepath = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            initialfile=f"duplicate_files_{timestamp}.csv",
+            filetypes=[("CSV files", "*.csv"), ("NDJSON files", "*.ndjson"), ("All files", "*.*")]
+        )
+        if not filepath:  # User cancelled
+            return None
         try:
-            # Create filename with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"duplicate_files_{timestamp}.csv"
-            
-            # Get save location from user
-            filepath = filedialog.asksaveasfilename(
-                defaultextension=".csv",
-                initialfile=filename,
-                filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
-            )
-            
-            if not filepath:  # User cancelled
-                return
-                
-            with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                # Write header
-                writer.writerow(['Group', 'File Path', 'Size', 'Modified Time', 'Status'])
-                
-                # Write data
-                for i, group in enumerate(self.duplicate_groups, 1):
-                    # Write the file to keep
-                    writer.writerow([
-                        i,
-                        group['keep_file'],
-                        self.format_size(group['size']),
-                        group['modified_time'],
-                        'KEEP'
-                    ])
-                    # Write the duplicates
-                    for dup_file in group['duplicate_files']:
-                        writer.writerow([
-                            i,
-                            dup_file,
-                            self.format_size(group['size']),
-                            datetime.fromtimestamp(os.path.getmtime(dup_file)),
-                            'DUPLICATE'
-                        ])
-            
-            self.update_progress(f"\nExported duplicate information to: {filepath}")
-            messagebox.showinfo("Export Complete", f"Duplicate information has been exported to:\n{filepath}")
-            
-        except Exception as e:
-            self.update_progress(f"Error exporting to CSV: {str(e)}")
-            messagebox.showerror("Export Error", f"Failed to export duplicate information:\n{str(e)}")
+            return ResultWriter(filepath)
+        except OSError as e:
+            self.update_progress(f"Error exporting duplicates: {str(e)}")
+            messagebox.showerror("Export Error", f"Failed to create the export file:\n{str(e)}")
+            return None
 
 def main():
     """Initialize and start the application."""
@@ -809,4 +1099,5 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Required for the process backend in frozen builds
     main() 
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+Directory manifest for incremental rescans in Deduplicationator 3000.
+
+Stores, for every directory listed by a scan, its mtime together with its
+subdirectory names and the records of its files. Adding, removing or
+renaming an entry changes a directory's mtime, so on the next scan any
+directory whose mtime is unchanged can be answered from the manifest with a
+single stat instead of a listing plus a stat per file.
+
+Editing a file in place does not touch its directory's mtime, so records
+reused from the manifest may be stale. The scan engine re-stats the files
+that survive size pruning before hashing them, but size pruning itself
+trusts the manifest: a file edited in place so that it now has the size of
+another file is only found by a scan without the manifest.
+
+Directory paths are stored as file system bytes, so names that are not
+valid UTF-8 work too.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+
+from file_walker import FileRecord
+
+# Default manifest location and limits
+MANIFEST_PATH = str(Path.home() / ".deduplicationator3000" / "dir_manifest.db")
+MANIFEST_VERSION = 1          # Schema version, in PRAGMA user_version
+COMMIT_INTERVAL = 1000        # Directories stored before each commit
+RACY_WINDOW_NS = 2 * 10**9    # Listings this close to the directory mtime are not trusted
+
+logger = logging.getLogger(__name__)
+
+
+class DirectoryManifest:
+    """
+    SQLite-backed manifest of directory listings.
+
+    Unlike HashCache it is shared by the walker threads, so every database
+    access is serialized by a lock.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        """
+        Open (and create if needed) the manifest database.
+
+        Args:
+            path (str): Location of the SQLite database file
+        """
+        self.path = path
+        self.stats = {
+            'reused': 0,     # Directories answered from the manifest
+            'listed': 0,     # Directories listed from disk
+            'removed': 0     # Manifest entries of directories that no longer exist
+        }
+        self.scan_id = time.time_ns()
+        self.lock = threading.Lock()
+        self._pending = 0
+        self._seen = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS directories (
+                path BLOB PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                scan_id INTEGER NOT NULL,
+                subdirs TEXT NOT NULL,
+                files TEXT NOT NULL
+            )
+        """)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < MANIFEST_VERSION:
+            # Version 0 stored paths as text; those rows would never match again
+            self.conn.execute("DELETE FROM directories WHERE typeof(path) = 'text'")
+            self.conn.execute(f"PRAGMA user_version = {MANIFEST_VERSION}")
+        self.conn.commit()
+
+    def lookup(self, path, mtime_ns):
+        """
+        Get the stored listing of an unchanged directory.
+
+        Args:
+            path (str): Directory as passed to the walker
+            mtime_ns (int): Current mtime of the directory
+
+        Returns:
+            tuple: (subdirectory paths, FileRecords), or None if the directory
+            is unknown or has changed
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT subdirs, files FROM directories WHERE path=? AND mtime_ns=?",
+                (os.fsencode(os.path.abspath(path)), mtime_ns)
+            ).fetchone()
+            if row is None:
+                return None
+            self.stats['reused'] += 1
+            self._seen.append(os.fsencode(os.path.abspath(path)))
+            self._count_write()
+
+        subdirs = [os.path.join(path, name) for name in json.loads(row[0])]
+        # Rows written before link counts were recorded have five fields
+        records = [FileRecord(os.path.join(path, file_row[0]), *file_row[1:])
+                   for file_row in json.loads(row[1])]
+        return subdirs, records
+
+    def store(self, path, mtime_ns, listed_at_ns, subdirs, records):
+        """
+        Save the listing of a directory.
+
+        Args:
+            path (str): Directory as passed to the walker
+            mtime_ns (int): mtime of the directory, taken before listing it
+            listed_at_ns (int): time.time_ns() when the listing started
+            subdirs (list): Subdirectory paths
+            records (list): FileRecords of the files in the directory
+        """
+        # A change within the mtime granularity of the listing would go unnoticed
+        if listed_at_ns - mtime_ns < RACY_WINDOW_NS:
+            mtime_ns = -1
+        subdir_names = json.dumps([os.path.basename(subdir) for subdir in subdirs])
+        file_rows = json.dumps([(os.path.basename(record.path), record.size, record.inode,
+                                 record.device, record.mtime_ns, record.nlink) for record in records])
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                (os.fsencode(os.path.abspath(path)), mtime_ns, self.scan_id, subdir_names, file_rows)
+            )
+            self.stats['listed'] += 1
+            self._count_write()
+
+    def _count_write(self):
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self._flush()
+
+    def _flush(self):
+        if self._seen:
+            self.conn.executemany(
+                "UPDATE directories SET scan_id=? WHERE path=?",
+                ((self.scan_id, path) for path in self._seen)
+            )
+            self._seen = []
+        self.conn.commit()
+        self._pending = 0
+
+    def flush(self):
+        """Record reused directories and commit buffered writes."""
+        with self.lock:
+            self._flush()
+
+    def prune(self, roots):
+        """
+        Forget directories below the roots that were not seen by this scan.
+
+        Only call this after a complete walk; a stopped walk has not seen
+        every directory.
+
+        Args:
+            roots (list): Roots of the finished walk
+        """
+        with self.lock:
+            self._flush()
+            for root in roots:
+                root = os.fsencode(os.path.abspath(root))
+                prefix = os.path.join(root, b"")
+                cursor = self.conn.execute(
+                    "DELETE FROM directories WHERE scan_id<>? AND "
+                    "(path=? OR substr(path, 1, ?)=?)",
+                    (self.scan_id, root, len(prefix), prefix)
+                )
+                self.stats['removed'] += cursor.rowcount
+            self.conn.commit()
+
+    def report(self):
+        """
+        Summarize manifest effectiveness for the progress log.
+
+        Returns:
+            str: Reuse summary
+        """
+        return (f"Incremental scan: {self.stats['reused']} unchanged directories reused, "
+                f"{self.stats['listed']} listed, {self.stats['removed']} removed from the manifest")
+
+    def close(self):
+        """Flush pending work and close the database."""
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logger.error(f"Error finalizing directory manifest {self.path}: {str(e)}")
+        finally:
+            self.conn.close()
@@ -0,0 +1,153 @@
+"""
+Compact in-memory file catalog for Deduplicationator 3000.
+
+A scan of tens of millions of files cannot afford a Python object per path.
+The catalog interns every directory once and stores each file as a row of
+fixed-width arrays (directory id, basename offset, size, inode, device id,
+mtime, link count) plus its fs-encoded basename in one shared byte buffer. Digests are
+kept as raw bytes in a single buffer as well. Full paths and FileRecords
+are only materialized when a file is hashed, displayed or exported.
+"""
+
+import os
+from array import array
+
+from file_walker import FileRecord
+
+INDEX_TYPECODE = 'I'  # Row numbers; 32 bits is enough for 4 billion files
+
+
+class FileCatalog:
+    """Column store of FileRecords, addressed by row index."""
+
+    def __init__(self):
+        self.directories = []        # Interned directory paths, by id
+        self._directory_ids = {}     # Directory path -> id
+        self.device_numbers = []     # Interned st_dev values, by id
+        self._device_ids = {}        # st_dev -> id
+        self.dir_ids = array('I')
+        self.names = bytearray()     # Basenames, fs-encoded and concatenated
+        self.name_ends = array('Q')  # End offset of each basename in self.names
+        self.sizes = array('Q')
+        self.inodes = array('Q')
+        self.devices = array('H')    # Device ids; a scan spans few filesystems
+        self.mtimes = array('q')     # mtime_ns, may be negative
+        self.nlinks = array('I')     # Hardlink count of each file
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def add(self, record):
+        """
+        Append a file.
+
+        Args:
+            record (FileRecord): File found by the walk
+
+        Returns:
+            int: Row index of the file
+        """
+        directory, name = os.path.split(record.path)
+        dir_id = self._directory_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+
+        self.dir_ids.append(dir_id)
+        self.names += os.fsencode(name)
+        self.name_ends.append(len(self.names))
+        self.sizes.append(record.size)
+        self.inodes.append(record.inode)
+        self.devices.append(self._device_id(record.device))
+        self.mtimes.append(record.mtime_ns)
+        self.nlinks.append(record.nlink)
+        return len(self.sizes) - 1
+
+    def _device_id(self, device):
+        device_id = self._device_ids.get(device)
+        if device_id is None:
+            device_id = self._device_ids[device] = len(self.device_numbers)
+            self.device_numbers.append(device)
+        return device_id
+
+    def path(self, index):
+        """Full path of a row."""
+        start = self.name_ends[index - 1] if index else 0
+        name = os.fsdecode(bytes(self.names[start:self.name_ends[index]]))
+        return os.path.join(self.directories[self.dir_ids[index]], name)
+
+    def file_id(self, index):
+        """(device, inode) pair of a row, shared by hardlinks."""
+        return (self.device_numbers[self.devices[index]], self.inodes[index])
+
+    def fingerprint(self, index):
+        """Hash cache key of a row, see FileRecord.fingerprint."""
+        return (self.device_numbers[self.devices[index]], self.inodes[index],
+                self.sizes[index], self.mtimes[index])
+
+    def record(self, index):
+        """Materialize a row as a FileRecord."""
+        return FileRecord(self.path(index), self.sizes[index], self.inodes[index],
+                          self.device_numbers[self.devices[index]], self.mtimes[index],
+                          self.nlinks[index])
+
+    def update(self, index, st):
+        """
+        Refresh a row from a new stat result.
+
+        Args:
+            index (int): Catalog row index
+            st (os.stat_result): Current stat of the file
+
+        Returns:
+            bool: True if the row changed
+        """
+        self.nlinks[index] = st.st_nlink
+        if self.fingerprint(index) == (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns):
+            return False
+        self.sizes[index] = st.st_size
+        self.inodes[index] = st.st_ino
+        self.devices[index] = self._device_id(st.st_dev)
+        self.mtimes[index] = st.st_mtime_ns
+        return True
+
+    def nbytes(self):
+        """Approximate memory held by the per-file columns, in bytes."""
+        columns = (self.dir_ids, self.name_ends, self.sizes, self.inodes, self.devices, self.mtimes,
+                   self.nlinks)
+        return len(self.names) + sum(len(column) * column.itemsize for column in columns)
+
+
+class DigestTable:
+    """
+    Full-file digests of catalog rows, stored as fixed-width raw bytes.
+
+    Every digest of one scan comes from the same algorithm, so they all have
+    the same width and are packed back to back into one bytearray.
+    """
+
+    def __init__(self):
+        self.indexes = array(INDEX_TYPECODE)  # Catalog row of each digest
+        self.digests = bytearray()
+        self.width = None
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def add(self, index, digest):
+        """
+        Store the digest of a catalog row.
+
+        Args:
+            index (int): Catalog row index
+            digest (str): Hex digest as returned by the hash functions
+        """
+        raw = bytes.fromhex(digest)
+        if self.width is None:
+            self.width = len(raw)
+        self.indexes.append(index)
+        self.digests += raw
+
+    def digest(self, position):
+        """Raw digest stored at a position of the table."""
+        return bytes(self.digests[position * self.width:(position + 1) * self.width])
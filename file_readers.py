@@ -0,0 +1,234 @@
+"""
+File read strategies for full hashing in Deduplicationator 3000.
+
+Every reader yields the content of a file as a series of memoryview chunks.
+A chunk is only valid until the next one is requested, which lets readers
+reuse their buffers instead of allocating a new bytes object per read.
+
+    buffered  readinto() into one reusable per-thread buffer
+    fadvise   as buffered, plus posix_fadvise SEQUENTIAL before reading and
+              DONTNEED behind the reader, so a scan does not evict the page
+              cache of other applications on the host
+    mmap      map the file and hash slices of the mapping (no copy at all)
+    prefetch  a helper thread reads the next chunk into a second buffer
+              while the current one is being hashed
+
+Which one is fastest depends on the storage and the kernel; the selectable
+read methods exist so they can be compared on the hardware at hand.
+"""
+
+import os
+import mmap
+import time
+import queue
+import threading
+
+DEFAULT_READ_METHOD = 'buffered'
+PREFETCH_BUFFERS = 2  # Chunks in flight for the prefetch reader (double buffering)
+
+_buffers = threading.local()
+
+
+def _read_buffer(size, slot=0):
+    """Get one of this thread's reusable read buffers of the given size."""
+    pool = getattr(_buffers, 'pool', None)
+    if pool is None:
+        pool = _buffers.pool = {}
+    buffer = pool.get(slot)
+    if buffer is None or len(buffer) != size:
+        buffer = pool[slot] = memoryview(bytearray(size))
+    return buffer
+
+
+def _fadvise(fd, offset, length, advice_name):
+    """posix_fadvise where the platform has it; a no-op elsewhere."""
+    advice = getattr(os, advice_name, None)
+    if advice is not None:
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass  # Advice only; some filesystems reject it
+
+
+def read_buffered(filepath, chunk_size):
+    """
+    Read a file with readinto() into a reusable buffer.
+
+    Args:
+        filepath (str): File to read
+        chunk_size (int): Size of each read
+
+    Yields:
+        memoryview: Next chunk, valid until the following one is requested
+    """
+    buffer = _read_buffer(chunk_size)
+    with open(filepath, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            yield buffer[:n]
+
+
+def read_fadvise(filepath, chunk_size):
+    """
+    Read a file like read_buffered() and tell the kernel what we are doing.
+
+    The whole file is announced as sequential (larger readahead), and every
+    chunk already hashed is dropped from the page cache, since a scan
+    reads each file only once.
+
+    Args:
+        filepath (str): File to read
+        chunk_size (int): Size of each read
+
+    Yields:
+        memoryview: Next chunk, valid until the following one is requested
+    """
+    buffer = _read_buffer(chunk_size)
+    with open(filepath, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        _fadvise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        offset = 0
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            yield buffer[:n]
+            _fadvise(fd, offset, n, 'POSIX_FADV_DONTNEED')
+            offset += n
+
+
+def read_mmap(filepath, chunk_size):
+    """
+    Map a file into memory and yield slices of the mapping.
+
+    Args:
+        filepath (str): File to read
+        chunk_size (int): Size of each slice
+
+    Yields:
+        memoryview: Next chunk, valid until the following one is requested
+    """
+    with open(filepath, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return  # Empty files cannot be mapped
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapping:
+            if hasattr(mapping, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mapping.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapping)
+            try:
+                for offset in range(0, size, chunk_size):
+                    chunk = view[offset:offset + chunk_size]
+                    try:
+                        yield chunk
+                    finally:
+                        chunk.release()
+            finally:
+                view.release()
+
+
+def read_prefetch(filepath, chunk_size):
+    """
+    Read a file on a helper thread, one chunk ahead of the consumer.
+
+    While the caller hashes one buffer the helper fills the next, so disk
+    reads overlap hashing. Read errors are raised in the caller.
+
+    Args:
+        filepath (str): File to read
+        chunk_size (int): Size of each read
+
+    Yields:
+        memoryview: Next chunk, valid until the following one is requested
+    """
+    f = open(filepath, 'rb', buffering=0)
+    free = queue.SimpleQueue()
+    filled = queue.SimpleQueue()
+    for slot in range(PREFETCH_BUFFERS):
+        free.put(_read_buffer(chunk_size, slot))
+    stop = threading.Event()
+
+    def fill():
+        try:
+            while not stop.is_set():
+                buffer = free.get()
+                if buffer is None:
+                    break
+                n = f.readinto(buffer)
+                filled.put((buffer, n))
+                if not n:
+                    break
+        except Exception as e:
+            filled.put((None, e))
+
+    reader = threading.Thread(target=fill, name="prefetch", daemon=True)
+    reader.start()
+    try:
+        while True:
+            buffer, n = filled.get()
+            if buffer is None:
+                raise n
+            if not n:
+                break
+            yield buffer[:n]
+            free.put(buffer)
+    finally:
+        stop.set()
+        free.put(None)  # Wake the helper if it waits for a buffer
+        reader.join()
+        f.close()
+
+
+def paced(chunks, max_rate):
+    """
+    Slow a chunk iterator down to a maximum read rate.
+
+    Args:
+        chunks (iterator): Chunks from one of the read methods
+        max_rate (float): Bytes per second
+
+    Yields:
+        memoryview: The chunks, no faster than max_rate
+    """
+    start = time.monotonic()
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        yield chunk
+        ahead = total / max_rate - (time.monotonic() - start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+READ_METHODS = {
+    'buffered': read_buffered,
+    'fadvise': read_fadvise,
+    'mmap': read_mmap,
+    'prefetch': read_prefetch,
+}
+
+
+def read_chunks(filepath, chunk_size, method=DEFAULT_READ_METHOD, max_rate=0):
+    """
+    Read a file with a registered read method.
+
+    Args:
+        filepath (str): File to read
+        chunk_size (int): Size of each chunk
+        method (str): Name from READ_METHODS
+        max_rate (float): Bytes per second, 0 for unlimited
+
+    Returns:
+        iterator: memoryview chunks, each valid until the next is requested
+
+    Raises:
+        ValueError: If the read method is unknown
+    """
+    try:
+        reader = READ_METHODS[method]
+    except KeyError:
+        raise ValueError(f"Unknown read method: {method}")
+    chunks = reader(filepath, chunk_size)
+    return paced(chunks, max_rate) if max_rate else chunks
@@ -0,0 +1,343 @@
+"""
+Directory traversal for Deduplicationator 3000.
+
+Walks directory trees with os.scandir and reuses the stat information of
+each DirEntry, so every file costs at most one stat call (none for the
+type check). Directories are spread across a small work-stealing thread
+pool and file records are streamed to the caller in fixed-size chunks
+instead of per-directory lists.
+
+The FileRecord built from that single stat travels with the file through
+every later stage (hashing, keep policy, display, CSV, deletion), so no
+stage needs to stat the file again.
+"""
+
+import os
+import queue
+import threading
+import time
+import zlib
+import logging
+from collections import deque, namedtuple
+from datetime import datetime
+
+WALK_WORKERS = 8          # Threads listing directories in parallel
+RECORD_CHUNK_SIZE = 512   # Records handed to the consumer at a time
+
+logger = logging.getLogger(__name__)
+
+class FileRecord(namedtuple('FileRecord', ['path', 'size', 'inode', 'device', 'mtime_ns', 'nlink'],
+                            defaults=(1,))):
+    """
+    One record per regular file, filled from the stat made during the walk.
+
+    Tuple-backed and without a per-instance __dict__, so millions of them
+    stay compact in memory.
+    """
+    __slots__ = ()
+
+    @property
+    def fingerprint(self):
+        """Key identifying this version of the file, as used by the hash cache."""
+        return (self.device, self.inode, self.size, self.mtime_ns)
+
+    @property
+    def file_id(self):
+        """(device, inode) pair shared by all hardlinks of the same file."""
+        return (self.device, self.inode)
+
+    @property
+    def mtime(self):
+        """Modification time in seconds since the epoch."""
+        return self.mtime_ns / 1e9
+
+    @property
+    def modified(self):
+        """Modification time as a local datetime, for display and export."""
+        return datetime.fromtimestamp(self.mtime)
+
+
+def _entry_record(entry):
+    """
+    Build a FileRecord from a DirEntry, reusing its cached stat result.
+
+    Args:
+        entry (os.DirEntry): Directory entry of a regular file
+
+    Returns:
+        FileRecord: Record for the file
+    """
+    st = entry.stat()
+    if not st.st_ino:
+        # On Windows DirEntry.stat() leaves inode and device at zero
+        st = os.stat(entry.path)
+    return FileRecord(entry.path, st.st_size, st.st_ino, st.st_dev, st.st_mtime_ns, st.st_nlink)
+
+
+def _scan_dir(path, on_error, manifest=None):
+    """
+    List one directory.
+
+    With a manifest, an unchanged directory costs a single stat: its listing
+    is replayed from the manifest. Changed directories are listed from disk
+    and their new listing is stored.
+
+    Args:
+        path (str): Directory to list
+        on_error (callable): Called as on_error(path, exception) on failures
+        manifest (DirectoryManifest): Listings from the previous scan, or None
+
+    Yields:
+        tuple: ('dir', path) for subdirectories, ('file', FileRecord) for regular
+        files; symlinks are skipped, since they hold no data of their own
+    """
+    if manifest is not None:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError as e:
+            on_error(path, e)
+            return
+        stored = manifest.lookup(path, mtime_ns)
+        if stored is not None:
+            subdirs, records = stored
+            for subdir in subdirs:
+                yield 'dir', subdir
+            for record in records:
+                yield 'file', record
+            return
+        listed_at_ns = time.time_ns()
+        subdirs, records = [], []
+
+    complete = True
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if manifest is not None:
+                            subdirs.append(entry.path)
+                        yield 'dir', entry.path
+                    elif entry.is_file(follow_symlinks=False):
+                        record = _entry_record(entry)
+                        if manifest is not None:
+                            records.append(record)
+                        yield 'file', record
+                except OSError as e:
+                    complete = False
+                    on_error(entry.path, e)
+    except OSError as e:
+        complete = False
+        on_error(path, e)
+
+    # Only complete listings may be replayed by later scans
+    if manifest is not None and complete:
+        manifest.store(path, mtime_ns, listed_at_ns, subdirs, records)
+
+
+def _log_error(path, error):
+    logger.error(f"Error accessing {path}: {str(error)}")
+
+
+def walk_files(roots, workers=WALK_WORKERS, on_error=None, is_running=lambda: True, manifest=None):
+    """
+    Walk one or more directory trees and stream a record for every file.
+
+    Args:
+        roots (str or list): Directory or directories to walk
+        workers (int): Number of traversal threads; 1 walks on the calling thread
+        on_error (callable): Called as on_error(path, exception) for unreadable entries
+        is_running (callable): Returns False when the walk should stop early
+        manifest (DirectoryManifest): Reuse listings of unchanged directories from
+            a previous walk and record the new ones
+
+    Yields:
+        FileRecord: (path, size, inode, device, mtime_ns, nlink) for each regular file
+    """
+    if isinstance(roots, (str, os.PathLike)):
+        roots = [roots]
+    on_error = on_error or _log_error
+
+    if workers <= 1:
+        stack = list(reversed([os.fspath(root) for root in roots]))
+        while stack and is_running():
+            for kind, item in _scan_dir(stack.pop(), on_error, manifest):
+                if kind == 'dir':
+                    stack.append(item)
+                else:
+                    yield item
+        return
+
+    walker = _ParallelWalker(roots, workers, on_error, is_running, manifest)
+    yield from walker.records()
+
+
+def walk_shard(roots, shards, shard, workers=WALK_WORKERS, on_error=None, is_running=lambda: True,
+               manifest=None):
+    """
+    Walk the part of one or more directory trees that belongs to a shard.
+
+    With at least as many roots as shards, every shard walks whole roots.
+    Otherwise the entries directly below the roots are spread over the
+    shards by a hash of their path, and each shard walks the subdirectories
+    it owns in full. All shards compute the same split independently.
+
+    Args:
+        roots (str or list): Directory or directories to walk
+        shards (int): Number of shards
+        shard (int): This shard, from 0 to shards - 1
+        workers (int): Number of traversal threads
+        on_error (callable): Called as on_error(path, exception) for unreadable entries
+        is_running (callable): Returns False when the walk should stop early
+        manifest (DirectoryManifest): Listings from a previous walk, see walk_files
+
+    Yields:
+        FileRecord: Record for each regular file of the shard
+    """
+    if isinstance(roots, (str, os.PathLike)):
+        roots = [roots]
+    roots = [os.fspath(root) for root in roots]
+    if len(roots) >= shards:
+        yield from walk_files(sorted(roots)[shard::shards], workers, on_error, is_running, manifest)
+        return
+
+    on_error = on_error or _log_error
+    owned = []
+    for root in roots:
+        for kind, item in _scan_dir(root, on_error, manifest):
+            path = item if kind == 'dir' else item.path
+            if zlib.crc32(os.fsencode(path)) % shards != shard:
+                continue
+            if kind == 'dir':
+                owned.append(path)
+            else:
+                yield item
+    yield from walk_files(owned, workers, on_error, is_running, manifest)
+
+
+class _ParallelWalker:
+    """
+    Work-stealing directory walker.
+
+    Each worker owns a deque of directories: it pushes subdirectories it
+    finds and pops from the same end (depth first, good locality). A worker
+    whose deque is empty steals from the opposite end of another worker's
+    deque, which hands out the largest remaining subtrees first.
+    """
+
+    def __init__(self, roots, workers, on_error, is_running, manifest):
+        self.workers = workers
+        self.on_error = on_error
+        self.is_running = is_running
+        self.manifest = manifest
+        self.deques = [deque() for _ in range(workers)]
+        self.output = queue.Queue(maxsize=workers * 4)
+        self.condition = threading.Condition()
+        self.pending = 0          # Directories queued or being listed
+        self.stopped = False
+        self.error = None         # First unexpected exception of a worker, raised by records()
+
+        for i, root in enumerate(roots):
+            self.deques[i % workers].append(os.fspath(root))
+            self.pending += 1
+
+    def records(self):
+        """
+        Run the workers and yield records as they arrive.
+
+        Raises:
+            Exception: The first unexpected error of a worker thread (e.g.
+                from the manifest database), after all workers have stopped
+        """
+        threads = [
+            threading.Thread(target=self._work, args=(i,), name=f"walk-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        finished = 0
+        try:
+            while finished < self.workers and self.is_running():
+                chunk = self.output.get()
+                if chunk is None:
+                    finished += 1
+                    continue
+                yield from chunk
+        finally:
+            self._stop()
+            # Unblock workers waiting on a full output queue
+            while finished < self.workers:
+                try:
+                    if self.output.get(timeout=0.1) is None:
+                        finished += 1
+                except queue.Empty:
+                    if not any(thread.is_alive() for thread in threads):
+                        break
+        if self.error is not None:
+            raise self.error
+
+    def _stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def _next_dir(self, index):
+        """Pop local work or steal from another worker; None when the walk is over."""
+        own = self.deques[index]
+        while True:
+            try:
+                return own.pop()
+            except IndexError:
+                pass
+            for offset in range(1, self.workers):
+                try:
+                    return self.deques[(index + offset) % self.workers].popleft()
+                except IndexError:
+                    continue
+            with self.condition:
+                if self.stopped or self.pending == 0:
+                    return None
+                self.condition.wait(0.05)
+
+    def _work(self, index):
+        own = self.deques[index]
+        chunk = []
+        try:
+            while True:
+                if not self.is_running():
+                    self._stop()
+                path = self._next_dir(index)
+                if path is None:
+                    break
+
+                try:
+                    for kind, item in _scan_dir(path, self.on_error, self.manifest):
+                        if kind == 'dir':
+                            with self.condition:
+                                self.pending += 1
+                                own.append(item)
+                                self.condition.notify()
+                        else:
+                            chunk.append(item)
+                            if len(chunk) >= RECORD_CHUNK_SIZE:
+                                self.output.put(chunk)
+                                chunk = []
+                except Exception as e:
+                    # Other workers would wait forever for this directory; stop the whole walk
+                    with self.condition:
+                        if self.error is None:
+                            self.error = e
+                    self._stop()
+                finally:
+                    with self.condition:
+                        self.pending -= 1
+                        if self.pending == 0:
+                            self.condition.notify_all()
+                # Hand over partial chunks when local work runs dry so the consumer never waits
+                if chunk and not own:
+                    self.output.put(chunk)
+                    chunk = []
+        finally:
+            if chunk and not self.stopped:
+                self.output.put(chunk)
+            self.output.put(None)
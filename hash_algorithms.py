@@ -0,0 +1,90 @@
+"""
+Hash algorithm registry for Deduplicationator 3000.
+
+Maps algorithm names to hasher factories with the hashlib interface
+(update() / hexdigest()). Cryptographic hashes confirm duplicates; cheap
+checksums from zlib are only fast enough pre-filters, since a checksum
+collision is far too likely to decide that two files are identical.
+"""
+
+import hashlib
+import zlib
+
+
+class ChecksumHash:
+    """hashlib-style wrapper around a zlib rolling checksum."""
+
+    def __init__(self, func, initial):
+        self.func = func
+        self.value = initial
+
+    def update(self, data):
+        self.value = self.func(data, self.value)
+
+    def hexdigest(self):
+        return f"{self.value & 0xffffffff:08x}"
+
+
+def crc32():
+    """Create a CRC32 checksum hasher."""
+    return ChecksumHash(zlib.crc32, 0)
+
+
+def adler32():
+    """Create an Adler-32 checksum hasher."""
+    return ChecksumHash(zlib.adler32, 1)
+
+
+# name -> (factory, prefilter_only)
+HASH_ALGORITHMS = {
+    'sha256': (hashlib.sha256, False),
+    'blake2b': (hashlib.blake2b, False),
+    'blake2s': (hashlib.blake2s, False),
+    'crc32': (crc32, True),
+    'adler32': (adler32, True),
+}
+
+DEFAULT_ALGORITHM = 'sha256'     # Used to confirm duplicates
+DEFAULT_PREFILTER = 'crc32'      # Used for partial hashing stages
+
+
+def register_algorithm(name, factory, prefilter_only=False):
+    """
+    Add a hash algorithm to the registry.
+
+    Args:
+        name (str): Name used in settings, cache entries and exports
+        factory (callable): Returns a new hasher with update() and hexdigest()
+        prefilter_only (bool): True if the hash is too weak to confirm duplicates
+    """
+    HASH_ALGORITHMS[name] = (factory, prefilter_only)
+
+
+def new_hasher(name):
+    """
+    Create a hasher for a registered algorithm.
+
+    Args:
+        name (str): Algorithm name
+
+    Returns:
+        object: Hasher with update() and hexdigest()
+
+    Raises:
+        ValueError: If the algorithm is not registered
+    """
+    try:
+        factory, _ = HASH_ALGORITHMS[name]
+    except KeyError:
+        raise ValueError(f"Unknown hash algorithm: {name}")
+    return factory()
+
+
+def prefilter_algorithms():
+    """Names of all algorithms usable for early filtering."""
+    return list(HASH_ALGORITHMS)
+
+
+def confirm_algorithms():
+    """Names of algorithms strong enough to confirm duplicates."""
+    return [name for name, (_, prefilter_only) in HASH_ALGORITHMS.items() if not prefilter_only]
@@ -0,0 +1,219 @@
+"""
+Persistent hash cache for Deduplicationator 3000.
+
+Stores full and partial file hashes in a local SQLite database keyed by the
+file fingerprint (device, inode, size, mtime_ns). A file whose fingerprint
+has not changed since the previous scan gets its hashes back without any of
+its content being read, so rescanning an unchanged tree only costs a
+metadata walk.
+"""
+
+import os
+import sqlite3
+import time
+import logging
+from pathlib import Path
+
+# Default cache location and limits
+CACHE_PATH = str(Path.home() / ".deduplicationator3000" / "hash_cache.db")
+MAX_CACHE_BYTES = 1024 * 1024 * 512  # Least recently used entries are evicted beyond this
+COMMIT_INTERVAL = 1000               # Writes buffered before each commit
+
+logger = logging.getLogger(__name__)
+
+
+class HashCache:
+    """
+    SQLite-backed cache of file hashes.
+
+    Each entry is a (fingerprint, kind) pair, where kind names the hash
+    algorithm and hashing stage (e.g. 'sha256:full'), so hashes made with
+    different algorithms or stage settings are never mixed. Files that a
+    lockstep comparison ruled out have no hash; their 'lockstep' entry
+    holds the comparison_key() of the files they were compared with
+    instead. Fingerprints
+    are (device, inode, size, mtime_ns) tuples from FileCatalog.fingerprint().
+    A connection must only be used from the thread that opened it.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES):
+        """
+        Open (and create if needed) the cache database.
+
+        Args:
+            path (str): Location of the SQLite database file
+            max_bytes (int): Size the entries may take up in the database
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = {
+            'hits': 0,       # Lookups answered from the cache
+            'misses': 0,     # Lookups that required reading the file
+            'writes': 0,     # Hashes stored
+            'evicted': 0     # Entries removed to stay under max_bytes
+        }
+        self._pending = 0
+        self._touched = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        # Lets evict() return freed pages to the file system (new databases only)
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (device, inode, size, mtime_ns, kind)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)")
+        self.conn.commit()
+
+    def get(self, fingerprint, kind='sha256:full'):
+        """
+        Look up a cached hash.
+
+        Args:
+            fingerprint (tuple): File fingerprint
+            kind (str): Hash algorithm and stage, e.g. 'sha256:full'
+
+        Returns:
+            str: The cached hash, or None on a miss
+        """
+        digest = self.lookup(fingerprint, kind)
+        if digest is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self._touched.append((*fingerprint, kind))
+        return digest
+
+    def lookup(self, fingerprint, kind='sha256:full'):
+        """
+        Look up a cached hash without counting a hit or miss.
+
+        Args:
+            fingerprint (tuple): File fingerprint
+            kind (str): Hash algorithm and stage, e.g. 'sha256:full'
+
+        Returns:
+            str: The cached hash, or None if there is none
+        """
+        row = self.conn.execute(
+            "SELECT digest FROM hashes WHERE device=? AND inode=? AND size=? AND mtime_ns=? AND kind=?",
+            (*fingerprint, kind)
+        ).fetchone()
+        return row[0] if row else None
+
+    def contains(self, fingerprint, kind='sha256:full'):
+        """
+        Check for a cached hash without counting a hit or miss.
+
+        Args:
+            fingerprint (tuple): File fingerprint
+            kind (str): Hash algorithm and stage, e.g. 'sha256:full'
+
+        Returns:
+            bool: True if a hash is cached
+        """
+        return self.lookup(fingerprint, kind) is not None
+
+    def put(self, fingerprint, digest, kind='sha256:full'):
+        """
+        Store a hash, replacing entries left over from older versions of the file.
+
+        Args:
+            fingerprint (tuple): File fingerprint
+            digest (str): Hash to store
+            kind (str): Hash algorithm and stage, e.g. 'sha256:full'
+        """
+        device, inode, size, mtime_ns = fingerprint
+        # Any entry for the same inode with another size/mtime is stale
+        self.conn.execute(
+            "DELETE FROM hashes WHERE device=? AND inode=? AND (size<>? OR mtime_ns<>?)",
+            (device, inode, size, mtime_ns)
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (device, inode, size, mtime_ns, kind, digest, time.time())
+        )
+        self.stats['writes'] += 1
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.flush()
+
+    def invalidate(self, fingerprint):
+        """
+        Remove every cached hash of a file, e.g. one that no longer exists.
+
+        Args:
+            fingerprint (tuple): Fingerprint of any version of the file
+        """
+        device, inode = fingerprint[:2]
+        self.conn.execute("DELETE FROM hashes WHERE device=? AND inode=?", (device, inode))
+        self._pending += 1
+
+    def flush(self):
+        """Record lookups and commit buffered writes."""
+        if self._touched:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE hashes SET last_used=? WHERE device=? AND inode=? AND size=? AND mtime_ns=? AND kind=?",
+                ((now, *key) for key in self._touched)
+            )
+            self._touched = []
+        self.conn.commit()
+        self._pending = 0
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        used = (pages - free_pages) * page_size
+        if used <= self.max_bytes:
+            return
+        # Entries (and their index rows) are all about the same size
+        count = self.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        excess = count - count * self.max_bytes // used
+        self.conn.execute(
+            "DELETE FROM hashes WHERE rowid IN "
+            "(SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)",
+            (excess,)
+        )
+        self.stats['evicted'] += excess
+        self.conn.commit()
+        # Run to completion; execute() would free a single page per step
+        self.conn.executescript("PRAGMA incremental_vacuum;")
+
+    def report(self):
+        """
+        Summarize cache effectiveness for the progress log.
+
+        Returns:
+            str: Hit/miss summary
+        """
+        lookups = self.stats['hits'] + self.stats['misses']
+        hit_rate = self.stats['hits'] / lookups * 100 if lookups else 0
+        return (f"Hash cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+                f"({hit_rate:.1f}% hit rate), {self.stats['writes']} stored, "
+                f"{self.stats['evicted']} evicted")
+
+    def close(self):
+        """Flush pending work, enforce the size limit and close the database."""
+        try:
+            self.flush()
+            self.evict()
+        except sqlite3.Error as e:
+            logger.error(f"Error finalizing hash cache {self.path}: {str(e)}")
+        finally:
+            self.conn.close()
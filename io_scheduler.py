@@ -0,0 +1,200 @@
+"""
+Per-device read scheduling for Deduplicationator 3000.
+
+Parallel reads are what NVMe drives need to reach full speed, but several
+concurrent readers on a spinning disk make its head jump between files and
+are much slower than reading one file after the other. The scheduler splits
+the files to hash by device, gives every device its own concurrency limit
+(low for rotational disks, the full pool for SSDs and anything unknown) and
+reads the files of each device in the order they are stored on disk: by
+inode number, or by the physical offset of their first extent.
+"""
+
+import os
+import struct
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+HDD_CONCURRENCY = 1           # Reads in flight per rotational disk
+READ_ORDERS = ('inode', 'extent', 'walk')
+DEFAULT_READ_ORDER = 'inode'
+SYS_DEV_BLOCK = "/sys/dev/block"
+
+# FS_IOC_FIEMAP request for the first extent of a file
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct("=QQIIII")     # start, length, flags, mapped, count, reserved
+FIEMAP_EXTENT = struct.Struct("=QQQQQI12x")  # logical, physical, length, reserved x2, flags
+FIEMAP_FLAG_SYNC = 0x1
+
+
+@lru_cache(maxsize=None)
+def is_rotational(device):
+    """
+    Check whether a device is a spinning disk.
+
+    Args:
+        device (int): st_dev of a file on the device
+
+    Returns:
+        bool: True for rotational disks, False for SSDs, None if unknown
+        (network and virtual filesystems, or a platform without sysfs)
+    """
+    if not hasattr(os, 'major'):
+        return None
+    block = os.path.join(SYS_DEV_BLOCK, f"{os.major(device)}:{os.minor(device)}")
+    # Partitions have no queue directory of their own; it belongs to the whole disk
+    for directory in (block, os.path.join(os.path.realpath(block), os.pardir)):
+        try:
+            with open(os.path.join(directory, "queue", "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def physical_offset(filepath):
+    """
+    Get the on-disk offset of the start of a file.
+
+    Args:
+        filepath (str): File to look up
+
+    Returns:
+        int: Physical byte offset of the first extent, or None if the
+        filesystem cannot tell (no FIEMAP support, empty or inline file)
+    """
+    if fcntl is None:
+        return None
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    FIEMAP_HEADER.pack_into(request, 0, 0, 2**64 - 1, FIEMAP_FLAG_SYNC, 0, 1, 0)
+    try:
+        with open(filepath, 'rb', buffering=0) as f:
+            fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    if not FIEMAP_HEADER.unpack_from(request)[3]:
+        return None
+    return FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)[1]
+
+
+class DeviceScheduler:
+    """Splits catalog rows into per-device lanes in on-disk order."""
+
+    def __init__(self, catalog, max_in_flight, order=DEFAULT_READ_ORDER, hdd_concurrency=HDD_CONCURRENCY):
+        """
+        Args:
+            catalog (FileCatalog): Catalog the rows belong to
+            max_in_flight (int): Reads in flight for SSDs and unknown devices
+            order (str): 'inode', 'extent' or 'walk' (no reordering)
+            hdd_concurrency (int): Reads in flight per rotational disk
+        """
+        if order not in READ_ORDERS:
+            raise ValueError(f"Unknown read order: {order}")
+        self.catalog = catalog
+        self.max_in_flight = max_in_flight
+        self.order = order
+        self.hdd_concurrency = max(1, hdd_concurrency)
+        # Catalog row -> physical offset of its first extent (None if unknown);
+        # every stage splits its rows again, the FIEMAP lookups are done once
+        self.offsets = {}
+
+    def rotational(self, device_id):
+        """is_rotational() for an interned catalog device id."""
+        return is_rotational(self.catalog.device_numbers[device_id])
+
+    def limit(self, device_id):
+        """Reads allowed in flight on a device."""
+        return self.hdd_concurrency if self.rotational(device_id) else self.max_in_flight
+
+    def _sort_key(self, device_id):
+        catalog = self.catalog
+        if self.order == 'extent' and self.rotational(device_id):
+            # Files the filesystem cannot map go last, in inode order
+            def key(index):
+                if index in self.offsets:
+                    offset = self.offsets[index]
+                else:
+                    offset = self.offsets[index] = physical_offset(catalog.path(index))
+                return (0, offset) if offset is not None else (1, catalog.inodes[index])
+            return key
+        if self.order == 'walk':
+            return None
+        # Inode numbers roughly follow allocation order on most filesystems
+        return lambda index: catalog.inodes[index]
+
+    def split(self, indexes, key=lambda index: index):
+        """
+        Group items by device, in read order within each device.
+
+        Args:
+            indexes (iterable): Items to schedule
+            key (callable): Catalog row of an item
+
+        Returns:
+            dict: Catalog device id -> list of items
+        """
+        devices = self.catalog.devices
+        lanes = {}
+        for item in indexes:
+            lanes.setdefault(devices[key(item)], []).append(item)
+        for device_id, items in lanes.items():
+            sort_key = self._sort_key(device_id)
+            if sort_key is not None:
+                items.sort(key=lambda item: sort_key(key(item)))
+        return lanes
+
+    def lanes(self, jobs, make_args):
+        """
+        Build per-device submission lanes for iter_scheduled().
+
+        Args:
+            jobs (iterable): (key, catalog row) tuples
+            make_args (callable): Builds the worker arguments of a catalog row
+
+        Returns:
+            list: (limit, iterator of ((key, row), args)) for each device
+        """
+        lanes = self.split(jobs, key=lambda job: job[1])
+        return [(self.limit(device_id), ((job, make_args(job[1])) for job in items))
+                for device_id, items in lanes.items()]
+
+    def batches(self, indexes, batch_size):
+        """
+        Cut rows into batches that each hold a share of every device.
+
+        Keeping every device in every batch lets disks work in parallel,
+        while each device's share stays in read order.
+
+        Args:
+            indexes (iterable): Catalog rows
+            batch_size (int): Approximate rows per batch
+
+        Yields:
+            list: Catalog rows of one batch
+        """
+        lanes = list(self.split(indexes).values())
+        total = sum(len(items) for items in lanes)
+        count = -(-total // batch_size)
+        for i in range(count):
+            yield [index for items in lanes
+                   for index in items[i * len(items) // count:(i + 1) * len(items) // count]]
+
+    def describe(self):
+        """
+        Describe the devices seen in the catalog for the progress log.
+
+        Returns:
+            list: One line per device
+        """
+        lines = []
+        for device_id, device in enumerate(self.catalog.device_numbers):
+            rotational = is_rotational(device)
+            kind = {True: "rotational", False: "solid state", None: "unknown type"}[rotational]
+            order = 'inode' if self.order == 'extent' and not rotational else self.order
+            lines.append(f"Device {device:#x}: {kind}, up to {self.limit(device_id)} reads in flight, "
+                         f"{order} order")
+        return lines
@@ -0,0 +1,386 @@
+"""
+Scan result store for Deduplicationator 3000.
+
+Keeps the duplicate groups of recent scans in an indexed SQLite database,
+so large results can be browsed and filtered without loading a report:
+
+    runs    one row per scan: roots, algorithm, start and end time, status
+            and final counters
+    groups  one row per duplicate group of a run: size, digest,
+            reclaimable bytes, a fingerprint of the member paths and how
+            the group compares with the previous run of the same roots
+    files   one row per path of a group, in the order of the group (the
+            kept file first), with the walk's stat fields; paths are stored
+            as file system bytes, so names that are not valid UTF-8 survive
+
+Typical queries (the largest groups, duplicates below a directory, groups
+that are new or changed since the previous run) are answered from indexes;
+the comparison with the previous run is made once, when a run completes.
+The database only holds results; the hash cache and the directory manifest
+stay in their own files.
+"""
+
+import os
+import json
+import sqlite3
+import time
+import hashlib
+from collections import namedtuple
+from itertools import groupby
+from pathlib import Path
+
+from file_walker import FileRecord
+
+# Default store location and limits
+RESULTS_PATH = str(Path.home() / ".deduplicationator3000" / "results.db")
+MAX_RUNS = 20           # Older runs are deleted when a new one starts
+COMMIT_INTERVAL = 1000  # Groups stored before each commit
+
+StoredRun = namedtuple('StoredRun', ['id', 'started', 'finished', 'status', 'roots', 'algorithm', 'stats'])
+StoredGroup = namedtuple('StoredGroup', ['id', 'run_id', 'size', 'algorithm', 'digest', 'copies', 'reclaimable'])
+StoredFile = namedtuple('StoredFile', ['group_id', 'path', 'role', 'size', 'mtime_ns'])
+
+_GROUP_COLUMNS = "g.id, g.run_id, g.size, g.algorithm, g.digest, g.copies, g.reclaimable"
+_FILE_COLUMNS = "path, size, inode, device, mtime_ns, nlink"
+
+
+def _members(group):
+    """Fingerprint of the paths of a group, to tell whether it changed between runs."""
+    paths = sorted(record.path for record in list(group.files) + list(group.links))
+    return hashlib.blake2b("\0".join(paths).encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+
+
+def _prefix_range(directory):
+    """Bounds of the paths below a directory, for an indexed range query."""
+    prefix = os.fsencode(os.path.join(os.path.abspath(directory), ''))
+    return prefix, prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+def _stored_file(row):
+    """StoredFile from a (group_id, path, role, size, mtime_ns) row."""
+    group_id, path, role, size, mtime_ns = row
+    return StoredFile(group_id, os.fsdecode(path), role, size, mtime_ns)
+
+
+class ResultStore:
+    """
+    SQLite-backed history of scan results.
+
+    A connection must only be used from the thread that opened it.
+    """
+
+    def __init__(self, path=RESULTS_PATH, max_runs=MAX_RUNS):
+        """
+        Open (and create if needed) the result database.
+
+        Args:
+            path (str): Location of the SQLite database file
+            max_runs (int): Number of runs to keep
+        """
+        self.path = path
+        self.max_runs = max_runs
+        self._pending = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                started REAL NOT NULL,
+                finished REAL,
+                status TEXT NOT NULL,
+                roots TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                stats TEXT
+            );
+            CREATE TABLE IF NOT EXISTS groups (
+                id INTEGER PRIMARY KEY,
+                run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+                size INTEGER NOT NULL,
+                algorithm TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                copies INTEGER NOT NULL,
+                reclaimable INTEGER NOT NULL,
+                members TEXT NOT NULL,
+                change TEXT,
+                resolved_by INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS groups_reclaimable ON groups (run_id, reclaimable DESC);
+            CREATE INDEX IF NOT EXISTS groups_digest ON groups (digest, run_id, members);
+            CREATE INDEX IF NOT EXISTS groups_change ON groups (run_id, change, reclaimable DESC);
+            CREATE INDEX IF NOT EXISTS groups_resolved ON groups (resolved_by, reclaimable DESC);
+            CREATE TABLE IF NOT EXISTS files (
+                group_id INTEGER NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+                run_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                is_link INTEGER NOT NULL,
+                path BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                device INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                nlink INTEGER NOT NULL,
+                PRIMARY KEY (group_id, position)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS files_path ON files (run_id, path);
+        """)
+        self.conn.commit()
+
+    def begin_run(self, roots, algorithm):
+        """
+        Start recording a scan, deleting the oldest runs beyond max_runs.
+
+        Args:
+            roots (list): Scanned directories
+            algorithm (str): Hash algorithm that confirms duplicates
+
+        Returns:
+            int: Id of the new run
+        """
+        cursor = self.conn.execute(
+            "INSERT INTO runs (started, status, roots, algorithm) VALUES (?, 'running', ?, ?)",
+            (time.time(), json.dumps(list(roots)), algorithm))
+        run_id = cursor.lastrowid
+        self.conn.execute("DELETE FROM runs WHERE id <= ?", (run_id - self.max_runs,))
+        self.conn.commit()
+        return run_id
+
+    def add_group(self, run_id, group):
+        """
+        Store a duplicate group of a run.
+
+        Args:
+            run_id (int): Run from begin_run()
+            group (DuplicateGroup): Identical files; the first one is kept
+        """
+        keep_id = group.keep.file_id
+        cursor = self.conn.execute(
+            "INSERT INTO groups (run_id, size, algorithm, digest, copies, reclaimable, members) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (run_id, group.size, group.algorithm, group.digest, len(group.duplicate_files),
+             group.reclaimable, _members(group)))
+        group_id = cursor.lastrowid
+        rows = []
+        for position, record in enumerate(list(group.files) + list(group.links)):
+            is_link = position >= len(group.files)
+            if position == 0:
+                role = 'keep'
+            elif is_link and record.file_id == keep_id:
+                role = 'linked'
+            else:
+                role = 'duplicate'
+            rows.append((group_id, run_id, position, role, is_link, os.fsencode(record.path), record.size,
+                         record.inode, record.device, record.mtime_ns, record.nlink))
+        self.conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.conn.commit()
+            self._pending = 0
+
+    def finish_run(self, run_id, status, stats):
+        """
+        Mark a run as finished. Does nothing if it already is.
+
+        A completed run is compared with the previous completed run of the
+        same roots: its groups are marked 'new', 'changed' (same content,
+        other paths) or 'same', and groups of the previous run whose
+        content is no longer duplicated are marked as resolved by it.
+
+        Args:
+            run_id (int): Run from begin_run()
+            status (str): 'done', or 'stopped' for a scan that did not complete
+            stats (dict): Final engine counters
+        """
+        cursor = self.conn.execute(
+            "UPDATE runs SET finished = ?, status = ?, stats = ? WHERE id = ? AND status = 'running'",
+            (time.time(), status, json.dumps(stats), run_id))
+        if cursor.rowcount and status == 'done':
+            since = {'run': run_id, 'since': self.previous_run(run_id)}
+            self.conn.execute(
+                "UPDATE groups SET change = CASE "
+                "WHEN EXISTS (SELECT 1 FROM groups p WHERE p.digest = groups.digest AND p.run_id = :since "
+                "AND p.members = groups.members) THEN 'same' "
+                "WHEN EXISTS (SELECT 1 FROM groups p WHERE p.digest = groups.digest AND p.run_id = :since) "
+                "THEN 'changed' ELSE 'new' END WHERE run_id = :run", since)
+            self.conn.execute(
+                "UPDATE groups SET resolved_by = :run WHERE run_id = :since AND NOT EXISTS ("
+                "SELECT 1 FROM groups n WHERE n.digest = groups.digest AND n.run_id = :run)", since)
+        self.conn.commit()
+        self._pending = 0
+
+    def runs(self, limit=MAX_RUNS):
+        """
+        List recent runs, newest first.
+
+        Args:
+            limit (int): Maximum number of runs
+
+        Returns:
+            list: StoredRun tuples
+        """
+        rows = self.conn.execute("SELECT id, started, finished, status, roots, algorithm, stats "
+                                 "FROM runs ORDER BY id DESC LIMIT ?", (limit,))
+        return [StoredRun(run_id, started, finished, status, json.loads(roots), algorithm,
+                          json.loads(stats) if stats else {})
+                for run_id, started, finished, status, roots, algorithm, stats in rows]
+
+    def latest_run(self):
+        """
+        Get the newest completed run.
+
+        Returns:
+            int: Run id, or None if no scan has completed yet
+        """
+        row = self.conn.execute("SELECT id FROM runs WHERE status = 'done' ORDER BY id DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def previous_run(self, run_id):
+        """
+        Get the completed run of the same roots before a run.
+
+        Args:
+            run_id (int): Run to look back from
+
+        Returns:
+            int: Run id, or None if there is none
+        """
+        row = self.conn.execute(
+            "SELECT p.id FROM runs p JOIN runs r ON r.id = ? "
+            "WHERE p.id < r.id AND p.status = 'done' AND p.roots = r.roots ORDER BY p.id DESC LIMIT 1",
+            (run_id,)).fetchone()
+        return row[0] if row else None
+
+    def top_groups(self, limit=20, run_id=None):
+        """
+        Get the groups that free the most space.
+
+        Args:
+            limit (int): Number of groups
+            run_id (int): Run to query, by default the latest completed one
+
+        Returns:
+            list: StoredGroup tuples, largest reclaimable bytes first
+        """
+        run_id = run_id or self.latest_run()
+        rows = self.conn.execute(f"SELECT {_GROUP_COLUMNS} FROM groups g WHERE g.run_id = ? "
+                                 f"ORDER BY g.reclaimable DESC LIMIT ?", (run_id, limit))
+        return [StoredGroup(*row) for row in rows]
+
+    def duplicates_under(self, directory, run_id=None, limit=-1):
+        """
+        Get the duplicate files below a directory.
+
+        Args:
+            directory (str): Directory to look under
+            run_id (int): Run to query, by default the latest completed one
+            limit (int): Maximum number of files, -1 for all
+
+        Returns:
+            list: StoredFile tuples, in path order
+        """
+        run_id = run_id or self.latest_run()
+        low, high = _prefix_range(directory)
+        rows = self.conn.execute(
+            "SELECT group_id, path, role, size, mtime_ns FROM files "
+            "WHERE run_id = ? AND path >= ? AND path < ? AND role = 'duplicate' ORDER BY path LIMIT ?",
+            (run_id, low, high, limit))
+        return [_stored_file(row) for row in rows]
+
+    def changed_groups(self, run_id=None, since=None):
+        """
+        Get the groups that are new or have different members than in an earlier run.
+
+        Args:
+            run_id (int): Run to query, by default the latest completed one
+            since (int): Run to compare with, by default the previous run of
+                the same roots, as compared when run_id completed
+
+        Returns:
+            list: StoredGroup tuples of run_id, largest reclaimable bytes first
+        """
+        run_id = run_id or self.latest_run()
+        if since is None:
+            rows = self.conn.execute(f"SELECT {_GROUP_COLUMNS} FROM groups g INDEXED BY groups_change WHERE g.run_id = ? "
+                                     f"AND g.change IN ('new', 'changed') ORDER BY g.reclaimable DESC", (run_id,))
+        else:
+            rows = self.conn.execute(
+                f"SELECT {_GROUP_COLUMNS} FROM groups g WHERE g.run_id = ? AND NOT EXISTS ("
+                f"SELECT 1 FROM groups p WHERE p.digest = g.digest AND p.run_id = ? AND p.members = g.members) "
+                f"ORDER BY g.reclaimable DESC", (run_id, since))
+        return [StoredGroup(*row) for row in rows]
+
+    def resolved_groups(self, run_id=None, since=None):
+        """
+        Get the groups of an earlier run whose content is no longer duplicated.
+
+        Args:
+            run_id (int): Run to query, by default the latest completed one
+            since (int): Earlier run, by default the previous run of the
+                same roots, as compared when run_id completed
+
+        Returns:
+            list: StoredGroup tuples of the earlier run
+        """
+        run_id = run_id or self.latest_run()
+        if since is None:
+            rows = self.conn.execute(f"SELECT {_GROUP_COLUMNS} FROM groups g WHERE g.resolved_by = ? "
+                                     f"ORDER BY g.reclaimable DESC", (run_id,))
+        else:
+            rows = self.conn.execute(
+                f"SELECT {_GROUP_COLUMNS} FROM groups g WHERE g.run_id = ? AND NOT EXISTS ("
+                f"SELECT 1 FROM groups n WHERE n.digest = g.digest AND n.run_id = ?) "
+                f"ORDER BY g.reclaimable DESC", (since, run_id))
+        return [StoredGroup(*row) for row in rows]
+
+    def files(self, group_id):
+        """
+        Get the paths of a group.
+
+        Args:
+            group_id (int): Group id
+
+        Returns:
+            list: StoredFile tuples, the kept file first
+        """
+        rows = self.conn.execute("SELECT group_id, path, role, size, mtime_ns FROM files "
+                                 "WHERE group_id = ? ORDER BY position", (group_id,))
+        return [_stored_file(row) for row in rows]
+
+    def groups(self, run_id=None):
+        """
+        Read back the full groups of a run, e.g. to review or apply them.
+
+        Args:
+            run_id (int): Run to read, by default the latest completed one
+
+        Yields:
+            tuple: (StoredGroup, file records, link records), largest
+            reclaimable bytes first; the FileRecord lists are the files
+            and links of the original DuplicateGroup
+        """
+        run_id = run_id or self.latest_run()
+        rows = self.conn.execute(
+            f"SELECT {_GROUP_COLUMNS}, f.is_link, {', '.join('f.' + c for c in _FILE_COLUMNS.split(', '))} "
+            f"FROM groups g JOIN files f ON f.group_id = g.id WHERE g.run_id = ? "
+            f"ORDER BY g.reclaimable DESC, g.id, f.position", (run_id,))
+        width = len(StoredGroup._fields)
+        for stored, members in groupby(rows, key=lambda row: row[:width]):
+            files, links = [], []
+            for row in members:
+                path, *fields = row[width + 1:]
+                (links if row[width] else files).append(FileRecord(os.fsdecode(path), *fields))
+            yield StoredGroup(*stored), files, links
+
+    def close(self):
+        """Commit pending writes and close the database."""
+        try:
+            self.conn.commit()
+        finally:
+            self.conn.close()
@@ -0,0 +1,129 @@
+"""
+Streaming duplicate reports for Deduplicationator 3000.
+
+A ResultWriter appends every duplicate group to a CSV or NDJSON file as
+soon as the scan confirms it, instead of collecting all groups for an
+export at the end. Rows are buffered in memory up to a fixed size and then
+written as complete lines, so the file can be read (or tailed) by other
+tools while the scan runs, and a scan that is stopped or crashes leaves a
+valid report of every group flushed so far.
+
+    csv     one row per path: group number, KEEP / LINKED / DUPLICATE, path,
+            size in bytes, modification time, hash algorithm and digest
+    ndjson  one JSON object per group, as written by dedup_cli.py
+"""
+
+import os
+import csv
+import io
+import json
+import time
+
+RESULT_FORMATS = ('csv', 'ndjson')
+CSV_HEADER = ['Group', 'Status', 'File Path', 'Size (bytes)', 'Last Modified', 'Hash Algorithm', 'Hash']
+FLUSH_BYTES = 64 * 1024  # Buffered report text written at once
+FLUSH_INTERVAL = 2.0     # Seconds a confirmed group may wait in the buffer
+
+
+def group_to_dict(group):
+    """Convert a DuplicateGroup to a JSON-serializable dictionary."""
+    return {
+        'size': group.size,
+        'algorithm': group.algorithm,
+        'hash': group.digest,
+        'keep': group.keep_file,
+        'duplicates': group.duplicate_files,
+        'already_linked': [record.path for record in group.already_linked],
+        'reclaimable': group.reclaimable
+    }
+
+
+def guess_format(path):
+    """Report format implied by a file name: 'ndjson' for .ndjson and .jsonl files, else 'csv'."""
+    return 'ndjson' if path.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+class ResultWriter:
+    """Appends duplicate groups to a report file while a scan runs."""
+
+    def __init__(self, path, result_format=None, flush_bytes=FLUSH_BYTES, flush_interval=FLUSH_INTERVAL):
+        """
+        Create the report file, replacing an existing one.
+
+        Args:
+            path (str): Report file
+            result_format (str): 'csv' or 'ndjson', by default from the file extension
+            flush_bytes (int): Write the buffer once it holds this many characters
+            flush_interval (float): Write the buffer at least this often, in seconds
+
+        Raises:
+            ValueError: If the format is unknown
+            OSError: If the file cannot be created
+        """
+        self.format = result_format or guess_format(path)
+        if self.format not in RESULT_FORMATS:
+            raise ValueError(f"Unknown result format: {self.format}")
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.groups = 0  # Groups written, including buffered ones
+        self.rows = 0    # Lines written, excluding the CSV header
+        # Paths that are not valid UTF-8 are written back as their original bytes
+        self._file = open(path, 'w', newline='', encoding='utf-8', errors='surrogateescape')
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer)
+        self._last_flush = time.monotonic()
+        if self.format == 'csv':
+            self._csv.writerow(CSV_HEADER)
+            self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, group):
+        """
+        Add a confirmed duplicate group to the report.
+
+        Args:
+            group (DuplicateGroup): Identical files; the first one is kept
+        """
+        self.groups += 1
+        if self.format == 'csv':
+            rows = [('KEEP', group.keep)]
+            rows += [('LINKED', record) for record in group.already_linked]
+            rows += [('DUPLICATE', record) for record in group.duplicates]
+            for status, record in rows:
+                self._csv.writerow([self.groups, status, record.path, group.size, record.modified,
+                                    group.algorithm, group.digest])
+            self.rows += len(rows)
+        else:
+            self._buffer.write(json.dumps(group_to_dict(group)) + "\n")
+            self.rows += 1
+
+        if (self._buffer.tell() >= self.flush_bytes
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write buffered groups to the file as complete lines."""
+        text = self._buffer.getvalue()
+        if text:
+            self._file.write(text)
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Flush the remaining groups, make them durable and close the file."""
+        if self._file.closed:
+            return
+        self.flush()
+        try:
+            os.fsync(self._file.fileno())
+        except OSError:
+            pass  # Not every file (e.g. a pipe) can be synced
+        self._file.close()
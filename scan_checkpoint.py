@@ -0,0 +1,217 @@
+"""
+Checkpoints for resumable scans in Deduplicationator 3000.
+
+Once a scan has walked the tree and run its cheap filtering stages, it saves
+a plan: the settings, the file catalog and the files that still need a
+full hash. After every batch of full hashes it appends the
+new digests to a log and rewrites a small state file, both fsync'd. A scan
+that was stopped, crashed or lost power can then be resumed from the plan
+and continues with the files that have no digest yet.
+
+A checkpoint directory holds:
+
+    plan.pickle   catalog and candidate rows (written once)
+    digests.bin   (row, raw digest) records, appended after each batch
+    state.json    records in digests.bin known to be complete, and counters
+"""
+
+import os
+import json
+import time
+import pickle
+import struct
+import logging
+from array import array
+from pathlib import Path
+
+from file_catalog import DigestTable, INDEX_TYPECODE
+
+CHECKPOINT_DIR = str(Path.home() / ".deduplicationator3000" / "checkpoint")
+CHECKPOINT_VERSION = 1
+ROW = struct.Struct("=I")  # Catalog row in front of each digest record
+# Settings that decide what the saved digests mean; a resume must use the same ones
+DIGEST_SETTINGS = ('algorithm', 'prefilter', 'partial_stages')
+
+logger = logging.getLogger(__name__)
+
+
+def _fsync_write(path, data):
+    """Replace a file atomically with data, durable once this returns."""
+    temp = f"{path}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+class ScanCheckpoint:
+    """Reads and writes the checkpoint of one scan."""
+
+    def __init__(self, directory=CHECKPOINT_DIR):
+        """
+        Args:
+            directory (str): Directory holding the checkpoint files
+        """
+        self.directory = directory
+        self.plan_path = os.path.join(directory, "plan.pickle")
+        self.digests_path = os.path.join(directory, "digests.bin")
+        self.state_path = os.path.join(directory, "state.json")
+        self._saved = 0  # Digests already in digests.bin
+
+    def files(self):
+        """Every file this class may write, including unfinished atomic writes."""
+        paths = (self.plan_path, self.digests_path, self.state_path)
+        return paths + tuple(f"{path}.tmp" for path in paths)
+
+    def exists(self):
+        """True if there is a plan to resume from."""
+        return os.path.exists(self.state_path) and os.path.exists(self.plan_path)
+
+    def state(self):
+        """
+        Read the state file.
+
+        Returns:
+            dict: Saved state, or None if there is no readable checkpoint
+        """
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if state.get('version') == CHECKPOINT_VERSION else None
+
+    def save_plan(self, config, catalog, candidates, digests, stats, stage_stats):
+        """
+        Start a checkpoint for the hashing phase of a scan.
+
+        Args:
+            config (ScanConfig): Settings of the scan
+            catalog (FileCatalog): Every file of the scan
+            candidates (array): Rows that still need a full hash
+            digests (DigestTable): Digests known so far
+            stats (dict): Engine counters
+            stage_stats (dict): Per-stage counters
+        """
+        self.clear()
+        os.makedirs(self.directory, exist_ok=True)
+        _fsync_write(self.plan_path, pickle.dumps(
+            {'catalog': catalog, 'candidates': candidates},
+            protocol=pickle.HIGHEST_PROTOCOL))
+        self._saved = 0
+        open(self.digests_path, 'wb').close()
+        self.save_progress(config, digests, stats, stage_stats)
+
+    def save_progress(self, config, digests, stats, stage_stats):
+        """
+        Append digests found since the last save and record the counters.
+
+        Args:
+            config (ScanConfig): Settings of the scan
+            digests (DigestTable): All digests of the scan so far
+            stats (dict): Engine counters
+            stage_stats (dict): Per-stage counters
+        """
+        if len(digests) > self._saved:
+            records = bytearray()
+            for position in range(self._saved, len(digests)):
+                records += ROW.pack(digests.indexes[position]) + digests.digest(position)
+            with open(self.digests_path, 'ab') as f:
+                f.write(records)
+                f.flush()
+                os.fsync(f.fileno())
+            self._saved = len(digests)
+
+        # The state file is what makes appended records count, so it is written last
+        _fsync_write(self.state_path, json.dumps({
+            'version': CHECKPOINT_VERSION,
+            'saved_at': time.time(),
+            'config': config.to_dict(),
+            'digests': self._saved,
+            'width': digests.width,
+            'stats': stats,
+            'stage_stats': stage_stats,
+        }, indent=2).encode('utf-8'))
+
+    def mismatched_settings(self, config, state):
+        """
+        Compare the settings of a scan with those saved in the checkpoint.
+
+        Args:
+            config (ScanConfig): Settings of the scan that wants to resume
+            state (dict): Saved state, as returned by state() or load()
+
+        Returns:
+            list: Names of the settings in DIGEST_SETTINGS that differ
+        """
+        # A JSON round trip turns tuples into lists like the saved copy
+        current = json.loads(json.dumps(config.to_dict()))
+        saved = state['config']
+        return [name for name in DIGEST_SETTINGS if current.get(name) != saved.get(name)]
+
+    def load(self):
+        """
+        Load the checkpoint.
+
+        Returns:
+            dict: The state plus 'catalog', 'candidates' (rows still
+            without a digest) and 'digests' (DigestTable), or None if there
+            is no usable checkpoint
+        """
+        state = self.state()
+        if state is None:
+            return None
+        try:
+            with open(self.plan_path, 'rb') as f:
+                plan = pickle.load(f)
+            with open(self.digests_path, 'rb') as f:
+                data = f.read()
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.error(f"Error reading checkpoint {self.directory}: {str(e)}")
+            return None
+
+        digests = DigestTable()
+        width = state['width']
+        if width:
+            record = ROW.size + width
+            # Records past the saved count belong to a batch that never finished
+            for offset in range(0, state['digests'] * record, record):
+                digests.add(ROW.unpack_from(data, offset)[0],
+                            data[offset + ROW.size:offset + record].hex())
+        done = set(digests.indexes)
+        self._saved = len(digests)
+
+        state.update(plan)
+        state['digests'] = digests
+        state['candidates'] = array(INDEX_TYPECODE, (index for index in plan['candidates'] if index not in done))
+        return state
+
+    def describe(self):
+        """
+        Describe the checkpoint for a resume prompt.
+
+        Returns:
+            str: Roots, age and progress, or None if there is no checkpoint
+        """
+        state = self.state()
+        if state is None:
+            return None
+        saved = time.strftime('%Y-%m-%d %H:%M', time.localtime(state['saved_at']))
+        return (f"{', '.join(state['config']['roots'])} (saved {saved}, "
+                f"{state['stats'].get('hashed', 0)} files hashed)")
+
+    def clear(self):
+        """Delete the checkpoint files, and the directory if nothing else is left in it."""
+        for path in self.files():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error deleting checkpoint file {path}: {str(e)}")
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass  # Missing, or holds files that are not ours
+        self._saved = 0
@@ -0,0 +1,1452 @@
+"""
+Headless scan engine for Deduplicationator 3000.
+
+Holds all duplicate-finding logic, free of any GUI code, so it can run on
+servers, from the command line or under a profiler. A scan takes a
+ScanConfig and produces a stream of ScanEvents:
+
+- ('log', message)      human readable progress messages
+- ('stats', stats)      snapshot of the scan counters
+- ('group', group)      a confirmed DuplicateGroup
+- ('linked', linked)    a LinkedFile, paths that are hardlinks of one file
+- ('done', stats)       final counters once the scan has finished
+
+Pipeline: walk the tree into a compact FileCatalog, prune unique sizes,
+run the partial hashing stages, compare small groups byte by byte in
+lockstep, then fully hash the remaining candidates on a worker pool (with
+the persistent hash cache in front of every stage).
+Candidates are passed between stages as catalog row indexes; paths are only
+built when a file is read or reported. In incremental mode the walk replays
+unchanged directories from the DirectoryManifest of the previous scan.
+"""
+
+import os
+import time
+import logging
+import multiprocessing
+from array import array
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from hash_algorithms import new_hasher, DEFAULT_ALGORITHM, DEFAULT_PREFILTER
+from hash_cache import HashCache, CACHE_PATH
+from dir_manifest import DirectoryManifest, MANIFEST_PATH
+from file_walker import walk_files, walk_shard, WALK_WORKERS
+from file_catalog import FileCatalog, DigestTable, INDEX_TYPECODE
+from file_readers import read_chunks, paced, DEFAULT_READ_METHOD
+from io_scheduler import DeviceScheduler, DEFAULT_READ_ORDER, HDD_CONCURRENCY
+from throttle import ResourceThrottle
+from scan_metrics import ScanMetrics, timed_call
+from scan_checkpoint import ScanCheckpoint, CHECKPOINT_DIR
+from result_store import ResultStore
+
+logger = logging.getLogger(__name__)
+
+# Default configuration values
+MIN_FILE_SIZE = 1024 * 1024 * 1024 * 10  # 10GB
+MAX_FILE_SIZE = 1024 * 1024 * 1024 * 300  # 300GB
+CHUNK_SIZE = 1024 * 1024 * 4  # 4MB chunks for better performance
+SKIP_EXTENSIONS = {'.tmp', '.temp', '.log', '.cache'}
+BATCH_SIZE = 1000  # Process files in batches of 1000
+NUM_WORKERS = max(1, multiprocessing.cpu_count() - 1)  # Leave one core free
+HASH_BACKEND = 'thread'  # 'thread' or 'process' pool for hashing
+IN_FLIGHT_PER_WORKER = 4  # Hash jobs queued per worker (keeps NVMe queues busy)
+LOCKSTEP_MAX_FILES = 3  # Groups up to this size are compared in lockstep instead of hashed
+LOCKSTEP_FIRST_BLOCK = 1024 * 64  # First lockstep read; blocks double up to the chunk size
+
+# Partial hashing stages, run cheapest first before any file is fully hashed.
+# 'edges' reads the first and last block, 'samples' reads blocks spread evenly
+# through the file. Files whose stage hash is unique within their group are dropped.
+PARTIAL_HASH_STAGES = [
+    {'name': 'edges', 'mode': 'edges', 'block_size': 1024 * 16, 'blocks': 2},       # 16KB head + tail
+    {'name': 'samples', 'mode': 'samples', 'block_size': 1024 * 64, 'blocks': 8},   # 8 x 64KB samples
+]
+
+def stream_file_hash(filepath, algorithm, chunk_size=CHUNK_SIZE, read_method=DEFAULT_READ_METHOD, max_rate=0):
+    """
+    Hash a file in fixed-size chunks from one of the file_readers read methods.
+
+    Memory use is bounded by the chunk size no matter how large the file is,
+    and no new bytes objects are allocated per chunk.
+
+    Args:
+        filepath (str): Path to the file to hash
+        algorithm (str): Name of a registered hash algorithm
+        chunk_size (int): Size of each chunk
+        read_method (str): Name from file_readers.READ_METHODS
+        max_rate (float): Read rate cap in bytes per second, 0 for unlimited
+
+    Returns:
+        str: Hash of the file
+    """
+    hasher = new_hasher(algorithm)
+    for chunk in read_chunks(filepath, chunk_size, read_method, max_rate):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def calculate_file_hash(filepath, chunk_size=CHUNK_SIZE, algorithm=DEFAULT_ALGORITHM,
+                        read_method=DEFAULT_READ_METHOD, max_rate=0):
+    """
+    Calculate the hash of a file using chunked reading for memory efficiency.
+
+    Args:
+        filepath (str): Path to the file to hash
+        chunk_size (int): Size of chunks to read (default: 4MB)
+        algorithm (str): Name of a registered hash algorithm (default: sha256)
+        read_method (str): Name from file_readers.READ_METHODS (default: buffered)
+        max_rate (float): Read rate cap in bytes per second (default: unlimited)
+
+    Returns:
+        str: Hash of the file, or None if an error occurs
+    """
+    try:
+        return stream_file_hash(filepath, algorithm, chunk_size, read_method, max_rate)
+    except Exception as e:
+        logger.error(f"Error calculating hash for {filepath}: {str(e)}")
+        return None
+
+
+def compare_lockstep(filepaths, chunk_size=CHUNK_SIZE, algorithm=DEFAULT_ALGORITHM, max_rate=0):
+    """
+    Read same-size files side by side and stop reading each one as soon as it
+    differs from all the others.
+
+    Files that stay identical to at least one other file up to the end are
+    hashed along the way, so they get the same digest calculate_file_hash
+    would give them. Reads start small and double up to chunk_size, so files
+    that differ early cost almost nothing.
+
+    Args:
+        filepaths (list): Paths of files with the same size
+        chunk_size (int): Largest block read per file and step
+        algorithm (str): Name of a registered hash algorithm
+        max_rate (float): Read rate cap in bytes per second, 0 for unlimited
+
+    Returns:
+        tuple: (digests, errors, bytes_read) where digests holds the hash of
+        each file, or None if it matched no other file or could not be read
+    """
+    digests = [None] * len(filepaths)
+    errors = 0
+    bytes_read = 0
+    files = {}
+    start = time.monotonic()
+    try:
+        for position, filepath in enumerate(filepaths):
+            try:
+                files[position] = open(filepath, 'rb')
+            except OSError as e:
+                errors += 1
+                logger.error(f"Error opening {filepath}: {str(e)}")
+        hashers = {position: new_hasher(algorithm) for position in files}
+
+        block_size = min(LOCKSTEP_FIRST_BLOCK, chunk_size)
+        groups = [list(files)] if len(files) > 1 else []
+        while groups:
+            next_groups = []
+            for group in groups:
+                # Split the group by the content of the next block
+                blocks = []
+                for position in group:
+                    try:
+                        data = files[position].read(block_size)
+                    except OSError as e:
+                        errors += 1
+                        logger.error(f"Error reading {filepaths[position]}: {str(e)}")
+                        continue
+                    bytes_read += len(data)
+                    for block, members in blocks:
+                        if block == data:
+                            members.append(position)
+                            break
+                    else:
+                        blocks.append((data, [position]))
+
+                for data, members in blocks:
+                    if len(members) < 2:
+                        continue  # Diverged from every other file; stop reading it
+                    for position in members:
+                        hashers[position].update(data)
+                    if data:
+                        next_groups.append(members)
+                    else:
+                        for position in members:
+                            digests[position] = hashers[position].hexdigest()
+            groups = next_groups
+            block_size = min(block_size * 2, chunk_size)
+            if max_rate:
+                ahead = bytes_read / max_rate - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+    finally:
+        for f in files.values():
+            f.close()
+    return digests, errors, bytes_read
+
+
+def reads_whole_file(size, stage):
+    """
+    Tell whether a partial hashing stage would read all of a file.
+
+    Such a stage is skipped for the file: lockstep comparison or full
+    hashing would only read the same bytes again.
+
+    Args:
+        size (int): Size of the file in bytes
+        stage (dict): Stage settings from PARTIAL_HASH_STAGES
+
+    Returns:
+        bool: True if the stage's blocks cover the whole file
+    """
+    return size <= stage['block_size'] * stage['blocks']
+
+
+def partial_hash_ranges(size, stage):
+    """
+    Compute the byte ranges a partial hashing stage reads from a file.
+
+    Args:
+        size (int): Size of the file in bytes
+        stage (dict): Stage settings from PARTIAL_HASH_STAGES
+
+    Returns:
+        list: (offset, length) tuples to read
+    """
+    block_size = stage['block_size']
+    if reads_whole_file(size, stage):
+        return [(0, size)]
+    if stage['mode'] == 'edges':
+        # First and last blocks of the file
+        return [(0, block_size), (size - block_size, block_size)]
+    # Blocks spread evenly through the interior of the file
+    step = (size - block_size) // (stage['blocks'] + 1)
+    return [(step * (i + 1), block_size) for i in range(stage['blocks'])]
+
+
+def _read_ranges(f, ranges):
+    """Read (offset, length) ranges of an open file, one chunk per range."""
+    for offset, length in ranges:
+        f.seek(offset)
+        yield f.read(length)
+
+
+def calculate_partial_hash(filepath, ranges, algorithm=DEFAULT_PREFILTER, max_rate=0):
+    """
+    Calculate the hash of selected byte ranges of a file.
+
+    Args:
+        filepath (str): Path to the file to hash
+        ranges (list): (offset, length) tuples to read
+        algorithm (str): Name of a registered hash algorithm (default: crc32)
+        max_rate (float): Read rate cap in bytes per second, 0 for unlimited
+
+    Returns:
+        str: Hash of the ranges, or None if an error occurs
+    """
+    try:
+        partial_hash = new_hasher(algorithm)
+        with open(filepath, "rb") as f:
+            chunks = _read_ranges(f, ranges)
+            for chunk in paced(chunks, max_rate) if max_rate else chunks:
+                partial_hash.update(chunk)
+        return partial_hash.hexdigest()
+    except Exception as e:
+        logger.error(f"Error calculating partial hash for {filepath}: {str(e)}")
+        return None
+
+
+def create_hash_executor(backend, workers):
+    """
+    Create the worker pool used for hashing.
+
+    Args:
+        backend (str): 'thread' or 'process'
+        workers (int): Number of workers in the pool
+
+    Returns:
+        Executor: A ThreadPoolExecutor or ProcessPoolExecutor
+    """
+    if backend == 'process':
+        return ProcessPoolExecutor(max_workers=workers)
+    # hashlib releases the GIL while hashing, so threads scale for I/O-bound scans
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash")
+
+
+def iter_scheduled(executor, func, lanes, max_in_flight, is_running=lambda: True, throttle=None,
+                   metrics=None, stage=None):
+    """
+    Run func over jobs on an executor and yield results as they complete.
+
+    Jobs are split into lanes with their own limits. Lanes are served
+    round-robin, so every lane with work and room keeps jobs in flight, and
+    jobs within a lane are submitted in order. At most max_in_flight jobs
+    are submitted at any time, so memory stays bounded no matter how many
+    jobs are queued.
+
+    Args:
+        executor (Executor): Pool to submit work to
+        func (callable): Picklable function called as func(*args)
+        lanes (list): (limit, iterable of (key, args)) tuples
+        max_in_flight (int): Maximum number of outstanding jobs over all lanes
+        is_running (callable): Returns False when work should stop early
+        throttle (ResourceThrottle): Optional limit below max_in_flight, re-read
+            at least once per throttle interval
+        metrics (ScanMetrics): Optional recorder of job times and jobs in flight
+        stage (str): Stage the jobs are recorded under
+
+    Yields:
+        tuple: (key, result) for each finished job, or (key, None) if it failed
+    """
+    lanes = [[max(1, limit), iter(jobs)] for limit, jobs in lanes]
+    in_lane = [0] * len(lanes)
+    pending = {}
+    turn = 0
+    timeout = throttle.interval if throttle else None
+    try:
+        while True:
+            limit = max_in_flight
+            if throttle:
+                limit = throttle.limit(max_in_flight)
+                # Lanes with a low limit (e.g. spinning disks) cap the jobs sharing the read rate
+                throttle.readers = min(limit, sum(lane_limit for lane_limit, jobs in lanes if jobs is not None))
+            while len(pending) < limit and is_running():
+                # Next lane, after the last one served, that has room and jobs left
+                for step in range(len(lanes)):
+                    lane = (turn + step) % len(lanes)
+                    lane_limit, jobs = lanes[lane]
+                    if jobs is None or in_lane[lane] >= lane_limit:
+                        continue
+                    job = next(jobs, None)
+                    if job is None:
+                        lanes[lane][1] = None
+                        continue
+                    key, args = job
+                    if metrics:
+                        # Time the job in the worker, so queueing is not counted
+                        future = executor.submit(timed_call, func, *args)
+                    else:
+                        future = executor.submit(func, *args)
+                    pending[future] = (lane, key)
+                    in_lane[lane] += 1
+                    turn = lane + 1
+                    break
+                else:
+                    break
+
+            if not pending or not is_running():
+                return
+
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight = len(pending)
+                lane, key = pending.pop(future)
+                in_lane[lane] -= 1
+                try:
+                    result = future.result()
+                    if metrics:
+                        result, seconds = result
+                        metrics.observe_job(stage, seconds, in_flight)
+                    yield key, result
+                except Exception as e:
+                    logger.error(f"Worker failed for {key}: {str(e)}")
+                    yield key, None
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def format_size(size_bytes):
+    """
+    Format size in bytes to human readable format.
+
+    Args:
+        size_bytes (int): Size in bytes
+
+    Returns:
+        str: Formatted size string (e.g., "1.5GB")
+    """
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.1f}{unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f}TB"
+
+
+ScanEvent = namedtuple('ScanEvent', ['kind', 'data'])
+
+
+def distinct_files(records):
+    """
+    Split the records of identical files into one per distinct file and the other paths.
+
+    Paths with the same (device, inode) are the same file, e.g. a file
+    reached twice through overlapping roots or bind mounts, and must never
+    be reported as copies of each other.
+
+    Args:
+        records (list): FileRecords of files with the same content
+
+    Returns:
+        tuple: (records of distinct files, records of further paths to them)
+    """
+    files, others, seen = [], [], set()
+    for record in records:
+        if record.file_id in seen:
+            others.append(record)
+        else:
+            seen.add(record.file_id)
+            files.append(record)
+    return files, others
+
+
+def same_digest(pairs):
+    """
+    Collect the rows that share a digest.
+
+    Args:
+        pairs (iterable): (catalog row, hex digest) tuples; a None digest marks
+            a file that was ruled out or could not be read
+
+    Returns:
+        list: (hex digest, catalog rows) for each digest of two or more rows
+    """
+    rows = defaultdict(list)
+    for index, digest in pairs:
+        if digest:
+            rows[digest].append(index)
+    return [(digest, indexes) for digest, indexes in rows.items() if len(indexes) > 1]
+
+
+def comparison_key(fingerprints):
+    """
+    Identify a set of file versions, e.g. the files of a lockstep comparison.
+
+    Args:
+        fingerprints (list): Fingerprints from FileCatalog.fingerprint()
+
+    Returns:
+        str: Hex digest that changes whenever a file is added, removed or modified
+    """
+    hasher = new_hasher(DEFAULT_ALGORITHM)
+    hasher.update(repr(sorted(fingerprints)).encode())
+    return hasher.hexdigest()
+
+
+class PendingGroups:
+    """
+    Groups of possible duplicates whose files are waiting for a full hash.
+
+    Files of different groups differ in size or partial hash, so a group's
+    duplicates are final as soon as each of its files has a result, long
+    before the last batch is hashed.
+    """
+
+    def __init__(self, groups):
+        self.group_of = {}  # Catalog row -> number of its group
+        self.waiting = []   # Files without a result, per group
+        self.results = []   # (catalog row, hex digest) of the files done, per group
+        for rows in groups:
+            for index in rows:
+                self.group_of[index] = len(self.waiting)
+            self.waiting.append(len(rows))
+            self.results.append([])
+
+    def finish(self, index, digest):
+        """
+        Record the full hash of a file.
+
+        Args:
+            index (int): Catalog row
+            digest (str): Hex digest, or None if the file could not be hashed
+
+        Returns:
+            list: (hex digest, catalog rows) of the duplicates in the file's
+            group once the group is complete, otherwise an empty list
+        """
+        number = self.group_of.pop(index, None)
+        if number is None:
+            return []
+        self.results[number].append((index, digest))
+        self.waiting[number] -= 1
+        if self.waiting[number]:
+            return []
+        results, self.results[number] = self.results[number], None
+        return same_digest(results)
+
+
+class DuplicateGroup(namedtuple('DuplicateGroup', ['size', 'digest', 'algorithm', 'files', 'links'],
+                                defaults=((),))):
+    """
+    A set of files with identical content.
+
+    files holds one FileRecord per distinct file (device, inode), most
+    recently modified first; the first file is the one kept. links holds
+    the records of further hardlinks to those files found by the scan.
+    Hardlinks of the kept file are already deduplicated and never deleted;
+    every path of a duplicate file is removed, or no space would be freed.
+    """
+    __slots__ = ()
+
+    @property
+    def keep(self):
+        """Record of the file that is kept."""
+        return self.files[0]
+
+    @property
+    def already_linked(self):
+        """Records of other paths that are hardlinks of the kept file."""
+        keep_id = self.files[0].file_id
+        return [record for record in self.links if record.file_id == keep_id]
+
+    @property
+    def duplicates(self):
+        """Records of every path holding a copy of the kept file."""
+        keep_id = self.files[0].file_id
+        return list(self.files[1:]) + [record for record in self.links if record.file_id != keep_id]
+
+    @property
+    def keep_file(self):
+        return self.files[0].path
+
+    @property
+    def duplicate_files(self):
+        return [record.path for record in self.duplicates]
+
+    @property
+    def reclaimable(self):
+        """Bytes freed by removing every duplicate."""
+        return self.reclaimed(self.duplicate_files)
+
+    def reclaimed(self, deleted):
+        """
+        Bytes actually freed by deleting some paths of the group.
+
+        A file only releases its data once all of its links are gone, so
+        files with links outside the scanned tree free nothing.
+
+        Args:
+            deleted (iterable): Paths that were deleted
+
+        Returns:
+            int: Bytes freed
+        """
+        deleted = set(deleted)
+        paths = {record.file_id: [record.path] for record in self.files}
+        for record in self.links:
+            paths[record.file_id].append(record.path)
+        return self.size * sum(
+            1 for record in self.files[1:]
+            if record.nlink <= len(paths[record.file_id])
+            and all(path in deleted for path in paths[record.file_id])
+        )
+
+
+class LinkedFile(namedtuple('LinkedFile', ['size', 'files'])):
+    """Paths found by the scan that are hardlinks of one and the same file."""
+    __slots__ = ()
+
+
+class ScanConfig:
+    """Settings for one scan."""
+
+    def __init__(self, roots, min_size=0, max_size=MAX_FILE_SIZE,
+                 skip_extensions=SKIP_EXTENSIONS, algorithm=DEFAULT_ALGORITHM,
+                 prefilter=DEFAULT_PREFILTER, backend=HASH_BACKEND, workers=NUM_WORKERS,
+                 walk_workers=WALK_WORKERS, chunk_size=CHUNK_SIZE,
+                 partial_stages=PARTIAL_HASH_STAGES, prune_sizes=True,
+                 use_cache=True, cache_path=CACHE_PATH,
+                 incremental=False, manifest_path=MANIFEST_PATH,
+                 lockstep_max_files=LOCKSTEP_MAX_FILES, read_method=DEFAULT_READ_METHOD,
+                 read_order=DEFAULT_READ_ORDER, hdd_concurrency=HDD_CONCURRENCY,
+                 max_read_rate=0, max_open_files=0, max_cpu_percent=0, max_load=0, max_disk_busy=0,
+                 metrics_path=None, metrics_format=None, metrics_interval=0,
+                 checkpoint_path=None, resume=False, results_path=None, shards=1, shard=0):
+        """
+        Args:
+            roots (str or list): Directory or directories to scan
+            min_size (int): Minimum file size in bytes
+            max_size (int): Maximum file size in bytes
+            skip_extensions (iterable): File extensions to ignore
+            algorithm (str): Hash algorithm that confirms duplicates
+            prefilter (str): Hash algorithm for the partial hashing stages
+            backend (str): 'thread' or 'process' hashing pool
+            workers (int): Number of hashing workers
+            walk_workers (int): Number of directory traversal threads
+            chunk_size (int): Read size for full hashing
+            partial_stages (list): Partial hashing stages, empty to disable
+            prune_sizes (bool): Skip hashing files whose size is unique
+            use_cache (bool): Reuse hashes from the persistent hash cache
+            cache_path (str): Location of the hash cache database
+            incremental (bool): Skip listing directories unchanged since the previous scan
+            manifest_path (str): Location of the directory manifest database
+            lockstep_max_files (int): Largest group compared in lockstep, 0 to always hash
+            read_method (str): How full hashing reads files, see file_readers.READ_METHODS
+            read_order (str): Order of reads within a device: 'inode', 'extent' or 'walk'
+            hdd_concurrency (int): Reads in flight per rotational disk
+            max_read_rate (int): Read bandwidth cap in bytes per second, 0 for none
+            max_open_files (int): Files hashed at the same time, 0 for no cap
+            max_cpu_percent (float): Share of all CPUs the scan may use, 0 for no cap
+            max_load (float): Back off above this load average per CPU, 0 to ignore load
+            max_disk_busy (float): Back off above this disk utilization in percent, 0 to ignore
+            metrics_path (str): Write scan metrics here at the end of the scan, None to skip
+            metrics_format (str): 'json' or 'prometheus', None to pick by file extension
+            metrics_interval (float): Also write metrics every this many seconds, 0 for only at the end
+            checkpoint_path (str): Directory for a checkpoint after every hashing batch, None for no checkpoints
+            resume (bool): Continue from the checkpoint instead of walking the tree again
+            results_path (str): Store the duplicate groups in this result database, None to skip
+            shards (int): Number of shards the roots are split into, see file_walker.walk_shard
+            shard (int): Shard walked by this engine
+        """
+        self.roots = [roots] if isinstance(roots, (str, os.PathLike)) else list(roots)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.skip_extensions = {ext.strip().lower() for ext in skip_extensions if ext.strip()}
+        self.algorithm = algorithm
+        self.prefilter = prefilter
+        self.backend = backend
+        self.workers = max(1, workers)
+        self.walk_workers = walk_workers
+        self.chunk_size = chunk_size
+        self.partial_stages = partial_stages
+        self.prune_sizes = prune_sizes
+        self.use_cache = use_cache
+        self.cache_path = cache_path
+        self.incremental = incremental
+        self.manifest_path = manifest_path
+        self.lockstep_max_files = lockstep_max_files
+        self.read_method = read_method
+        self.read_order = read_order
+        self.hdd_concurrency = hdd_concurrency
+        self.max_read_rate = max_read_rate
+        self.max_open_files = max_open_files
+        self.max_cpu_percent = max_cpu_percent
+        self.max_load = max_load
+        self.max_disk_busy = max_disk_busy
+        self.metrics_path = metrics_path
+        self.metrics_format = metrics_format
+        self.metrics_interval = metrics_interval
+        self.checkpoint_path = checkpoint_path
+        self.resume = resume
+        self.results_path = results_path
+        self.shards = shards
+        self.shard = shard
+
+    def to_dict(self):
+        """Settings as a JSON-serializable dictionary."""
+        settings = dict(vars(self))
+        settings['skip_extensions'] = sorted(self.skip_extensions)
+        return settings
+
+    @classmethod
+    def from_dict(cls, settings):
+        """
+        Rebuild settings saved with to_dict().
+
+        Args:
+            settings (dict): Settings as returned by to_dict()
+
+        Returns:
+            ScanConfig: The same settings
+        """
+        return cls(**settings)
+
+
+class ScanEngine:
+    """
+    Finds duplicate files for a ScanConfig.
+
+    run() is a generator and does all of its work on the calling thread
+    (plus the hashing pool). stop() may be called from any thread.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.is_running = False
+        self.executor = None
+        self.cache = None
+        self.manifest = None
+        self.results = None
+        self.run_id = None
+        self.catalog = None
+        self.scheduler = None
+        self.throttle = ResourceThrottle(config.max_read_rate, config.max_open_files, config.max_cpu_percent,
+                                         config.max_load, config.max_disk_busy)
+        self.metrics = ScanMetrics()
+        self.checkpoint = None
+        if config.checkpoint_path or config.resume:
+            self.checkpoint = ScanCheckpoint(config.checkpoint_path or CHECKPOINT_DIR)
+        self.links = {}  # Catalog row -> rows of its other hardlinks
+        self.stats = {
+            'total_files': 0,  # Files found by the walk
+            'processed': 0,    # Files within the size range
+            'skipped': 0,      # Files skipped due to size or extension
+            'hashed': 0,       # Files successfully hashed
+            'duplicates': 0,   # Number of duplicate groups found
+            'duplicate_files': 0,  # Files that are a copy of a kept file
+            'reclaimable': 0,  # Bytes freed by removing every duplicate
+            'total_size': 0,   # Total size of all processed files
+            'pruned': 0,       # Files with a unique size that were never hashed
+            'pruned_size': 0,  # Bytes not read thanks to size pruning
+            'linked': 0,       # Paths that are hardlinks of another scanned path (hashed once)
+            'refreshed': 0,    # Candidates whose manifest or checkpoint record was stale
+            'errors': 0        # Files or directories that could not be read
+        }
+        self.stage_stats = {
+            stage['name']: {'eliminated': 0, 'bytes_read': 0, 'bytes_avoided': 0}
+            for stage in config.partial_stages
+        }
+        if config.lockstep_max_files > 1:
+            self.stage_stats['lockstep'] = {'eliminated': 0, 'bytes_read': 0, 'bytes_avoided': 0}
+
+    def stop(self):
+        """Ask a running scan to stop at the next opportunity."""
+        self.is_running = False
+
+    def _stats_event(self):
+        stats = dict(self.stats)
+        if self.throttle.enabled:
+            stats['throttle'] = self.throttle.status()  # Shown in the status bar, not a counter
+        return ScanEvent('stats', stats)
+
+    def run(self):
+        """
+        Run the scan.
+
+        Yields:
+            ScanEvent: Progress messages, stats snapshots and duplicate groups
+        """
+        config = self.config
+        self.metrics = ScanMetrics()
+        next_write = time.monotonic() + config.metrics_interval
+        try:
+            # Time spent by the caller between events is charged to the 'caller' stage
+            for event in self.metrics.caller(self._scan()):
+                if config.metrics_path and config.metrics_interval and time.monotonic() >= next_write:
+                    self.write_metrics()
+                    next_write = time.monotonic() + config.metrics_interval
+                yield event
+        finally:
+            if config.metrics_path:
+                self.write_metrics()
+
+    def write_metrics(self, path=None):
+        """
+        Write the scan metrics (stage times, counters, histograms) to a file.
+
+        Args:
+            path (str): Output file, by default the configured metrics_path
+        """
+        path = path or self.config.metrics_path
+        try:
+            self.metrics.write(path, self.config.metrics_format, self.stats, self.stage_stats)
+        except OSError as e:
+            logger.error(f"Error writing metrics to {path}: {str(e)}")
+
+    def _scan(self):
+        config = self.config
+        self.is_running = True
+        try:
+            self.executor = create_hash_executor(config.backend, config.workers)
+            self.max_in_flight = config.workers * IN_FLIGHT_PER_WORKER
+            if config.use_cache:
+                self.cache = HashCache(config.cache_path)
+            if config.incremental:
+                self.manifest = DirectoryManifest(config.manifest_path)
+            if config.results_path:
+                self.results = ResultStore(config.results_path)
+                self.run_id = self.results.begin_run(config.roots, config.algorithm)
+
+            yield ScanEvent('log', f"Starting scan in: {', '.join(config.roots)}")
+            yield ScanEvent('log', f"File size range: {format_size(config.min_size)} - {format_size(config.max_size)}")
+            yield ScanEvent('log', f"Using {config.workers} {config.backend} workers for hashing")
+            yield ScanEvent('log', f"Hash algorithms: {config.prefilter} prefilter, {config.algorithm} confirmation "
+                                   f"({config.read_method} reads)")
+            yield ScanEvent('log', f"Skipping extensions: {', '.join(sorted(config.skip_extensions))}")
+            if self.throttle.enabled:
+                yield ScanEvent('log', self.throttle.describe())
+
+            restored = None
+            if config.resume:
+                restored = yield from self.restore_checkpoint()
+                if not self.is_running:
+                    return
+            if restored:
+                candidates, digests, pending = restored
+            else:
+                planned = yield from self.plan_hashing()
+                if planned is None:
+                    return
+                candidates, digests, pending = planned
+                self.save_checkpoint(digests, candidates)
+
+            # Phase 5: full hashes confirm duplicates in the remaining groups;
+            # each group is reported as soon as all of its files are hashed
+            yield ScanEvent('log', f"Hashing {len(candidates)} candidate files...")
+            for batch in self.scheduler.batches(candidates, BATCH_SIZE):
+                if not self.is_running:
+                    return
+                yield ScanEvent('log', f"Processing batch of {len(batch)} files...")
+                with self.metrics.stage('hash'):
+                    matches = self.process_batch(batch, digests, pending)
+                    self.save_checkpoint(digests)
+                yield from self.report_groups(matches)
+                yield self._stats_event()
+            if not self.is_running:
+                return
+
+            if self.checkpoint:
+                self.checkpoint.clear()
+            if self.results:
+                self.results.finish_run(self.run_id, 'done', self.stats)
+                yield ScanEvent('log', f"Stored {self.stats['duplicates']} duplicate groups in "
+                                       f"{self.results.path} (run {self.run_id})")
+            yield ScanEvent('done', dict(self.stats))
+        finally:
+            stopped = not self.is_running
+            self.is_running = False
+            self.metrics.enter('teardown')
+            if self.executor:
+                # Only a stop may leave running jobs behind; otherwise the process
+                # pool must be joined before interpreter teardown
+                self.executor.shutdown(wait=not stopped, cancel_futures=True)
+                self.executor = None
+            if self.cache:
+                self.cache.close()
+            if self.manifest:
+                self.manifest.close()
+            if self.results:
+                # Runs that did not complete keep the groups found so far
+                self.results.finish_run(self.run_id, 'stopped', self.stats)
+                self.results.close()
+
+    def plan_hashing(self):
+        """
+        Walk the tree and narrow it down to the files that need a full hash.
+
+        Yields:
+            ScanEvent: Progress of the walk and the filtering stages
+
+        Returns:
+            tuple: (candidate rows, DigestTable of the files already confirmed
+            in lockstep, PendingGroups of the candidates), or None if the scan
+            was stopped
+        """
+        config = self.config
+
+        # Phase 1: walk the tree into the catalog without reading content
+        with self.metrics.stage('walk'):
+            self.catalog = yield from self.build_catalog()
+        if not self.is_running:
+            return None
+        self.scheduler = DeviceScheduler(self.catalog, self.max_in_flight,
+                                         config.read_order, config.hdd_concurrency)
+        for line in self.scheduler.describe():
+            yield ScanEvent('log', line)
+
+        # Hardlinks of the same file are one logical file, hashed once
+        with self.metrics.stage('hardlinks'):
+            aliases = yield from self.collapse_hardlinks()
+
+        # Phase 2: only files sharing their size with another file can be duplicates
+        if config.prune_sizes:
+            with self.metrics.stage('prune'):
+                candidates = self.prune_unique_sizes(aliases)
+            yield ScanEvent('log', f"Size pruning skipped {self.stats['pruned']} files "
+                                   f"({format_size(self.stats['pruned_size'])} not read)")
+        else:
+            candidates = array(INDEX_TYPECODE, (index for index in range(len(self.catalog))
+                                                if index not in aliases))
+
+        # Records replayed from the manifest may predate in-place edits; only
+        # candidates are checked, so pruning above trusted the recorded sizes
+        if self.manifest:
+            with self.metrics.stage('refresh'):
+                candidates = self.refresh_candidates(candidates)
+            yield ScanEvent('log', f"Re-checked candidates, {self.stats['refreshed']} changed in place")
+
+        # Phase 3: cheap partial hashes eliminate most same-size candidates
+        groups = yield from self.filter_partial_hashes(candidates)
+        if not self.is_running:
+            return None
+
+        # Phase 4: small groups are compared in lockstep, stopping at the first difference
+        digests = DigestTable()
+        with self.metrics.stage('lockstep'):
+            groups = yield from self.compare_small_groups(groups, digests)
+        if not self.is_running:
+            return None
+        candidates = array(INDEX_TYPECODE, (index for files in groups for index in files))
+        return candidates, digests, PendingGroups(groups)
+
+    def restore_checkpoint(self):
+        """
+        Load the catalog and the digests of an interrupted scan.
+
+        Yields:
+            ScanEvent: Progress messages
+
+        Returns:
+            tuple: (rows still to hash, DigestTable of the rows already
+            hashed, PendingGroups of the rows still to hash), or None if
+            there is no checkpoint to resume from. A checkpoint saved with
+            other hash settings stops the scan.
+        """
+        state = self.checkpoint.load()
+        if state is None:
+            yield ScanEvent('log', f"No checkpoint in {self.checkpoint.directory}, starting a new scan")
+            return None
+        mismatched = self.checkpoint.mismatched_settings(self.config, state)
+        if mismatched:
+            # Digests of different algorithms or stages must never be compared
+            yield ScanEvent('log', f"Cannot resume from {self.checkpoint.directory}: the checkpoint was saved "
+                                   f"with different {', '.join(mismatched)} settings")
+            self.is_running = False
+            return None
+        self.catalog = state['catalog']
+        self.stats.update(state['stats'])
+        self.stage_stats.update(state['stage_stats'])
+        digests = state['digests']
+        yield ScanEvent('log', f"Resuming from checkpoint: {len(digests)} files already hashed, "
+                               f"{len(state['candidates'])} to go")
+        self.scheduler = DeviceScheduler(self.catalog, self.max_in_flight,
+                                         self.config.read_order, self.config.hdd_concurrency)
+        # Rebuilds the hardlink table and reports the linked files again
+        yield from self.collapse_hardlinks()
+
+        # Files may have changed while the scan was stopped
+        with self.metrics.stage('refresh'):
+            candidates = self.refresh_candidates(state['candidates'])
+        yield self._stats_event()
+
+        # The partial hash groups are not saved; files of the same size are
+        # grouped instead, and groups hashed before the stop are reported again
+        for key in ('duplicates', 'duplicate_files', 'reclaimable'):
+            self.stats[key] = 0
+        sizes = defaultdict(list)
+        for index in list(digests.indexes) + list(candidates):
+            sizes[self.catalog.sizes[index]].append(index)
+        pending = PendingGroups(sizes.values())
+        matches = []
+        for position, index in enumerate(digests.indexes):
+            matches += pending.finish(index, digests.digest(position).hex())
+        yield from self.report_groups(matches)
+        return candidates, digests, pending
+
+    def save_checkpoint(self, digests, candidates=None):
+        """
+        Record the digests of the batches hashed so far.
+
+        Args:
+            digests (DigestTable): All digests of the scan
+            candidates (array): Rows still to hash; starts a new checkpoint
+                with the catalog when given
+        """
+        if not self.checkpoint:
+            return
+        if self.cache:
+            self.cache.flush()
+        try:
+            if candidates is not None:
+                self.checkpoint.save_plan(self.config, self.catalog, candidates, digests,
+                                          self.stats, self.stage_stats)
+            else:
+                self.checkpoint.save_progress(self.config, digests, self.stats, self.stage_stats)
+        except OSError as e:
+            logger.error(f"Error writing checkpoint {self.checkpoint.directory}: {str(e)}")
+
+    def build_catalog(self):
+        """
+        Walk the configured roots and store in-range files in a catalog.
+
+        Yields:
+            ScanEvent: Progress while walking
+
+        Returns:
+            FileCatalog: Every file within the size range
+        """
+        config = self.config
+        catalog = FileCatalog()
+        walk_errors = []
+
+        yield ScanEvent('log', "\nScanning directory structure...")
+        on_error = lambda path, e: walk_errors.append((path, e))
+        if config.shards > 1:
+            entries = walk_shard(config.roots, config.shards, config.shard, config.walk_workers,
+                                 on_error, lambda: self.is_running, self.manifest)
+        else:
+            entries = walk_files(config.roots, config.walk_workers, on_error,
+                                 lambda: self.is_running, self.manifest)
+        for entry in entries:
+            self.stats['total_files'] += 1
+            if self.stats['total_files'] % BATCH_SIZE == 0:
+                yield ScanEvent('log', f"Found {self.stats['total_files']} files so far...")
+                yield self._stats_event()
+
+            # Skip files with specified extensions
+            filename = os.path.basename(entry.path).lower()
+            if any(filename.endswith(ext) for ext in config.skip_extensions):
+                self.stats['skipped'] += 1
+                continue
+
+            # Size comes from the stat made during the walk
+            size = entry.size
+            self.stats['total_size'] += size
+
+            # Skip files outside size range
+            if size < config.min_size or size > config.max_size:
+                self.stats['skipped'] += 1
+                continue
+
+            catalog.add(entry)
+            self.stats['processed'] += 1
+
+        self.stats['errors'] += len(walk_errors)
+        for path, e in walk_errors:
+            yield ScanEvent('log', f"Error accessing {path}: {str(e)}")
+        yield ScanEvent('log', f"Found {self.stats['total_files']} files "
+                               f"(catalog uses {format_size(catalog.nbytes())})")
+        if self.manifest:
+            # Directories that were not walked this time no longer exist
+            if self.is_running:
+                self.manifest.prune(config.roots)
+            yield ScanEvent('log', self.manifest.report())
+        yield self._stats_event()
+        return catalog
+
+    def collapse_hardlinks(self):
+        """
+        Group catalog rows that are hardlinks of the same file.
+
+        Only files with a link count above one can share an inode, so the
+        lookup table stays small even for huge scans.
+
+        Yields:
+            ScanEvent: A 'linked' event for each file reachable by several paths
+
+        Returns:
+            set: Rows of the extra links, which are not hashed on their own
+        """
+        catalog = self.catalog
+        primaries = {}
+        self.links = {}
+        for index, nlink in enumerate(catalog.nlinks):
+            if nlink < 2:
+                continue
+            primary = primaries.setdefault(catalog.file_id(index), index)
+            if primary != index:
+                self.links.setdefault(primary, []).append(index)
+        del primaries
+
+        aliases = set()
+        for primary, others in self.links.items():
+            aliases.update(others)
+            yield ScanEvent('linked', LinkedFile(
+                catalog.sizes[primary], [catalog.record(index) for index in [primary] + others]))
+        self.stats['linked'] = len(aliases)
+        if aliases:
+            yield ScanEvent('log', f"{len(aliases)} files are hardlinks of another scanned file "
+                                   f"and will be hashed once")
+        return aliases
+
+    def prune_unique_sizes(self, aliases=frozenset()):
+        """
+        Drop files whose size is unique, since they cannot have a duplicate.
+
+        A first pass counts sizes into a fixed bytearray of hash buckets, so
+        exact counts are only kept for sizes that land in a shared bucket
+        instead of in a dictionary holding every size of the scan.
+
+        Args:
+            aliases (set): Rows of extra hardlinks, ignored entirely
+
+        Returns:
+            array: Catalog rows of files whose size occurs two or more times
+        """
+        sizes = self.catalog.sizes
+        buckets = bytearray(max(1024, len(sizes)))
+        for index, size in enumerate(sizes):
+            if index in aliases:
+                continue
+            bucket = hash(size) % len(buckets)
+            if buckets[bucket] < 2:
+                buckets[bucket] += 1
+
+        counts = {}
+        for index, size in enumerate(sizes):
+            if index not in aliases and buckets[hash(size) % len(buckets)] > 1:
+                counts[size] = counts.get(size, 0) + 1
+        del buckets
+
+        candidates = array(INDEX_TYPECODE)
+        for index, size in enumerate(sizes):
+            if index in aliases:
+                continue
+            if counts.get(size, 0) > 1:
+                candidates.append(index)
+            else:
+                self.stats['pruned'] += 1
+                self.stats['pruned_size'] += size
+        return candidates
+
+    def refresh_candidates(self, candidates):
+        """
+        Re-stat candidates and update rows that changed since they were recorded.
+
+        Needed for records replayed from the directory manifest, which cannot
+        see files edited in place, and for rows restored from a checkpoint.
+        Files that have disappeared are dropped.
+
+        Args:
+            candidates (array): Catalog rows of the candidate files
+
+        Returns:
+            array: Catalog rows of the candidates that still exist
+        """
+        catalog = self.catalog
+        refreshed = array(INDEX_TYPECODE)
+        for index in candidates:
+            if not self.is_running:
+                break
+            try:
+                st = os.stat(catalog.path(index))
+            except FileNotFoundError:
+                # Deleted since it was recorded; its cached hashes will never be used again
+                if self.cache:
+                    self.cache.invalidate(catalog.fingerprint(index))
+                continue
+            except OSError as e:
+                self.stats['errors'] += 1
+                logger.error(f"Error accessing {catalog.path(index)}: {str(e)}")
+                continue
+            if catalog.update(index, st):
+                self.stats['refreshed'] += 1
+            refreshed.append(index)
+        return refreshed
+
+    def cached_hashes(self, func, jobs, kind, make_args, stage):
+        """
+        Hash files on the worker pool, answering from the hash cache where possible.
+
+        Args:
+            func (callable): Hash function to run for cache misses
+            jobs (iterable): (key, catalog row) tuples
+            kind (str): Cache kind naming the algorithm and hashing stage
+            make_args (callable): Builds the arguments of func for a catalog row
+            stage (str): Stage name for the scan metrics
+
+        Yields:
+            tuple: (key, catalog row, hash, cached) with hash None if the file could not be read
+        """
+        catalog = self.catalog
+        misses = []
+        for key, index in jobs:
+            digest = self.cache.get(catalog.fingerprint(index), kind) if self.cache else None
+            if digest is not None:
+                self.metrics.count(f"{stage}_cached")
+                yield key, index, digest, True
+            else:
+                misses.append((key, index))
+
+        # Misses are read per device, in on-disk order; arguments (and so paths)
+        # are only built as jobs are submitted
+        lanes = self.scheduler.lanes(misses, make_args)
+        for (key, index), digest in iter_scheduled(
+                self.executor, func, lanes,
+                self.max_in_flight, lambda: self.is_running, self.throttle,
+                self.metrics, stage):
+            if digest is not None and self.cache:
+                self.cache.put(catalog.fingerprint(index), digest, kind)
+            yield key, index, digest, False
+
+    def filter_partial_hashes(self, candidates):
+        """
+        Run the partial hashing stages and drop files that no longer collide.
+
+        Args:
+            candidates (array): Catalog rows of the candidate files
+
+        Yields:
+            ScanEvent: Per-stage progress
+
+        Returns:
+            list: Groups (lists of catalog rows) that still collide after every stage
+        """
+        config = self.config
+        catalog = self.catalog
+        sizes = catalog.sizes
+        groups = defaultdict(list)
+        for index in candidates:
+            groups[sizes[index]].append(index)
+
+        for stage in config.partial_stages:
+            stats = self.stage_stats[stage['name']]
+            before = sum(len(files) for files in groups.values())
+            # Files the stage would read completely go on unchanged; all files of a group share their size
+            next_groups = defaultdict(list, {key: files for key, files in groups.items()
+                                             if reads_whole_file(sizes[files[0]], stage)})
+
+            jobs = ((key, index) for key, files in groups.items() if key not in next_groups for index in files)
+            make_args = lambda index, stage=stage: (
+                catalog.path(index), partial_hash_ranges(sizes[index], stage), config.prefilter,
+                self.throttle.job_rate())
+            # Algorithm and stage settings are part of the cache kind so hashes are never mixed
+            kind = f"{config.prefilter}:{stage['mode']}:{stage['block_size']}x{stage['blocks']}"
+            with self.metrics.stage(f"partial:{stage['name']}"):
+                for key, index, partial_hash, cached in self.cached_hashes(
+                        calculate_partial_hash, jobs, kind, make_args, stage['name']):
+                    if partial_hash is None:
+                        self.stats['errors'] += 1
+                        continue
+                    if not cached:
+                        stats['bytes_read'] += sum(length for _, length in partial_hash_ranges(sizes[index], stage))
+                    next_groups[(key, partial_hash)].append(index)
+
+            if not self.is_running:
+                return []
+
+            # Files with a unique stage hash cannot have a duplicate
+            groups = defaultdict(list)
+            for key, files in next_groups.items():
+                if len(files) < 2:
+                    size = sizes[files[0]]
+                    stats['eliminated'] += 1
+                    stats['bytes_avoided'] += size - sum(length for _, length in partial_hash_ranges(size, stage))
+                    continue
+                groups[key] = files
+
+            remaining = sum(len(files) for files in groups.values())
+            yield ScanEvent('log', f"Partial hash stage '{stage['name']}': "
+                                   f"{before} -> {remaining} candidates")
+
+        return list(groups.values())
+
+    def compare_small_groups(self, groups, digests):
+        """
+        Compare the files of small groups in lockstep instead of hashing them.
+
+        Groups with more files, or with a cached full hash, are left to the
+        hashing phase, which is cheaper for them. Groups compared in an
+        earlier scan are answered from the hash cache. The duplicates of
+        each compared group are reported as soon as its comparison is done.
+
+        Args:
+            groups (list): Groups (lists of catalog rows) of possible duplicates
+            digests (DigestTable): Table receiving the digests of matching files
+
+        Yields:
+            ScanEvent: Progress and duplicate groups
+
+        Returns:
+            list: Groups (lists of catalog rows) that still need a full hash
+        """
+        config = self.config
+        catalog = self.catalog
+        kind = f"{config.algorithm}:full"
+        stats = self.stage_stats.get('lockstep')
+        remaining = []
+        small = []
+        for files in groups:
+            if not 2 <= len(files) <= config.lockstep_max_files:
+                remaining.append(files)
+                continue
+            recalled = self.recall_comparison(files) if self.cache else None
+            if recalled is not None:
+                self.metrics.count('lockstep_cached', len(files))
+                stats['bytes_avoided'] += catalog.sizes[files[0]] * len(files)
+                for index, digest in zip(files, recalled):
+                    if digest is None:
+                        stats['eliminated'] += 1
+                    else:
+                        self.stats['hashed'] += 1
+                        digests.add(index, digest)
+                yield from self.report_groups(same_digest(zip(files, recalled)))
+            elif self.cache and any(self.cache.contains(catalog.fingerprint(index), kind) for index in files):
+                remaining.append(files)
+            else:
+                small.append(files)
+        if not small:
+            return remaining
+
+        yield ScanEvent('log', f"Comparing {len(small)} small groups in lockstep...")
+        # Groups are scheduled by their first file: its device's lane, in its on-disk order
+        first_of = {files[0]: files for files in small}
+        make_args = lambda index: ([catalog.path(member) for member in first_of[index]], config.chunk_size,
+                                   config.algorithm, self.throttle.job_rate())
+        lanes = self.scheduler.lanes(((tuple(files), files[0]) for files in small), make_args)
+        for (files, _), result in iter_scheduled(self.executor, compare_lockstep, lanes,
+                                                 min(self.max_in_flight, len(small)),
+                                                 lambda: self.is_running, self.throttle,
+                                                 self.metrics, 'lockstep'):
+            if result is None:
+                self.stats['errors'] += len(files)
+                continue
+            group_digests, errors, bytes_read = result
+            self.stats['errors'] += errors
+            stats['bytes_read'] += bytes_read
+            stats['bytes_avoided'] += catalog.sizes[files[0]] * len(files) - bytes_read
+            # Only a comparison that read every file can rule one out for good
+            group_key = comparison_key([catalog.fingerprint(index) for index in files]) if not errors else None
+            for index, digest in zip(files, group_digests):
+                if digest is None:
+                    stats['eliminated'] += 1
+                    if self.cache and group_key:
+                        self.cache.put(catalog.fingerprint(index), group_key, f"{config.algorithm}:lockstep")
+                    continue
+                self.stats['hashed'] += 1
+                digests.add(index, digest)
+                if self.cache:
+                    self.cache.put(catalog.fingerprint(index), digest, kind)
+            yield from self.report_groups(same_digest(zip(files, group_digests)))
+        yield ScanEvent('log', f"Lockstep comparison ruled out {stats['eliminated']} files, "
+                               f"avoided reading {format_size(stats['bytes_avoided'])}")
+        yield self._stats_event()
+        return remaining
+
+    def recall_comparison(self, files):
+        """
+        Answer a small group from the hash cache without reading it.
+
+        Every file needs either a cached full hash or a record that it
+        differed from exactly these files (same fingerprints) in an earlier
+        lockstep comparison.
+
+        Args:
+            files (list): Catalog rows of the group
+
+        Returns:
+            list: Hex digest of each file, None for files ruled out, or None
+            if the group has to be compared again
+        """
+        catalog = self.catalog
+        full_kind = f"{self.config.algorithm}:full"
+        lockstep_kind = f"{self.config.algorithm}:lockstep"
+        fingerprints = [catalog.fingerprint(index) for index in files]
+        group_key = comparison_key(fingerprints)
+        recalled = []
+        for fingerprint in fingerprints:
+            digest = self.cache.lookup(fingerprint, full_kind)
+            if digest is None and self.cache.lookup(fingerprint, lockstep_kind) != group_key:
+                return None
+            recalled.append(digest)
+        # Count the hits and keep the entries from being evicted
+        for fingerprint, digest in zip(fingerprints, recalled):
+            self.cache.get(fingerprint, full_kind if digest else lockstep_kind)
+        return recalled
+
+    def process_batch(self, batch, digests, pending=None):
+        """
+        Fully hash a batch of files and store their digests.
+
+        Args:
+            batch (list): Catalog rows to hash
+            digests (DigestTable): Table receiving the raw digests
+            pending (PendingGroups): Groups of the candidates, if groups
+                completed by this batch should be returned
+
+        Returns:
+            list: (hex digest, catalog rows) of the duplicates in the groups
+            whose last files were in this batch
+        """
+        matches = []
+        config = self.config
+        catalog = self.catalog
+        # Hash files on the worker pool and collect results as they finish
+        make_args = lambda index: (catalog.path(index), config.chunk_size, config.algorithm, config.read_method,
+                                   self.throttle.job_rate())
+        for _, index, file_hash, cached in self.cached_hashes(
+                calculate_file_hash, ((None, index) for index in batch),
+                f"{config.algorithm}:full", make_args, 'hash'):
+            if file_hash:
+                self.stats['hashed'] += 1
+                if not cached:
+                    self.metrics.count('bytes_hashed', catalog.sizes[index])
+                digests.add(index, file_hash)
+            else:
+                self.stats['errors'] += 1
+                logger.error(f"Error processing {catalog.path(index)}")
+            if pending:
+                matches += pending.finish(index, file_hash)
+        return matches
+
+    def find_duplicates(self, matches):
+        """
+        Turn files with the same full digest into duplicate groups.
+
+        Args:
+            matches (iterable): (hex digest, catalog rows) of files with the
+                same size and digest
+
+        Yields:
+            DuplicateGroup: Each set of identical files, newest first
+        """
+        for file_hash, indexes in matches:
+            # Paths are only materialized for confirmed duplicates
+            group_files, links = distinct_files([self.catalog.record(index) for index in indexes])
+            if len(group_files) < 2:
+                continue
+            links += [self.catalog.record(link) for index in indexes for link in self.links.get(index, ())]
+
+            # Keep the most recently modified file (mtime comes from the walk, no stat here)
+            group_files.sort(key=lambda record: record.mtime_ns, reverse=True)
+            group = DuplicateGroup(self.catalog.sizes[indexes[0]], file_hash, self.config.algorithm,
+                                   group_files, links)
+            self.stats['duplicates'] += 1
+            self.stats['duplicate_files'] += len(group.duplicate_files)
+            self.stats['reclaimable'] += group.reclaimable
+            yield group
+
+    def report_groups(self, matches):
+        """
+        Store and report the duplicate groups of completed candidate groups.
+
+        Args:
+            matches (list): (hex digest, catalog rows) of files with the same
+                size and digest
+
+        Yields:
+            ScanEvent: A 'group' event per duplicate group
+        """
+        if not matches:
+            return
+        with self.metrics.stage('group'):
+            groups = list(self.find_duplicates(matches))
+            if self.results:
+                for group in groups:
+                    self.results.add_group(self.run_id, group)
+        for group in groups:
+            yield ScanEvent('group', group)
+
+    def summary(self):
+        """
+        Summarize the scan for the progress log.
+
+        Returns:
+            list: Summary lines
+        """
+        stats = self.stats
+        lines = [
+            f"Total files found: {stats['total_files']}",
+            f"Files processed: {stats['processed']}",
+            f"Total size processed: {format_size(stats['total_size'])}",
+            f"Files skipped: {stats['skipped']}",
+            f"Files pruned by size: {stats['pruned']} "
+            f"({format_size(stats['pruned_size'])} saved from reading)",
+        ]
+        if self.manifest:
+            lines.append(self.manifest.report())
+        for name, stage in self.stage_stats.items():
+            lines.append(f"Stage '{name}': eliminated {stage['eliminated']} files, "
+                         f"read {format_size(stage['bytes_read'])}, "
+                         f"avoided {format_size(stage['bytes_avoided'])}")
+        if stats['linked']:
+            lines.append(f"Hardlinked files (already deduplicated): {stats['linked']}")
+        lines.append(f"Files hashed: {stats['hashed']}")
+        lines.append(f"Duplicate groups found: {stats['duplicates']}")
+        lines.append(f"Space reclaimable: {format_size(stats['reclaimable'])}")
+        if self.cache:
+            lines.append(self.cache.report())
+        if self.throttle.enabled:
+            lines.append(f"Throttle backed off {self.throttle.backoffs} times")
+        lines.append(self.metrics.report())
+        return lines
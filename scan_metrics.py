@@ -0,0 +1,235 @@
+"""
+Scan instrumentation for Deduplicationator 3000.
+
+ScanMetrics attributes the wall time of a scan to the stage that was running
+(walk, size pruning, partial hashing, full hashing, ...) and to the caller,
+i.e. the time a GUI or CLI spends handling events between two of them, which
+is where the UI and deletions run. Next to the stage times it keeps counters
+and histograms of per-file hashing time and of jobs in flight, and writes
+everything as JSON or in the Prometheus text format.
+"""
+
+import os
+import json
+import time
+import bisect
+from contextlib import contextmanager
+
+METRICS_FORMATS = ('json', 'prometheus')
+METRICS_PREFIX = "dedup"
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = tuple(0.0005 * 2**i for i in range(18))  # 0.5ms .. ~65s
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def timed_call(func, *args):
+    """
+    Call func and measure it, in a worker.
+
+    Args:
+        func (callable): Picklable function
+        *args: Arguments of func
+
+    Returns:
+        tuple: (result, seconds)
+    """
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds, Prometheus style."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        """Bucket counts (not cumulative), count and sum."""
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {'count': self.count, 'sum': round(self.sum, 6), 'buckets': buckets}
+
+
+class ScanMetrics:
+    """Stage timers, counters and histograms of one scan."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stage_seconds = {}   # Stage -> wall seconds spent in it
+        self.stage_entries = {'setup': 1}  # Stage -> times it was entered
+        self.counters = {}        # Name -> value
+        self.histograms = {}      # (name, stage) -> Histogram
+        self.max_depth = {}       # Stage -> most jobs in flight at once
+        self._stage = 'setup'
+        self._since = self.started
+
+    def _switch(self, stage):
+        """Charge the time since the last switch to the current stage and make stage current."""
+        now = time.perf_counter()
+        self.stage_seconds[self._stage] = self.stage_seconds.get(self._stage, 0.0) + now - self._since
+        previous, self._stage, self._since = self._stage, stage, now
+        return previous
+
+    def enter(self, name):
+        """Make a stage current until the next switch, e.g. for a stage that lasts to the end."""
+        self.stage_entries[name] = self.stage_entries.get(name, 0) + 1
+        self._switch(name)
+
+    @contextmanager
+    def stage(self, name):
+        """Attribute the time spent in the with block to a stage."""
+        self.stage_entries[name] = self.stage_entries.get(name, 0) + 1
+        previous = self._switch(name)
+        try:
+            yield
+        finally:
+            self._switch(previous)
+
+    def caller(self, events):
+        """
+        Pass events through, charging the time the caller spends on each to the 'caller' stage.
+
+        Args:
+            events (iterator): ScanEvents of a running scan
+
+        Yields:
+            ScanEvent: The same events
+        """
+        for event in events:
+            self.stage_entries['caller'] = self.stage_entries.get('caller', 0) + 1
+            previous = self._switch('caller')
+            try:
+                yield event
+            finally:
+                self._switch(previous)
+
+    def report(self):
+        """
+        Summarize where the time went for the progress log.
+
+        Returns:
+            str: Stages by time spent, slowest first
+        """
+        self._switch(self._stage)
+        stages = sorted(self.stage_seconds.items(), key=lambda item: item[1], reverse=True)
+        return "Time by stage: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in stages)
+
+    def count(self, name, value=1):
+        """Add to a counter."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe_job(self, stage, seconds, in_flight):
+        """
+        Record one finished worker job.
+
+        Args:
+            stage (str): Stage the job belongs to
+            seconds (float): Time the job ran in the worker
+            in_flight (int): Jobs in flight when it finished
+        """
+        for name, bounds, value in (('job_seconds', SECONDS_BUCKETS, seconds),
+                                    ('in_flight', DEPTH_BUCKETS, in_flight)):
+            histogram = self.histograms.get((name, stage))
+            if histogram is None:
+                histogram = self.histograms[(name, stage)] = Histogram(bounds)
+            histogram.observe(value)
+        self.max_depth[stage] = max(self.max_depth.get(stage, 0), in_flight)
+
+    def snapshot(self, stats=None, stage_stats=None):
+        """
+        All metrics as a JSON-serializable dictionary.
+
+        Args:
+            stats (dict): Engine counters to include
+            stage_stats (dict): Per-stage elimination counters to include
+
+        Returns:
+            dict: Metrics, with the time of the current stage charged up to now
+        """
+        self._switch(self._stage)
+        return {
+            'elapsed': round(time.perf_counter() - self.started, 6),
+            'current_stage': self._stage,
+            'stages': {stage: {'seconds': round(seconds, 6), 'entries': self.stage_entries.get(stage, 0)}
+                       for stage, seconds in self.stage_seconds.items()},
+            'counters': dict(self.counters),
+            'stats': dict(stats or {}),
+            'stage_stats': dict(stage_stats or {}),
+            'histograms': {f"{name}:{stage}": histogram.to_dict()
+                           for (name, stage), histogram in self.histograms.items()},
+            'max_in_flight': dict(self.max_depth),
+        }
+
+    def prometheus(self, stats=None, stage_stats=None):
+        """
+        All metrics in the Prometheus text exposition format.
+
+        Args:
+            stats (dict): Engine counters to include
+            stage_stats (dict): Per-stage elimination counters to include
+
+        Returns:
+            str: Exposition text
+        """
+        snapshot = self.snapshot(stats, stage_stats)
+        p = METRICS_PREFIX
+        lines = [f"# HELP {p}_stage_seconds_total Wall time spent in each scan stage",
+                 f"# TYPE {p}_stage_seconds_total counter"]
+        lines += [f'{p}_stage_seconds_total{{stage="{stage}"}} {values["seconds"]}'
+                  for stage, values in snapshot['stages'].items()]
+
+        lines += [f"# HELP {p}_scan Scan counters", f"# TYPE {p}_scan gauge"]
+        lines += [f'{p}_scan{{counter="{name}"}} {value}'
+                  for name, value in {**snapshot['stats'], **snapshot['counters']}.items()
+                  if isinstance(value, (int, float))]
+
+        lines += [f"# HELP {p}_stage_files Files and bytes of each partial stage", f"# TYPE {p}_stage_files gauge"]
+        for stage, values in snapshot['stage_stats'].items():
+            lines += [f'{p}_stage_files{{stage="{stage}",counter="{name}"}} {value}'
+                      for name, value in values.items()]
+
+        for name, help_text in (('job_seconds', "Time a worker spent on one job"),
+                                ('in_flight', "Jobs in flight when a job finished")):
+            lines += [f"# HELP {p}_{name} {help_text}", f"# TYPE {p}_{name} histogram"]
+            for (hist_name, stage), histogram in self.histograms.items():
+                if hist_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(histogram.bounds) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{p}_{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{p}_{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{p}_{name}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, metrics_format=None, stats=None, stage_stats=None):
+        """
+        Write the metrics to a file, replacing it atomically.
+
+        Args:
+            path (str): Output file
+            metrics_format (str): 'json' or 'prometheus'; by default
+                'prometheus' for .prom files and 'json' otherwise
+            stats (dict): Engine counters to include
+            stage_stats (dict): Per-stage elimination counters to include
+        """
+        if metrics_format is None:
+            metrics_format = 'prometheus' if path.endswith('.prom') else 'json'
+        if metrics_format == 'prometheus':
+            text = self.prometheus(stats, stage_stats)
+        else:
+            text = json.dumps(self.snapshot(stats, stage_stats), indent=2)
+        temp = f"{path}.tmp"
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp, path)
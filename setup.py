@@ -32,6 +32,11 @@ setup(
             base=base,
             target_name="Deduplicationator3000.exe",
             icon="icon.ico" if os.path.exists("icon.ico") else None
+        ),
+        Executable(
+            "dedup_cli.py",
+            base=None,
+            target_name="Deduplicationator3000-cli.exe"
         )
     ]
 ) 
\ No newline at end of file
@@ -0,0 +1,563 @@
+"""
+Sharded scanning for Deduplicationator 3000.
+
+One scan process cannot keep up with the largest storage pools, so a
+sharded scan splits the work over several workers, on one host or many:
+
+1. Every worker walks its shard of the roots (file_walker.walk_shard) and
+   reports the sizes of its files and the identity of its hardlinked ones.
+2. The coordinator merges the sizes of all shards. Files whose size (or
+   partial hash, after each partial hashing stage) is unique across all
+   shards are dropped, and each worker is told which of its files go on.
+3. Workers fully hash the files that still collide and return their
+   digests and records; the coordinator forms the duplicate groups.
+
+Workers and coordinator only talk through files in a shared work
+directory, written atomically (write, then rename), so a local disk works
+for several processes on one box and a network filesystem for several
+hosts:
+
+    .dedup-work-dir              marks the directory as a work directory
+    job.json                     settings, shard count and the rounds
+    tasks/<round>.<shard>        what a worker has to do in a round
+    results/<round>.<shard>      what it found
+    results/<round>.<shard>.err  why it failed
+    stop                         asks the workers to exit
+
+Files are referred to by their row in the worker's catalog, so the
+manifests exchanged per round are compact: sizes, (row, partial hash)
+pairs, and records with paths only for the files that are fully hashed.
+Tasks and results are plain JSON, since anyone who can write to a shared
+directory could otherwise make its readers run code. A coordinator only
+resets a directory that is empty or already carries the marker file.
+"""
+
+import os
+import json
+import time
+import shutil
+import signal
+import logging
+import threading
+import traceback
+import multiprocessing
+from array import array
+from collections import defaultdict
+
+from scan_engine import (ScanConfig, ScanEngine, ScanEvent, DuplicateGroup, create_hash_executor,
+                         calculate_partial_hash, distinct_files, partial_hash_ranges, reads_whole_file, format_size,
+                         BATCH_SIZE, IN_FLIGHT_PER_WORKER)
+from file_catalog import DigestTable, INDEX_TYPECODE
+from file_walker import FileRecord
+from io_scheduler import DeviceScheduler
+from result_store import ResultStore
+
+POLL_INTERVAL = 0.2   # Seconds between checks of the work directory
+WAIT_REPORT = 30      # Seconds between "waiting for shard" messages
+WORK_DIR_MARKER = ".dedup-work-dir"
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    """Encode the row arrays of tasks and results as JSON lists."""
+    if isinstance(value, array):
+        return value.tolist()
+    raise TypeError(f"Cannot encode {type(value).__name__} for a shard")
+
+
+def _write_atomic(path, payload):
+    """Write payload to path as JSON so that readers never see a partial file."""
+    temp = f"{path}.{os.getpid()}.tmp"
+    # Paths that are not valid UTF-8 travel as escaped surrogates
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, default=_json_default)
+    os.replace(temp, path)
+
+
+def _read(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def claim_work_dir(work_dir):
+    """
+    Create a work directory, or check that an existing one belongs to a sharded scan.
+
+    Args:
+        work_dir (str): Work directory shared with the workers
+
+    Raises:
+        ValueError: If the directory holds files but no work directory marker
+        OSError: If the directory cannot be created
+    """
+    marker = os.path.join(work_dir, WORK_DIR_MARKER)
+    if os.path.isdir(work_dir) and os.listdir(work_dir) and not os.path.exists(marker):
+        raise ValueError(f"{work_dir} is not empty and is not a work directory of a sharded scan")
+    os.makedirs(work_dir, exist_ok=True)
+    with open(marker, 'w', encoding='utf-8') as f:
+        f.write("Work directory of a Deduplicationator 3000 sharded scan; its contents are reset by each job\n")
+
+
+def _drain(events):
+    """Run one of the engine's generator stages to the end and return its result."""
+    while True:
+        try:
+            next(events)
+        except StopIteration as stop:
+            return stop.value
+
+
+class ShardWorker:
+    """Runs the rounds of one shard of a sharded scan."""
+
+    def __init__(self, work_dir, shard):
+        """
+        Args:
+            work_dir (str): Shared work directory of the job
+            shard (int): Shard to work on
+        """
+        self.work_dir = work_dir
+        self.shard = shard
+        self.engine = None
+
+    def _path(self, kind, round_name):
+        return os.path.join(self.work_dir, kind, f"{round_name.replace(':', '-')}.{self.shard}")
+
+    def _stopped(self):
+        return os.path.exists(os.path.join(self.work_dir, "stop"))
+
+    def run(self):
+        """
+        Wait for the job and work through its rounds, then exit.
+
+        Returns:
+            bool: True if every round was done, False if the job was stopped
+        """
+        job_path = os.path.join(self.work_dir, "job.json")
+        while not os.path.exists(job_path):
+            if self._stopped():
+                return False
+            time.sleep(POLL_INTERVAL)
+        with open(job_path, encoding='utf-8') as f:
+            job = json.load(f)
+
+        config = ScanConfig.from_dict(job['config'])
+        config.shards, config.shard = job['shards'], self.shard
+        engine = self.engine = ScanEngine(config)
+        engine.is_running = True
+        engine.executor = create_hash_executor(config.backend, config.workers)
+        engine.max_in_flight = config.workers * IN_FLIGHT_PER_WORKER
+        threading.Thread(target=self._watch_stop, name="stop-watch", daemon=True).start()
+        try:
+            for round_name in job['rounds']:
+                task_path = self._path('tasks', round_name)
+                while not os.path.exists(task_path):
+                    if self._stopped():
+                        return False
+                    time.sleep(POLL_INTERVAL)
+                try:
+                    result = self.run_round(round_name, _read(task_path))
+                except Exception:
+                    with open(f"{self._path('results', round_name)}.err", 'w', encoding='utf-8') as f:
+                        f.write(traceback.format_exc())
+                    raise
+                _write_atomic(self._path('results', round_name), result)
+            return True
+        finally:
+            stopped = not engine.is_running
+            engine.is_running = False
+            engine.executor.shutdown(wait=not stopped, cancel_futures=True)
+
+    def _watch_stop(self):
+        """Stop the running round as soon as the coordinator asks the workers to exit."""
+        while self.engine.is_running:
+            if self._stopped():
+                self.engine.stop()
+                return
+            time.sleep(POLL_INTERVAL)
+
+    def run_round(self, round_name, task):
+        """
+        Do one round of the job.
+
+        Args:
+            round_name (str): 'walk', 'partial:<stage>' or 'full'
+            task (dict): Task written by the coordinator
+
+        Returns:
+            dict: Result for the coordinator
+        """
+        engine = self.engine
+        if round_name == 'walk':
+            # Progress events stay on the worker
+            catalog = engine.catalog = _drain(engine.build_catalog())
+            engine.scheduler = DeviceScheduler(catalog, engine.max_in_flight,
+                                               engine.config.read_order, engine.config.hdd_concurrency)
+            linked = array(INDEX_TYPECODE, (index for index, nlink in enumerate(catalog.nlinks) if nlink > 1))
+            return {
+                'sizes': catalog.sizes,
+                'linked': linked,
+                'file_ids': [catalog.file_id(index) for index in linked],
+                'stats': {key: engine.stats[key] for key in ('total_files', 'processed', 'skipped',
+                                                             'total_size', 'errors')},
+            }
+
+        catalog = engine.catalog
+        if round_name.startswith('partial:'):
+            stage = task['stage']
+            config = engine.config
+            kind = f"{config.prefilter}:{stage['mode']}:{stage['block_size']}x{stage['blocks']}"
+            make_args = lambda index: (catalog.path(index), partial_hash_ranges(catalog.sizes[index], stage),
+                                       config.prefilter, engine.throttle.job_rate())
+            rows, hashes = array(INDEX_TYPECODE), []
+            for _, index, partial_hash, _ in engine.cached_hashes(
+                    calculate_partial_hash, ((None, index) for index in task['rows']), kind, make_args,
+                    stage['name']):
+                if partial_hash is not None:
+                    rows.append(index)
+                    hashes.append(partial_hash)
+            return {'rows': rows, 'hashes': hashes, 'errors': len(task['rows']) - len(rows)}
+
+        # Full hashes, plus the records the coordinator needs to report groups
+        digests = DigestTable()
+        for batch in engine.scheduler.batches(task['rows'], BATCH_SIZE):
+            engine.process_batch(batch, digests)
+        return {
+            'rows': digests.indexes,
+            'digests': digests.digests.hex(),
+            'width': digests.width,
+            'records': [[index, *catalog.record(index)] for index in list(digests.indexes) + task['records']],
+            'errors': len(task['rows']) - len(digests),
+        }
+
+
+class ShardCoordinator(ScanEngine):
+    """
+    Runs a sharded scan: hands out rounds to the workers and merges their results.
+
+    Behaves like a ScanEngine towards its caller: run() yields the same
+    events, and stats, stage_stats and summary() are filled the same way.
+    """
+
+    def __init__(self, config, work_dir, shards, local_workers=True):
+        """
+        Args:
+            config (ScanConfig): Settings of the scan; workers use them too
+            work_dir (str): Work directory shared with the workers
+            shards (int): Number of shards (workers)
+            local_workers (bool): Start the workers as local processes; if
+                False, they have to be started separately (ShardWorker.run),
+                e.g. on other hosts sharing work_dir
+
+        Raises:
+            ValueError: If work_dir is a non-empty directory of something else
+        """
+        claim_work_dir(work_dir)
+        super().__init__(config)
+        self.work_dir = work_dir
+        self.shards = shards
+        self.local_workers = local_workers
+        self.processes = []
+        self.stage_stats.pop('lockstep', None)  # Groups spread over shards are never compared in lockstep
+        self.rounds = ['walk'] + [f"partial:{stage['name']}" for stage in config.partial_stages] + ['full']
+
+    def _path(self, kind, round_name, shard):
+        return os.path.join(self.work_dir, kind, f"{round_name.replace(':', '-')}.{shard}")
+
+    def start_job(self):
+        """Reset the work directory claimed in __init__, publish the job and start local workers."""
+        for name in ('tasks', 'results'):
+            shutil.rmtree(os.path.join(self.work_dir, name), ignore_errors=True)
+            os.makedirs(os.path.join(self.work_dir, name))
+        for name in ('stop', 'job.json'):
+            if os.path.exists(os.path.join(self.work_dir, name)):
+                os.remove(os.path.join(self.work_dir, name))
+
+        # Workers keep no state of their own between jobs
+        settings = self.config.to_dict()
+        settings.update(use_cache=False, incremental=False, checkpoint_path=None, resume=False,
+                        results_path=None, metrics_path=None, shards=1, shard=0)
+        job = {'config': settings, 'shards': self.shards, 'rounds': self.rounds}
+        temp = os.path.join(self.work_dir, "job.json.tmp")
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(job, f, indent=2)
+        os.replace(temp, os.path.join(self.work_dir, "job.json"))
+
+        if self.local_workers:
+            context = multiprocessing.get_context('spawn')
+            self.processes = [context.Process(target=run_worker, args=(self.work_dir, shard, True),
+                                              name=f"shard-{shard}", daemon=True)
+                              for shard in range(self.shards)]
+            for process in self.processes:
+                process.start()
+
+    def exchange(self, round_name, tasks):
+        """
+        Hand out one round and collect the results of every shard.
+
+        Args:
+            round_name (str): Round of the job
+            tasks (list): Task of each shard
+
+        Yields:
+            ScanEvent: Progress while waiting
+
+        Returns:
+            list: Result of each shard, or None if the scan was stopped
+
+        Raises:
+            RuntimeError: If a worker failed
+        """
+        for shard, task in enumerate(tasks):
+            _write_atomic(self._path('tasks', round_name, shard), task)
+        results = [None] * self.shards
+        next_report = time.monotonic() + WAIT_REPORT
+        while any(result is None for result in results):
+            if not self.is_running:
+                return None
+            for shard in range(self.shards):
+                if results[shard] is not None:
+                    continue
+                path = self._path('results', round_name, shard)
+                if os.path.exists(f"{path}.err"):
+                    with open(f"{path}.err", encoding='utf-8') as f:
+                        raise RuntimeError(f"Shard {shard} failed in round {round_name}:\n{f.read()}")
+                if os.path.exists(path):
+                    results[shard] = _read(path)
+                elif self.processes and not self.processes[shard].is_alive():
+                    raise RuntimeError(f"Shard {shard} exited during round {round_name}")
+            if any(result is None for result in results):
+                if time.monotonic() >= next_report:
+                    waiting = [str(shard) for shard, result in enumerate(results) if result is None]
+                    yield ScanEvent('log', f"Waiting for shards {', '.join(waiting)} ({round_name})")
+                    next_report = time.monotonic() + WAIT_REPORT
+                time.sleep(POLL_INTERVAL)
+        return results
+
+    def _scan(self):
+        config = self.config
+        self.is_running = True
+        try:
+            if config.results_path:
+                self.results = ResultStore(config.results_path)
+                self.run_id = self.results.begin_run(config.roots, config.algorithm)
+            yield ScanEvent('log', f"Starting sharded scan in: {', '.join(config.roots)}")
+            yield ScanEvent('log', f"{self.shards} shards, work directory {self.work_dir} "
+                                   f"({'local worker processes' if self.local_workers else 'external workers'})")
+            self.start_job()
+
+            # Round 1: every shard walks its part; sizes are merged across shards
+            with self.metrics.stage('walk'):
+                walked = yield from self.exchange('walk', [{}] * self.shards)
+            if walked is None:
+                return
+            for result in walked:
+                for key, value in result['stats'].items():
+                    self.stats[key] += value
+            yield ScanEvent('log', f"Found {self.stats['total_files']} files in {self.shards} shards")
+            yield self._stats_event()
+
+            with self.metrics.stage('prune'):
+                aliases, links = self.collapse_shard_hardlinks(walked)
+                keys = self.prune_shard_sizes(walked, aliases)
+            yield ScanEvent('log', f"Size pruning skipped {self.stats['pruned']} files "
+                                   f"({format_size(self.stats['pruned_size'])} not read)")
+
+            # Partial rounds: keys grow by one partial hash per stage
+            for stage in config.partial_stages:
+                round_name = f"partial:{stage['name']}"
+                tasks = [{'stage': stage, 'rows': array(INDEX_TYPECODE)} for _ in range(self.shards)]
+                # Files the stage would read completely keep their key, see reads_whole_file
+                extended = {member: key for member, key in keys.items() if reads_whole_file(key[0], stage)}
+                for member in keys:
+                    if member not in extended:
+                        tasks[member[0]]['rows'].append(member[1])
+                with self.metrics.stage(round_name):
+                    results = yield from self.exchange(round_name, tasks)
+                if results is None:
+                    return
+                before = len(keys)
+                for shard, result in enumerate(results):
+                    self.stats['errors'] += result['errors']
+                    for row, partial_hash in zip(result['rows'], result['hashes']):
+                        extended[(shard, row)] = keys[(shard, row)] + (partial_hash,)
+                keys = self.drop_unique(extended, self.stage_stats[stage['name']], stage)
+                yield ScanEvent('log', f"Partial hash stage '{stage['name']}': {before} -> {len(keys)} candidates")
+
+            # Final round: full hashes of the remaining candidates
+            tasks = [{'rows': array(INDEX_TYPECODE), 'records': array(INDEX_TYPECODE)} for _ in range(self.shards)]
+            for shard, row in keys:
+                tasks[shard]['rows'].append(row)
+                for link_shard, link_row in links.get((shard, row), ()):
+                    tasks[link_shard]['records'].append(link_row)
+            yield ScanEvent('log', f"Hashing {len(keys)} candidate files...")
+            with self.metrics.stage('hash'):
+                results = yield from self.exchange('full', tasks)
+            if results is None:
+                return
+
+            yield ScanEvent('log', "\nAnalyzing potential duplicates...")
+            with self.metrics.stage('group'):
+                for group in self.merge_digests(results, links):
+                    if not self.is_running:
+                        return
+                    if self.results:
+                        self.results.add_group(self.run_id, group)
+                    yield ScanEvent('group', group)
+
+            if self.results:
+                self.results.finish_run(self.run_id, 'done', self.stats)
+            yield ScanEvent('done', dict(self.stats))
+        finally:
+            self.is_running = False
+            self.metrics.enter('teardown')
+            self.stop_workers()
+            if self.results:
+                self.results.finish_run(self.run_id, 'stopped', self.stats)
+                self.results.close()
+
+    def stop_workers(self):
+        """Ask the workers to exit and wait for local ones."""
+        try:
+            open(os.path.join(self.work_dir, "stop"), 'w').close()
+        except OSError as e:
+            logger.error(f"Error stopping shard workers in {self.work_dir}: {str(e)}")
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    def collapse_shard_hardlinks(self, walked):
+        """
+        Find files that are hardlinks of the same file, in any shard.
+
+        Args:
+            walked (list): Walk results of every shard
+
+        Returns:
+            tuple: (set of (shard, row) of the extra links, dict mapping the
+            (shard, row) of the first link to the (shard, row) of the others)
+        """
+        primaries = {}
+        links = {}
+        for shard, result in enumerate(walked):
+            for row, file_id in zip(result['linked'], result['file_ids']):
+                primary = primaries.setdefault(tuple(file_id), (shard, row))
+                if primary != (shard, row):
+                    links.setdefault(primary, []).append((shard, row))
+        aliases = {alias for others in links.values() for alias in others}
+        self.stats['linked'] = len(aliases)
+        return aliases, links
+
+    def prune_shard_sizes(self, walked, aliases):
+        """
+        Drop files whose size is unique across all shards.
+
+        Args:
+            walked (list): Walk results of every shard
+            aliases (set): (shard, row) of extra hardlinks, ignored
+
+        Returns:
+            dict: (shard, row) -> (size,) for every remaining candidate
+        """
+        counts = defaultdict(int)
+        for shard, result in enumerate(walked):
+            for row, size in enumerate(result['sizes']):
+                if (shard, row) not in aliases:
+                    counts[size] += 1
+
+        keys = {}
+        for shard, result in enumerate(walked):
+            for row, size in enumerate(result['sizes']):
+                if (shard, row) in aliases:
+                    continue
+                if counts[size] > 1 or not self.config.prune_sizes:
+                    keys[(shard, row)] = (size,)
+                else:
+                    self.stats['pruned'] += 1
+                    self.stats['pruned_size'] += size
+        return keys
+
+    def drop_unique(self, keys, stats, stage):
+        """
+        Drop candidates whose key (size and partial hashes so far) no other file has.
+
+        Args:
+            keys (dict): (shard, row) -> key tuple
+            stats (dict): Counters of the partial stage
+            stage (dict): Partial hashing stage
+
+        Returns:
+            dict: The entries of keys that still collide
+        """
+        counts = defaultdict(int)
+        for key in keys.values():
+            counts[key] += 1
+        remaining = {}
+        for member, key in keys.items():
+            size = key[0]
+            read = 0 if reads_whole_file(size, stage) else sum(length for _, length in partial_hash_ranges(size, stage))
+            stats['bytes_read'] += read
+            if counts[key] > 1:
+                remaining[member] = key
+            else:
+                stats['eliminated'] += 1
+                stats['bytes_avoided'] += size - read
+        return remaining
+
+    def merge_digests(self, results, links):
+        """
+        Group the fully hashed files of all shards by size and digest.
+
+        Args:
+            results (list): Full-hash results of every shard
+            links (dict): (shard, row) of a file -> (shard, row) of its other hardlinks
+
+        Yields:
+            DuplicateGroup: Each set of identical files, newest first
+        """
+        groups = defaultdict(list)
+        for shard, result in enumerate(results):
+            result['digests'] = bytes.fromhex(result['digests'])
+            result['records'] = {row: FileRecord(*fields) for row, *fields in result['records']}
+            self.stats['errors'] += result['errors']
+            width = result['width']
+            for position, row in enumerate(result['rows']):
+                digest = result['digests'][position * width:(position + 1) * width]
+                groups[(result['records'][row].size, digest)].append((shard, row))
+            self.stats['hashed'] += len(result['rows'])
+
+        for (size, digest), files in groups.items():
+            if len(files) < 2:
+                continue
+            group_files, group_links = distinct_files([results[shard]['records'][row] for shard, row in files])
+            if len(group_files) < 2:
+                continue
+            group_links += [results[link_shard]['records'][link_row]
+                            for file in files for link_shard, link_row in links.get(file, ())]
+            group_files.sort(key=lambda record: record.mtime_ns, reverse=True)
+            group = DuplicateGroup(size, digest.hex(), self.config.algorithm, group_files, group_links)
+            self.stats['duplicates'] += 1
+            self.stats['duplicate_files'] += len(group.duplicate_files)
+            self.stats['reclaimable'] += group.reclaimable
+            yield group
+
+
+def run_worker(work_dir, shard, ignore_interrupt=False):
+    """
+    Entry point of a worker process.
+
+    Args:
+        work_dir (str): Work directory shared with the coordinator
+        shard (int): Shard to work on
+        ignore_interrupt (bool): Ignore Ctrl-C, for local workers that the
+            coordinator stops through the work directory
+
+    Returns:
+        bool: True if the job was completed
+    """
+    if ignore_interrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    return ShardWorker(work_dir, shard).run()
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from action_plan import ActionRunner, ACTION_MODES, clone_file, rollback_journal
+from scan_engine import ScanConfig, ScanEngine
+
+CONTENT = b'duplicate ' * 1000
+
+
+@pytest.fixture
+def group(tmp_path):
+    """A scanned group of three identical files."""
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    for name in ("a", "b", "c"):
+        (tree / name).write_bytes(CONTENT)
+    groups = [event.data for event in ScanEngine(ScanConfig(str(tree), use_cache=False, workers=1)).run()
+              if event.kind == 'group']
+    assert len(groups) == 1
+    return groups[0]
+
+
+@pytest.fixture(params=ACTION_MODES)
+def mode(request, tmp_path):
+    if request.param == 'reflink':
+        (tmp_path / "probe").write_bytes(b'probe')
+        try:
+            clone_file(str(tmp_path / "probe"), str(tmp_path / "probe.clone"))
+        except OSError:
+            pytest.skip("the file system of the test directory cannot clone files")
+    return request.param
+
+
+def inodes(group):
+    return {record.path: os.stat(record.path).st_ino for record in group.files}
+
+
+def left_over(tmp_path):
+    return [name for name in os.listdir(tmp_path / "tree") if '.dedup-' in name]
+
+
+def test_apply(tmp_path, group, mode):
+    runner = ActionRunner(mode, journal_dir=str(tmp_path / "journals"))
+    assert runner.apply_group(group)
+    result = runner.finish()
+
+    keep = group.keep.path
+    for record in group.duplicates:
+        if mode == 'delete':
+            assert not os.path.lexists(record.path)
+        else:
+            assert open(record.path, 'rb').read() == CONTENT
+            assert os.path.samefile(keep, record.path) == (mode == 'hardlink')
+    assert result['deleted' if mode == 'delete' else 'linked'] == 2
+    assert result['errors'] == 0
+    assert open(keep, 'rb').read() == CONTENT
+    assert left_over(tmp_path) == []
+    assert os.listdir(tmp_path / "journals") == []
+
+
+# Replacements are faked, so reflink mode is tested without clone support
+@pytest.mark.parametrize('mode', ACTION_MODES)
+def test_verify_mismatch_restores_group(tmp_path, group, mode, monkeypatch):
+    before = inodes(group)
+
+    def corrupt(self, keep, filepath, backup, temp):
+        # Same size, other content, swapped in like a real replacement
+        with open(temp, 'wb') as f:
+            f.write(CONTENT.upper())
+        os.replace(temp, filepath)
+
+    monkeypatch.setattr(ActionRunner, '_replace', corrupt)
+    runner = ActionRunner(mode, journal_dir=str(tmp_path / "journals"))
+    assert not runner.apply_group(group)
+    result = runner.finish()
+
+    assert result['errors'] == 1
+    assert result['rolled_back'] == 1
+    assert inodes(group) == before
+    assert all(open(record.path, 'rb').read() == CONTENT for record in group.files)
+    assert left_over(tmp_path) == []
+
+
+def test_rollback_journal_of_interrupted_run(tmp_path, group, mode):
+    before = inodes(group)
+    runner = ActionRunner(mode, journal_dir=str(tmp_path / "journals"))
+    assert runner.apply_group(group)
+    # The run stops without finish(), e.g. a crash: the journal and backups remain
+    runner.journal.close()
+
+    messages = []
+    assert rollback_journal(runner.journal_path, messages.append) == 2
+    assert len(messages) == 2
+    assert inodes(group) == before
+    assert all(open(record.path, 'rb').read() == CONTENT for record in group.files)
+    assert left_over(tmp_path) == []
+    assert not os.path.exists(runner.journal_path)
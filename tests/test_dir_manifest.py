@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+from dir_manifest import DirectoryManifest
+from file_walker import walk_files
+from scan_engine import ScanConfig, ScanEngine
+
+# Linux file names are bytes; macOS and Windows reject names that are not valid UTF-8
+pytestmark = pytest.mark.skipif(sys.platform in ('win32', 'darwin'),
+                                reason="needs file names that are not valid UTF-8")
+
+OLD_MTIME = 1_000_000_000  # Far enough in the past for listings to be trusted
+
+
+def make_tree(root):
+    """Two directories, one with a name that is not valid UTF-8, holding the same files."""
+    for name in (b'bad\xffdir', b'ok'):
+        directory = os.path.join(os.fsencode(root), name)
+        os.makedirs(directory)
+        for i in range(3):
+            with open(os.path.join(directory, b'f%d' % i), 'wb') as f:
+                f.write(b'%d' % i * 1000)
+    for directory in (os.path.join(os.fsencode(root), name) for name in (b'bad\xffdir', b'ok', b'')):
+        os.utime(directory, (OLD_MTIME, OLD_MTIME))
+
+
+def test_walk_reuses_non_utf8_directory(tmp_path):
+    make_tree(tmp_path)
+    manifest_path = str(tmp_path.parent / "manifest.db")
+
+    manifest = DirectoryManifest(manifest_path)
+    first = sorted(record.path for record in walk_files(str(tmp_path), 1, manifest=manifest))
+    manifest.prune([str(tmp_path)])
+    manifest.close()
+
+    manifest = DirectoryManifest(manifest_path)
+    second = sorted(record.path for record in walk_files(str(tmp_path), 4, manifest=manifest))
+    manifest.close()
+
+    assert len(first) == 6
+    assert second == first
+    assert manifest.stats['reused'] == 3
+    assert manifest.stats['listed'] == 0
+
+
+@pytest.mark.parametrize('walk_workers', [1, 8])
+def test_incremental_scan_with_non_utf8_directory(tmp_path, walk_workers):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    make_tree(tree)
+    config = ScanConfig(str(tree), use_cache=False, incremental=True, walk_workers=walk_workers,
+                        manifest_path=str(tmp_path / "manifest.db"))
+
+    for _ in range(2):
+        groups = [event.data for event in ScanEngine(config).run() if event.kind == 'group']
+        assert len(groups) == 3
+        assert all(len(group.files) == 2 for group in groups)
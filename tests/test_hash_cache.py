@@ -0,0 +1,52 @@
+import os
+
+from hash_cache import HashCache
+from scan_engine import ScanConfig, ScanEngine
+
+
+def scan(tree, cache_path):
+    engine = ScanEngine(ScanConfig(str(tree), cache_path=str(cache_path), workers=1))
+    groups = [event.data for event in engine.run() if event.kind == 'group']
+    return engine, groups
+
+
+def test_warm_rescan_reads_nothing_after_lockstep(tmp_path):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    # Same size, edges and samples; the third file differs where no partial stage reads
+    content = bytearray(os.urandom(4 * 1024 * 1024))
+    (tree / "a").write_bytes(content)
+    (tree / "b").write_bytes(content)
+    content[3_000_003] ^= 0xff
+    (tree / "c").write_bytes(content)
+    cache_path = tmp_path / "cache.db"
+
+    cold, cold_groups = scan(tree, cache_path)
+    warm, warm_groups = scan(tree, cache_path)
+
+    assert cold.stage_stats['lockstep']['eliminated'] == 1
+    assert [group.files for group in warm_groups] == [group.files for group in cold_groups]
+    assert warm.stage_stats['lockstep'] == {'eliminated': 1, 'bytes_read': 0,
+                                            'bytes_avoided': 3 * len(content)}
+    assert warm.cache.stats['misses'] == 0
+    assert 'bytes_hashed' not in warm.metrics.counters
+
+    # A changed file is read again, the others still come from the cache
+    os.utime(tree / "c", ns=(1, 1))
+    changed, _ = scan(tree, cache_path)
+    assert changed.metrics.counters['bytes_hashed'] == len(content)
+
+
+def test_evicts_least_recently_used_beyond_max_bytes(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = HashCache(path, max_bytes=256 * 1024)
+    for inode in range(20000):
+        cache.put((1, inode, 100, 5), 'ab' * 32)
+    cache.close()
+
+    assert cache.stats['evicted'] > 0
+    assert os.path.getsize(path) < 512 * 1024
+    cache = HashCache(path)
+    assert cache.get((1, 19999, 100, 5)) == 'ab' * 32
+    assert cache.get((1, 0, 100, 5)) is None
+    cache.close()
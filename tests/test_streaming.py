@@ -0,0 +1,51 @@
+import json
+
+import scan_engine
+from result_writer import ResultWriter
+from scan_engine import ScanConfig, ScanEngine
+
+GROUPS = 8
+
+
+def make_tree(root, copies):
+    """GROUPS sets of identical files, each set with its own size."""
+    for group in range(GROUPS):
+        for copy in range(copies):
+            (root / f"g{group}_{copy}.bin").write_bytes(b'%d' % group * (1000 + group))
+
+
+def test_stopped_scan_keeps_groups_hashed_so_far(tmp_path, monkeypatch):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    make_tree(tree, 4)
+    # Groups of four files are hashed, a few files per batch
+    monkeypatch.setattr(scan_engine, 'BATCH_SIZE', 4)
+    engine = ScanEngine(ScanConfig(str(tree), use_cache=False, workers=1, lockstep_max_files=3))
+
+    kinds = []
+    with ResultWriter(str(tmp_path / "groups.ndjson")) as writer:
+        for event in engine.run():
+            kinds.append(event.kind)
+            if event.kind == 'group':
+                writer.write(event.data)
+                engine.stop()
+
+    with open(tmp_path / "groups.ndjson") as f:
+        reported = [json.loads(line) for line in f]
+    assert 'done' not in kinds
+    assert engine.stats['hashed'] < GROUPS * 4
+    assert len(reported) == kinds.count('group') >= 1
+    assert all(len(group['duplicates']) == 3 for group in reported)
+
+
+def test_lockstep_groups_reported_before_hashing(tmp_path):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    make_tree(tree, 2)
+    engine = ScanEngine(ScanConfig(str(tree), use_cache=False, workers=1))
+
+    events = list(engine.run())
+    hashing = next(position for position, event in enumerate(events)
+                   if event.kind == 'log' and event.data.startswith("Hashing "))
+    assert [event.kind for event in events[:hashing]].count('group') == GROUPS
+    assert [event.kind for event in events].count('group') == GROUPS
@@ -0,0 +1,205 @@
+"""
+Resource throttling for Deduplicationator 3000.
+
+Scans often run on file servers that have to keep serving their users. A
+ResourceThrottle sits in front of the hashing pool and limits how hard a
+scan may push the machine:
+
+- a cap on read bandwidth, split evenly over the most jobs that can be in
+  flight and enforced by pacing each read;
+- a cap on open files, i.e. on hashing jobs in flight;
+- a cap on the CPU share of the scan (its own process plus pool workers);
+- adaptive backoff while the system load or the busiest disk's utilization
+  is above a threshold: the number of jobs in flight is halved on every
+  check that finds the system busy, down to a single job so the scan
+  always finishes, and grows back by one per quiet check.
+
+The CPU and disk checks need psutil; without it only the load average
+(where the platform has one) and the fixed caps are applied.
+"""
+
+import os
+import time
+import logging
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+CHECK_INTERVAL = 1.0  # Seconds between system load samples
+BUSY_LOAD = 1.0       # Load per CPU treated as busy by the GUI's "back off" option
+BUSY_DISK_PERCENT = 80  # Disk utilization treated as busy by the same option
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceThrottle:
+    """Decides how many hashing jobs may be in flight and how fast they may read."""
+
+    def __init__(self, max_read_rate=0, max_open_files=0, max_cpu_percent=0,
+                 max_load=0, max_disk_busy=0, interval=CHECK_INTERVAL):
+        """
+        All caps are off when 0.
+
+        Args:
+            max_read_rate (int): Bytes per second read by the whole scan
+            max_open_files (int): Files open for hashing at the same time
+            max_cpu_percent (float): Share of all CPUs the scan may use, in percent
+            max_load (float): 1-minute load average per CPU above which the scan backs off
+            max_disk_busy (float): Disk utilization in percent above which the scan backs off
+            interval (float): Seconds between system samples
+        """
+        self.max_read_rate = max_read_rate
+        self.max_open_files = max_open_files
+        self.max_cpu_percent = max_cpu_percent
+        self.max_load = max_load
+        self.max_disk_busy = max_disk_busy
+        self.interval = interval
+        self.cpu_count = os.cpu_count() or 1
+
+        self.ceiling = None        # Jobs in flight allowed by the caller
+        self.allowed = None        # Current adaptive limit
+        self.readers = 1           # Most jobs that can be in flight, sharing max_read_rate
+        self.reason = None         # Why the scan is backing off, None if it is not
+        self.backoffs = 0          # Checks that found the system busy
+        self._last_check = 0.0
+        self._process = psutil.Process() if psutil else None
+        self._children = {}        # pid -> psutil.Process of pool workers
+        self._disk_busy = None     # (monotonic time, {disk: busy_time ms})
+
+        if psutil is None and (max_cpu_percent or max_disk_busy):
+            logger.warning("psutil is not installed; CPU and disk utilization caps are ignored")
+
+    @property
+    def enabled(self):
+        """True if any cap is set."""
+        return bool(self.max_read_rate or self.max_open_files or self.max_cpu_percent
+                    or self.max_load or self.max_disk_busy)
+
+    def limit(self, max_in_flight):
+        """
+        Get the number of jobs that may be in flight right now.
+
+        Samples the system at most once per interval.
+
+        Args:
+            max_in_flight (int): Limit the caller would use without a throttle
+
+        Returns:
+            int: Jobs allowed in flight, at least 1
+        """
+        self.ceiling = min(max_in_flight, self.max_open_files) if self.max_open_files else max_in_flight
+        if self.allowed is None:
+            self.allowed = self.ceiling
+        now = time.monotonic()
+        if now - self._last_check >= self.interval:
+            self._last_check = now
+            self._adjust()
+        return min(self.allowed, self.ceiling)
+
+    def _adjust(self):
+        reason = self._busy()
+        if reason:
+            self.backoffs += 1
+            self.allowed = max(1, min(self.allowed, self.ceiling) // 2)
+        else:
+            self.allowed = min(self.ceiling, self.allowed + 1)
+        if reason != self.reason:
+            logger.info(f"Throttle: {reason or 'system quiet again'}")
+        self.reason = reason
+
+    def _busy(self):
+        """Reason to back off, or None if the system has room."""
+        if self.max_load and hasattr(os, 'getloadavg'):
+            load = os.getloadavg()[0] / self.cpu_count
+            if load > self.max_load:
+                return f"load {load:.2f} per CPU"
+        if self.max_cpu_percent and self._process:
+            cpu = self._cpu_percent()
+            if cpu > self.max_cpu_percent:
+                return f"CPU {cpu:.0f}%"
+        if self.max_disk_busy and psutil:
+            busy = self._busiest_disk()
+            if busy is not None and busy > self.max_disk_busy:
+                return f"disk {busy:.0f}% busy"
+        return None
+
+    def _cpu_percent(self):
+        """CPU use of the scan and its worker processes since the last sample, as a share of all CPUs."""
+        try:
+            total = self._process.cpu_percent(None)
+            children = {}
+            for child in self._process.children(recursive=True):
+                # Reuse Process objects; cpu_percent() compares against their previous call
+                child = self._children.get(child.pid, child)
+                children[child.pid] = child
+                total += child.cpu_percent(None)
+            self._children = children
+        except psutil.Error:
+            return 0.0
+        return total / self.cpu_count
+
+    def _busiest_disk(self):
+        """Utilization in percent of the busiest disk since the last sample (Linux and BSD only)."""
+        try:
+            counters = psutil.disk_io_counters(perdisk=True)
+        except (psutil.Error, RuntimeError):
+            return None
+        now = time.monotonic()
+        busy = {disk: counter.busy_time for disk, counter in (counters or {}).items()
+                if hasattr(counter, 'busy_time')}
+        previous, self._disk_busy = self._disk_busy, (now, busy)
+        if previous is None or not busy:
+            return None
+        elapsed_ms = (now - previous[0]) * 1000
+        if elapsed_ms <= 0:
+            return None
+        return max((busy[disk] - previous[1].get(disk, busy[disk])) / elapsed_ms * 100 for disk in busy)
+
+    def job_rate(self):
+        """
+        Read rate for one job about to be submitted.
+
+        Returns:
+            float: Bytes per second, 0 for unlimited
+        """
+        if not self.max_read_rate:
+            return 0
+        return self.max_read_rate / max(1, self.readers)
+
+    def status(self):
+        """
+        Describe the throttle state for the status bar.
+
+        Returns:
+            str: Short state, e.g. 'backing off (load 3.20 per CPU), 2/16 jobs'
+        """
+        if not self.enabled:
+            return "off"
+        if self.allowed is None:
+            return "idle"
+        jobs = f"{min(self.allowed, self.ceiling)}/{self.ceiling} jobs"
+        if self.reason:
+            return f"backing off ({self.reason}), {jobs}"
+        return f"normal, {jobs}"
+
+    def describe(self):
+        """
+        Summarize the configured caps for the progress log.
+
+        Returns:
+            str: Enabled caps
+        """
+        caps = []
+        if self.max_read_rate:
+            caps.append(f"{self.max_read_rate / (1024 * 1024):.1f}MB/s reads")
+        if self.max_open_files:
+            caps.append(f"{self.max_open_files} open files")
+        if self.max_cpu_percent:
+            caps.append(f"{self.max_cpu_percent:g}% CPU")
+        if self.max_load:
+            caps.append(f"back off above load {self.max_load:g} per CPU")
+        if self.max_disk_busy:
+            caps.append(f"back off above {self.max_disk_busy:g}% disk utilization")
+        return "Throttle: " + (", ".join(caps) if caps else "off")
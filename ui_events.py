@@ -0,0 +1,106 @@
+"""
+Thread-safe UI update pipeline for the Deduplicationator 3000 GUIs.
+
+Tk widgets may only be touched from the main thread, and redrawing for
+every message slows a scan down to the speed of the UI. Worker threads
+therefore only put events into a CoalescingEventQueue; the Tk main loop
+drains it on a fixed after() tick, keeps just the latest counters and
+renders log lines in one capped batch per tick.
+"""
+
+import queue
+from scan_engine import ScanEvent
+
+UI_TICK_MS = 100          # How often the GUI drains the queue
+MAX_LINES_PER_TICK = 200  # Log lines rendered per tick; the rest are summarized
+
+
+class CoalescingEventQueue:
+    """
+    Queue of ScanEvents drained on the Tk thread.
+
+    Handlers are registered per event kind. 'log' handlers receive a list
+    of lines, 'stats' handlers only the newest stats of each tick; every
+    other kind is delivered one event at a time, in order.
+    """
+
+    def __init__(self, root, handlers, interval_ms=UI_TICK_MS, max_lines=MAX_LINES_PER_TICK):
+        """
+        Args:
+            root (tk.Tk): Window whose after() drives the drain tick
+            handlers (dict): Event kind -> callable run on the Tk thread
+            interval_ms (int): Drain interval in milliseconds
+            max_lines (int): Maximum log lines passed to the 'log' handler per tick
+        """
+        self.root = root
+        self.handlers = handlers
+        self.interval_ms = interval_ms
+        self.max_lines = max_lines
+        self.events = queue.SimpleQueue()
+        self.after_id = None
+        self.running = False
+
+    def put(self, kind, data=None):
+        """Queue an event. Safe to call from any thread."""
+        self.events.put(ScanEvent(kind, data))
+
+    def start(self):
+        """Start draining on the Tk thread."""
+        if not self.running:
+            self.running = True
+            self.after_id = self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        """Drain what is left and stop the tick. May be called from a handler."""
+        self.running = False
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        self.drain()
+
+    def _tick(self):
+        self.after_id = None
+        self.drain()
+        if self.running:
+            self.after_id = self.root.after(self.interval_ms, self._tick)
+
+    def drain(self):
+        """Deliver every queued event, coalescing log lines and stats."""
+        lines = []
+        dropped = 0
+        stats = None
+
+        def flush():
+            nonlocal lines, dropped, stats
+            if dropped:
+                lines.append(f"... {dropped} more messages not shown")
+            if lines and 'log' in self.handlers:
+                self.handlers['log'](lines)
+            if stats is not None and 'stats' in self.handlers:
+                self.handlers['stats'](stats)
+            lines = []
+            dropped = 0
+            stats = None
+
+        # Only take what is queued now so a fast producer cannot starve the UI
+        for _ in range(self.events.qsize()):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event.kind == 'log':
+                if len(lines) < self.max_lines:
+                    lines.append(event.data)
+                else:
+                    dropped += 1
+            elif event.kind == 'stats':
+                stats = event.data
+            else:
+                # Keep log output and counters in order with the events around them
+                flush()
+                handler = self.handlers.get(event.kind)
+                if handler:
+                    handler(event.data)
+
+        flush()